@@ -0,0 +1,391 @@
+"""
+Campaign-wide maintenance commands.
+
+Run from this directory as
+    python campaign.py COMMAND [options]
+See python campaign.py -h for the available commands.
+"""
+
+# standard library modules
+import argparse
+import concurrent.futures
+import os
+import time
+
+# local modules
+from colarunscripts import archive, artifacts, dedupe, ledger, locking, manifest
+from colarunscripts import cfgSidecar, cfunLayout, recover, shards
+from colarunscripts import directories as dirs
+from colarunscripts.parameters import Load
+
+
+def Reconcile(inputArgs: dict, *args, **kwargs):
+    """Rebuilds the artifact ledger from what is on disk."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    artifacts.Reconcile(parameters, inputArgs["jobs"])
+
+
+def Status(inputArgs: dict, *args, **kwargs):
+    """Prints the number of artifacts recorded in the ledger."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    print(f'{"kappa":>8} {"kind":>6} {"count":>10} {"configs":>8}')
+    for kappa, kind, count, numConfigs in ledger.Status(parameters):
+        print(f"{kappa:>8} {kind:>6} {count:>10} {numConfigs:>8}")
+
+
+def Manifest(inputArgs: dict, *args, **kwargs):
+    """Writes the manifest of every expected output file."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    startTime = time.perf_counter()
+    campaignManifest = manifest.Build(parameters)
+    buildTime = time.perf_counter() - startTime
+    campaignManifest.save(inputArgs["output"])
+
+    kinds = campaignManifest.columns["kind"]
+    for i, kind in enumerate(manifest.KINDS):
+        print(f"{kind:>6}: {kinds.count(i)}")
+    print(
+        f"{len(campaignManifest)} rows, {len(campaignManifest.strings)} strings, "
+        f'{os.path.getsize(inputArgs["output"])} bytes written to '
+        f'{inputArgs["output"]} (built in {buildTime:.2f}s)'
+    )
+
+
+def Dedupe(inputArgs: dict, *args, **kwargs):
+    """Prints the correlation functions reused from other campaigns."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    print(f'{"campaign":>30} {"reused":>10} {"GPU hours saved":>16}')
+    totalReused, totalHours = 0, 0.0
+    for campaign, reused, hours in dedupe.Saved(parameters):
+        print(f"{campaign:>30} {reused:>10} {hours:>16.2f}")
+        totalReused += reused
+        totalHours += hours
+    print(f'{"total":>30} {totalReused:>10} {totalHours:>16.2f}')
+
+
+def SweepLocks(inputArgs: dict, *args, **kwargs):
+    """Clears stale locks on the cfun tars of the campaign."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    directories = parameters["directories"]
+    outputDir = directories["baseOutputDir"] + directories["runIdentifier"]
+    lease = parameters["runValues"].get("lockLease", locking.LEASE)
+
+    counts = locking.Sweep(outputDir, lease, inputArgs["dry_run"])
+    print(
+        f'{counts["free"]} free, {counts["held"]} held, {counts["stale"]} stale, '
+        f'{counts["cleared"]} left behind by dead jobs'
+    )
+    if inputArgs["dry_run"] is True and counts["stale"] > 0:
+        print("Run again without --dry-run to clear the stale locks")
+
+
+def Compact(inputArgs: dict, *args, **kwargs):
+    """
+    Merges the shard tars of the campaign into the canonical tars, and
+    compacts the ID and member sidecars of the tars.
+    """
+
+    parameters = Load(inputArgs["parametersfile"])
+    directories = parameters["directories"]
+    outputDir = directories["baseOutputDir"] + directories["runIdentifier"]
+    timeout = parameters["runValues"].get("lockTimeout", locking.TIMEOUT)
+    lease = parameters["runValues"].get("lockLease", locking.LEASE)
+
+    tarSet = set()
+    for root, dirNames, fileNames in os.walk(outputDir):
+        if root.endswith(shards.SUFFIX):
+            continue
+        for name in dirNames:
+            if name.endswith(shards.SUFFIX):
+                tarSet.add(os.path.join(root, name[: -len(shards.SUFFIX)]))
+        for name in fileNames:
+            if name.endswith(cfgSidecar.IDS):
+                tarSet.add(os.path.join(root, name[: -len(cfgSidecar.IDS)]))
+    tarList = sorted(tarSet)
+
+    totalShards, totalMembers = 0, 0
+    with concurrent.futures.ProcessPoolExecutor(inputArgs["jobs"]) as executor:
+        results = executor.map(
+            shards.Compact, tarList, [timeout] * len(tarList), [lease] * len(tarList)
+        )
+        for tarPath, (numShards, numMembers) in zip(tarList, results):
+            if numShards > 0:
+                print(f"{tarPath}: {numShards} shards, {numMembers} members merged")
+            totalShards += numShards
+            totalMembers += numMembers
+    print(
+        f"{totalShards} shards merged into {len(tarList)} tars, {totalMembers} members"
+    )
+
+
+def _MigrateSidecars(tarPath, timeout, lease, *args, **kwargs):
+    """Converts the text sidecars of one tar, under its lock."""
+
+    try:
+        with locking.Locked(tarPath, timeout, lease=lease):
+            return cfgSidecar.Migrate(tarPath)
+    except locking.LockTimeout:
+        print(f"Could not lock {tarPath} in {timeout}s, leaving its sidecars")
+        return None
+
+
+def MigrateSidecars(inputArgs: dict, *args, **kwargs):
+    """Converts the text cfglist and info files of the campaign's tars."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    directories = parameters["directories"]
+    outputDir = directories["baseOutputDir"] + directories["runIdentifier"]
+    timeout = parameters["runValues"].get("lockTimeout", locking.TIMEOUT)
+    lease = parameters["runValues"].get("lockLease", locking.LEASE)
+
+    # Shards are converted as they are merged by compact
+    tarSet = set()
+    for root, _, fileNames in os.walk(outputDir):
+        if root.endswith(shards.SUFFIX):
+            continue
+        for name in fileNames:
+            for suffix in cfgSidecar.LEGACY:
+                if name.endswith(suffix):
+                    tarSet.add(os.path.join(root, name[: -len(suffix)]))
+    tarList = sorted(tarSet)
+    print(f"{len(tarList)} tars with text sidecars found")
+    if inputArgs["dry_run"] is True:
+        return
+
+    numIDs, numMembers, numTars = 0, 0, 0
+    n = len(tarList)
+    with concurrent.futures.ProcessPoolExecutor(inputArgs["jobs"]) as executor:
+        results = executor.map(_MigrateSidecars, tarList, [timeout] * n, [lease] * n)
+        for migrated in results:
+            if migrated is None:
+                continue
+            numTars += 1
+            numIDs += migrated[0]
+            numMembers += migrated[1]
+    print(f"{numTars} tars converted, {numIDs} IDs and {numMembers} members")
+
+
+def Recover(inputArgs: dict, *args, **kwargs):
+    """Puts cfuns left loose by failed or timed out jobs into their tars."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    runValues = parameters["runValues"]
+    timeout = runValues.get("lockTimeout", locking.TIMEOUT)
+    lease = runValues.get("lockLease", locking.LEASE)
+    codec = archive.Codec(parameters)
+
+    # Default age leaves alone anything a running job may still tar itself
+    minAge = inputArgs["min_age"]
+    if minAge is None:
+        minAge = timeout + lease
+
+    orphans, skipped = recover.Orphans(parameters, minAge)
+    tarList = list(orphans)
+    print(
+        f"{sum(len(cfuns) for cfuns in orphans.values())} loose cfuns of "
+        f"{len(tarList)} tars found, {skipped} newer than {minAge:.0f}s left alone"
+    )
+
+    totals = {"added": 0, "duplicates": 0, "gone": 0}
+    n = len(tarList)
+    with concurrent.futures.ProcessPoolExecutor(inputArgs["jobs"]) as executor:
+        results = executor.map(
+            recover.Ingest,
+            tarList,
+            [orphans[tarPath] for tarPath in tarList],
+            [timeout] * n,
+            [lease] * n,
+            [codec] * n,
+            [inputArgs["dry_run"]] * n,
+        )
+        for counts in results:
+            for key in totals:
+                totals[key] += counts[key]
+    verb = "would be" if inputArgs["dry_run"] else "were"
+    print(
+        f'{totals["added"]} cfuns {verb} added to their tars, '
+        f'{totals["duplicates"]} already tarred {verb} deleted, '
+        f'{totals["gone"]} were tarred by running jobs meanwhile'
+    )
+
+
+def MigrateLayout(inputArgs: dict, *args, **kwargs):
+    """Moves the loose cfuns of the campaign into the current cfunLayout."""
+
+    parameters = Load(inputArgs["parametersfile"])
+    runValues = parameters["runValues"]
+    timeout = runValues.get("lockTimeout", locking.TIMEOUT)
+    lease = runValues.get("lockLease", locking.LEASE)
+
+    # As for recover, anything a running job may still tar itself is left
+    minAge = inputArgs["min_age"]
+    if minAge is None:
+        minAge = timeout + lease
+
+    moves, skipped = cfunLayout.Moves(parameters, minAge)
+    print(
+        f"{len(moves)} loose cfuns not in the {dirs.CfunLayout(parameters)} layout "
+        f"found, {skipped} newer than {minAge:.0f}s left alone"
+    )
+    counts = cfunLayout.Migrate(moves, inputArgs["dry_run"])
+    verb = "would be" if inputArgs["dry_run"] else "were"
+    print(
+        f'{counts["moved"]} cfuns {verb} moved, {counts["duplicates"]} already in '
+        f'place {verb} deleted, {counts["conflicts"]} differing from the cfun in '
+        f"place were left"
+    )
+
+
+def Input():
+
+    # Setting up the parser
+    parser = argparse.ArgumentParser(
+        description="Campaign-wide maintenance of eigenmodes, propagators and correlation functions."
+    )
+    parser.add_argument(
+        "-p",
+        "--parametersfile",
+        help="The parameters file to use. Default is ./parameters.yml.",
+        default="./parameters.yml",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reconcile = subparsers.add_parser(
+        "reconcile", help="Rebuild the artifact ledger from disk."
+    )
+    reconcile.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to check configurations with. Default is 1.",
+        default=1,
+        type=int,
+    )
+    reconcile.set_defaults(function=Reconcile)
+
+    status = subparsers.add_parser(
+        "status", help="Print the number of artifacts recorded in the ledger."
+    )
+    status.set_defaults(function=Status)
+
+    manifestParser = subparsers.add_parser(
+        "manifest", help="Write the manifest of every expected output file."
+    )
+    manifestParser.add_argument(
+        "-o",
+        "--output",
+        help="The file to write the manifest to. Default is ./manifest.bin.",
+        default="./manifest.bin",
+    )
+    manifestParser.set_defaults(function=Manifest)
+
+    dedupeParser = subparsers.add_parser(
+        "dedupe",
+        help="Print the correlation functions reused from other campaigns and the GPU hours saved.",
+    )
+    dedupeParser.set_defaults(function=Dedupe)
+
+    sweepParser = subparsers.add_parser(
+        "sweeplocks",
+        help="Clear locks on cfun tars left by dead jobs, or held from other nodes past their lease.",
+    )
+    sweepParser.add_argument(
+        "-n",
+        "--dry-run",
+        help="Only report the stale locks.",
+        action="store_true",
+    )
+    sweepParser.set_defaults(function=SweepLocks)
+
+    compact = subparsers.add_parser(
+        "compact",
+        help="Merge the shard tars of jobs into the canonical tars and compact their sidecars.",
+    )
+    compact.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to merge tars with. Default is 1.",
+        default=1,
+        type=int,
+    )
+    compact.set_defaults(function=Compact)
+
+    migrateParser = subparsers.add_parser(
+        "migrate-sidecars",
+        help="Convert the text cfglist and info files of the cfun tars to ID and member sidecars.",
+    )
+    migrateParser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to convert tars with. Default is 1.",
+        default=1,
+        type=int,
+    )
+    migrateParser.add_argument(
+        "-n",
+        "--dry-run",
+        help="Only report the tars to convert.",
+        action="store_true",
+    )
+    migrateParser.set_defaults(function=MigrateSidecars)
+
+    layoutParser = subparsers.add_parser(
+        "migrate-layout",
+        help="Move loose cfuns into the cfun directory layout set by cfunLayout.",
+    )
+    layoutParser.add_argument(
+        "-a",
+        "--min-age",
+        help="Seconds since a cfun was written before it is moved. Default is lockTimeout + lockLease.",
+        default=None,
+        type=float,
+    )
+    layoutParser.add_argument(
+        "-n",
+        "--dry-run",
+        help="Only report what would be moved.",
+        action="store_true",
+    )
+    layoutParser.set_defaults(function=MigrateLayout)
+
+    recoverParser = subparsers.add_parser(
+        "recover",
+        help="Put cfuns left loose by failed or timed out jobs into their tars.",
+    )
+    recoverParser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to fill tars with. Default is 1.",
+        default=1,
+        type=int,
+    )
+    recoverParser.add_argument(
+        "-a",
+        "--min-age",
+        help="Seconds since a cfun was written before it is recovered. Default is lockTimeout + lockLease.",
+        default=None,
+        type=float,
+    )
+    recoverParser.add_argument(
+        "-n",
+        "--dry-run",
+        help="Only report what would be recovered.",
+        action="store_true",
+    )
+    recoverParser.set_defaults(function=Recover)
+
+    # Parsing the arguments from the command line
+    args = parser.parse_args()
+    # Turning the namespace into a dictionary
+    inputDict = vars(args)
+    return inputDict
+
+
+if __name__ == "__main__":
+
+    inputArgs = Input()
+    inputArgs["function"](inputArgs)
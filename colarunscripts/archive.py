@@ -0,0 +1,681 @@
+"""
+Module for reading and writing the archives correlation functions are kept in.
+
+The format is chosen by cfunArchiveFormat in runValues, next to tarCfuns:
+  tar -- (default) Tars, with the member index sidecar kept by tarIndex.py
+  zip -- Uncompressed zips. The central directory at the end of a zip is its
+         index, so there is no sidecar to keep in step with the archive.
+Everything reading or writing archives goes through this module, which tells
+the formats apart by extension. In both formats a membership test is a
+dictionary lookup, and reading a single member is a seek to its data.
+
+Appending to a zip rewrites its central directory in place. A zip left
+without one by a job killed mid-append is recovered the next time it is
+appended to, from the local headers in front of each member. Appends to the
+cfun tars are also journaled (see journal.py), which puts the archive back
+as it was from the part an append overwrites, as returned by Tail.
+
+Members can be stored compressed, as set by cfunCompression in runValues
+(none, gzip or lzma). Files are compressed in a pool of processes before the
+archive is opened, so a locked archive is only held for the writing. Tars
+are written from threads (see makeCfun.TarCfuns and backgroundTar.py), and a
+process with several threads cannot be forked safely, so the job starts the
+pool from its main thread with forkserver and shuts it down once the tars
+are done. Each compressed member keeps its name, and records its codec in
+the PAX header of tars or in an extra field of zips, which is also carried
+into the index.
+Read decompresses transparently. Tools outside these scripts see the raw
+gzip or xz stream of compressed members.
+
+Main functions:
+  Format          -- Returns the archive format set in the parameters
+  Extension       -- Returns the file extension of that format
+  Codec           -- Returns the compression set in the parameters
+  CompressionJobs -- Returns the number of processes to compress with
+  StartPool       -- Starts the pool of processes compressing files
+  ShutdownPool    -- Shuts the pool down
+  Compress        -- Reads and compresses files in a pool of processes
+  Members         -- Returns the members of an archive, name to location
+  Count           -- Returns the number of members, including repeated names
+  Scan            -- Reads an archive in full, ignoring any index
+  Locate          -- Returns where the data of a member lies in an archive
+  Read            -- Reads a single member of an archive
+  Iterate         -- Yields every member of an archive, in order
+  Appending       -- Context manager appending members to an archive
+  Tail            -- Returns the part of an archive an append overwrites
+  Restore         -- Puts an archive back as it was before an append
+  Files           -- Returns the files making up an archive
+  Rename          -- Moves an archive, and its index, into place
+  Summary         -- Returns the compression done by this process and its speed
+"""
+
+# standard library modules
+import concurrent.futures  # for compressing in parallel
+import contextlib  # for the appending context manager
+import gzip  # codec
+import io  # for adding members from memory
+import lzma  # codec
+import multiprocessing  # for the start method of the pool
+import os  # for stat and atomic replacement
+import struct  # for reading zip local headers
+import tarfile  # the tar format
+import threading  # for creating the pool from several threads
+import time  # for zip member timestamps
+import zipfile  # the zip format
+
+# local modules
+from colarunscripts import backgroundTar, tarIndex
+
+# Supported values of cfunArchiveFormat
+FORMATS = ("tar", "zip")
+
+# Supported values of cfunCompression, with their compress and decompress
+CODECS = {
+    "none": None,
+    "gzip": (gzip.compress, gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+# Zip extra field header ID recording the codec of a compressed member
+ZIPCODEC = 0x434C
+
+# Pools compressing files, keyed by number of processes. Started by the job
+# from its main thread, or otherwise when first needed, and kept for the job
+_pool = {}
+_poolLock = threading.Lock()
+
+# Files compressed by this process, their sizes and the time spent on them
+_stats = {"files": 0, "bytesIn": 0, "bytesOut": 0, "seconds": 0.0}
+
+# Zip members already read by this process. Keyed by zip path, values are
+# (size, mtime, count, members) as for tarIndex._cache.
+_zipCache = {}
+
+
+def Format(parameters, *args, **kwargs):
+    """Returns the archive format set in the parameters."""
+
+    archiveFormat = parameters["runValues"].get("cfunArchiveFormat", "tar")
+    if archiveFormat not in FORMATS:
+        raise ValueError(f"Unknown cfunArchiveFormat {archiveFormat}")
+    return archiveFormat
+
+
+def Extension(parameters, *args, **kwargs):
+    """Returns the file extension of the archive format in the parameters."""
+    return "." + Format(parameters)
+
+
+def Codec(parameters, *args, **kwargs):
+    """Returns the compression set in the parameters."""
+
+    codec = parameters["runValues"].get("cfunCompression", "none")
+    if codec not in CODECS:
+        raise ValueError(f"Unknown cfunCompression {codec}")
+    return codec
+
+
+def CompressionJobs(parameters, *args, **kwargs):
+    """
+    Returns the number of processes to compress with.
+
+    compressionJobs in runValues, with 0 meaning every core of the job. When
+    tarring in the background cfungen is running meanwhile, so the cores it
+    runs on, one per GPU, are left to it.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    jobs = parameters["runValues"].get("compressionJobs", 0)
+    if jobs != 0:
+        return jobs
+
+    cores = len(os.sched_getaffinity(0))
+    if backgroundTar.Enabled(parameters):
+        scheduler = parameters["runValues"]["scheduler"].lower()
+        cores -= parameters[scheduler + "Params"]["NUMGPUS"]
+    return max(cores, 1)
+
+
+def _NewPool(jobs):
+    """Returns a new pool of jobs processes, not forked from this one."""
+
+    workers = len(os.sched_getaffinity(0)) if jobs == 0 else jobs
+    return concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("forkserver")
+    )
+
+
+def StartPool(parameters, *args, **kwargs):
+    """
+    Starts the pool compressing files, if the parameters compress any.
+
+    To be called from the main thread, before any tars are written.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    jobs = CompressionJobs(parameters)
+    if Codec(parameters) == "none" or jobs == 1:
+        return
+    with _poolLock:
+        if jobs not in _pool:
+            _pool[jobs] = _NewPool(jobs)
+
+
+def ShutdownPool(*args, **kwargs):
+    """Shuts down the pools compressing files, once nothing is compressing."""
+
+    with _poolLock:
+        for pool in _pool.values():
+            pool.shutdown()
+        _pool.clear()
+
+
+def _CompressFile(filename, codec):
+    """
+    Reads and compresses a file. Run in the pool.
+
+    Returns:
+    data    -- bytes: The compressed contents
+    size    -- int: The uncompressed size
+    seconds -- float: Time spent compressing
+    """
+
+    with open(filename, "rb") as f:
+        contents = f.read()
+    startTime = time.perf_counter()
+    data = CODECS[codec][0](contents)
+    return data, len(contents), time.perf_counter() - startTime
+
+
+def Compress(filenames, codec, jobs=0, *args, **kwargs):
+    """
+    Reads and compresses files in a pool of processes.
+
+    Arguments:
+    filenames -- list: The files to compress
+    codec     -- str: gzip or lzma
+    jobs      -- int: Number of processes. 0 uses every core the job has, 1
+                      compresses in this process.
+
+    Returns:
+    compressed -- list: (data, mtime) of each file, in order
+    """
+
+    if jobs == 1:
+        # No pool, so it can be used from processes which are themselves pooled
+        results = map(_CompressFile, filenames, [codec] * len(filenames))
+    else:
+        # Several tars may be written at once, see makeCfun.TarCfuns
+        with _poolLock:
+            if jobs not in _pool:
+                _pool[jobs] = _NewPool(jobs)
+        results = _pool[jobs].map(_CompressFile, filenames, [codec] * len(filenames))
+    compressed = []
+    for filename, (data, size, seconds) in zip(filenames, results):
+        compressed.append((data, os.stat(filename).st_mtime))
+        _stats["files"] += 1
+        _stats["bytesIn"] += size
+        _stats["bytesOut"] += len(data)
+        _stats["seconds"] += seconds
+    return compressed
+
+
+def Decompress(data, codec=None, *args, **kwargs):
+    """Returns the decompressed data of a member stored with codec."""
+
+    if codec is None:
+        return data
+    return CODECS[codec][1](data)
+
+
+def _ZipExtra(codec):
+    """Returns the zip extra field recording a codec."""
+
+    encoded = codec.encode()
+    return struct.pack("<HH", ZIPCODEC, len(encoded)) + encoded
+
+
+def _ZipCodec(extra):
+    """Returns the codec recorded in a zip extra field, or None."""
+
+    while len(extra) >= 4:
+        headerID, length = struct.unpack("<HH", extra[:4])
+        if headerID == ZIPCODEC:
+            return extra[4 : 4 + length].decode()
+        extra = extra[4 + length :]
+    return None
+
+
+def IsZip(path, *args, **kwargs):
+    """Returns whether an archive is a zip, from its extension."""
+    return path.endswith(".zip")
+
+
+def _ZipIndex(path):
+    """
+    Returns the count and members of a zip from its central directory.
+
+    Members map name to [header offset, size, compression method, codec].
+    """
+
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        _zipCache.pop(path, None)
+        return 0, {}
+
+    cached = _zipCache.get(path)
+    if cached is not None and cached[0:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2], cached[3]
+
+    with zipfile.ZipFile(path, "r") as z:
+        infoList = z.infolist()
+    members = {
+        info.filename: [
+            info.header_offset,
+            info.compress_size,
+            info.compress_type,
+            _ZipCodec(info.extra),
+        ]
+        for info in infoList
+    }
+    _zipCache[path] = (stat.st_size, stat.st_mtime_ns, len(infoList), members)
+    return len(infoList), members
+
+
+def Members(path, *args, **kwargs):
+    """
+    Returns the members of an archive as a dictionary.
+
+    Keys are the member names. Values locate the member and are only
+    meaningful to Read. Missing archives have no members.
+
+    Arguments:
+    path -- str: Path to the archive
+    """
+
+    if IsZip(path):
+        return _ZipIndex(path)[1]
+    return tarIndex.Members(path)
+
+
+def Count(path, *args, **kwargs):
+    """
+    Returns the number of members of an archive, including repeated names.
+
+    Arguments:
+    path -- str: Path to the archive
+    """
+
+    if IsZip(path):
+        return _ZipIndex(path)[0]
+    header = tarIndex.CurrentHeader(path)
+    return 0 if header is None else header["count"]
+
+
+def Scan(path, *args, **kwargs):
+    """
+    Reads an archive in full, rebuilding any index from it.
+
+    Arguments:
+    path -- str: Path to the archive
+
+    Returns:
+    count -- int: Number of members, including repeated names
+    names -- set: Names of the members
+    """
+
+    if IsZip(path):
+        _zipCache.pop(path, None)
+        count, members = _ZipIndex(path)
+        return count, set(members)
+    index = tarIndex.RebuildIndex(path)
+    return index["count"], set(index["members"])
+
+
+def _ZipLocalHeader(f, headerOffset):
+    """
+    Reads the zip local header at headerOffset.
+
+    Returns:
+    header -- tuple: The fields of the header, as zipfile.structFileHeader
+    name   -- bytes: The member name
+    extra  -- bytes: The extra field
+    data   -- int: Offset of the member data
+    """
+
+    f.seek(headerOffset)
+    header = f.read(zipfile.sizeFileHeader)
+    if len(header) < zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        return None, None, None, None
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    # File name length and extra field length are the last two fields
+    nameLength, extraLength = fields[-2:]
+    name = f.read(nameLength)
+    extra = f.read(extraLength)
+    return (
+        fields,
+        name,
+        extra,
+        headerOffset + zipfile.sizeFileHeader + nameLength + extraLength,
+    )
+
+
+def Locate(path, member, f, *args, **kwargs):
+    """
+    Returns where the data of a member lies in an archive.
+
+    Arguments:
+    path   -- str: Path to the archive
+    member -- str: Name of the member
+    f      -- file: The archive open for binary reading, or a memory map of it
+
+    Returns:
+    offset -- int: Offset of the member data
+    size   -- int: Size of the data as stored
+    codec  -- str: Codec it is compressed with, None if not compressed
+    None is returned instead if there is no such member, or it is a zip member
+    compressed by zip itself, and so not stored as a single run of bytes.
+    """
+
+    location = Members(path).get(member)
+    if location is None:
+        return None
+
+    if IsZip(path):
+        headerOffset, size, method, codec = location
+        if method != zipfile.ZIP_STORED:
+            return None
+        *_, dataOffset = _ZipLocalHeader(f, headerOffset)
+        return dataOffset, size, codec
+
+    offset, size, *codec = location
+    return offset, size, codec[0] if len(codec) > 0 else None
+
+
+def Read(path, member, *args, **kwargs):
+    """
+    Reads a single member of an archive, decompressing it if required.
+
+    Arguments:
+    path   -- str: Path to the archive
+    member -- str: Name of the member
+
+    Returns:
+    data -- bytes: The member's contents, or None if there is no such member
+    """
+
+    location = Members(path).get(member)
+    if location is None:
+        return None
+
+    with open(path, "rb") as f:
+        span = Locate(path, member, f)
+        if span is None:
+            with zipfile.ZipFile(f, "r") as z:
+                return Decompress(z.read(member), location[3])
+        offset, size, codec = span
+        f.seek(offset)
+        return Decompress(f.read(size), codec)
+
+
+def Iterate(path, *args, **kwargs):
+    """
+    Yields every member of an archive in the order they were written.
+
+    Arguments:
+    path -- str: Path to the archive
+
+    Yields:
+    name  -- str: Name of the member
+    data  -- bytes: Its contents as stored, ie. still compressed
+    mtime -- float: Its modification time
+    codec -- str: Codec it is compressed with, None if not compressed
+    """
+
+    if IsZip(path):
+        with zipfile.ZipFile(path, "r") as z:
+            for info in z.infolist():
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                yield info.filename, z.read(info), mtime, _ZipCodec(info.extra)
+        return
+
+    with tarfile.open(name=path, mode="r") as t:
+        for member in t:
+            data = t.extractfile(member).read()
+            yield member.name, data, member.mtime, member.pax_headers.get(
+                tarIndex.CODEC
+            )
+
+
+class _TarWriter:
+    """Adds members to a tar open for appending, keeping the index."""
+
+    def __init__(self, t):
+        self.t = t
+
+    def Add(self, filename, arcname):
+        tarIndex.AddMember(self.t, filename, arcname=arcname)
+
+    def AddBytes(self, arcname, data, mtime, codec=None):
+        info = tarfile.TarInfo(arcname.lstrip("/"))
+        info.size = len(data)
+        info.mtime = mtime
+        if codec is not None:
+            info.pax_headers = {tarIndex.CODEC: codec}
+        tarIndex.CopyMember(self.t, info, io.BytesIO(data))
+
+
+class _ZipWriter:
+    """Adds members to a zip open for appending, storing them as given."""
+
+    def __init__(self, z):
+        self.z = z
+
+    def Add(self, filename, arcname):
+        self.z.write(filename, arcname=arcname)
+
+    def AddBytes(self, arcname, data, mtime, codec=None):
+        info = zipfile.ZipInfo(arcname.lstrip("/"), time.localtime(mtime)[:6])
+        if codec is not None:
+            info.extra = _ZipExtra(codec)
+        self.z.writestr(info, data)
+
+
+def _RecoverZip(path):
+    """
+    Rebuilds a zip whose central directory is missing or damaged.
+
+    Members are read from their local headers, in order, up to the first
+    one which is incomplete. Only zips written by this module, whose local
+    headers hold the member sizes, can be recovered.
+    """
+
+    members = []
+    with open(path, "rb") as f:
+        offset = 0
+        while True:
+            fields, name, extra, dataOffset = _ZipLocalHeader(f, offset)
+            # Flag bit 3 means the sizes are not in the local header
+            if fields is None or fields[3] & 0x08 or fields[4] != zipfile.ZIP_STORED:
+                break
+            size = fields[8]
+            f.seek(dataOffset)
+            data = f.read(size)
+            if len(data) < size:
+                break
+            members.append((name.decode(), data, extra, fields[5], fields[6]))
+            offset = dataOffset + size
+
+    tempFile = f"{path}.{os.getpid()}.tmp"
+    with zipfile.ZipFile(tempFile, "w", zipfile.ZIP_STORED) as z:
+        for name, data, extra, dosTime, dosDate in members:
+            dateTime = (
+                (dosDate >> 9) + 1980,
+                (dosDate >> 5) & 0xF,
+                dosDate & 0x1F,
+                dosTime >> 11,
+                (dosTime >> 5) & 0x3F,
+                (dosTime & 0x1F) * 2,
+            )
+            info = zipfile.ZipInfo(name, dateTime)
+            info.extra = extra
+            z.writestr(info, data)
+    os.replace(tempFile, path)
+    _zipCache.pop(path, None)
+    print(f"Recovered {len(members)} members of damaged zip {path}")
+
+
+def _CheckZip(path):
+    """Recovers a zip if its central directory is missing or damaged."""
+
+    try:
+        zipfile.ZipFile(path, "r").close()
+    except zipfile.BadZipFile:
+        _RecoverZip(path)
+
+
+@contextlib.contextmanager
+def Appending(path, archiveFormat=None, *args, **kwargs):
+    """
+    Opens an archive to append members to, creating it if required.
+
+    The archive is synced to disk, and its index updated, on leaving the
+    with block. Appending is not safe against other processes, so the
+    archive must be locked (see locking.py) if others may write to it.
+
+    Arguments:
+    path          -- str: Path to the archive
+    archiveFormat -- str: tar or zip. Default is from the extension of path.
+
+    Yields:
+    writer -- object: With methods Add(filename, arcname) and
+                      AddBytes(arcname, data, mtime, codec=None) to add
+                      members, the latter storing data as given
+    """
+
+    if archiveFormat is None:
+        archiveFormat = "zip" if IsZip(path) else "tar"
+
+    if archiveFormat == "tar":
+        with tarIndex.Appending(path) as t:
+            yield _TarWriter(t)
+        return
+
+    if os.path.exists(path) is False:
+        mode = "w"
+    else:
+        mode = "a"
+        _CheckZip(path)
+
+    with zipfile.ZipFile(path, mode, zipfile.ZIP_STORED) as z:
+        yield _ZipWriter(z)
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+    _zipCache.pop(path, None)
+
+
+def Tail(path, *args, **kwargs):
+    """
+    Returns the part of an archive overwritten by appending to it.
+
+    Appends are written from the end of the member data, over the end of
+    archive blocks of a tar or the central directory of a zip, so the
+    archive is put back as it was by cutting it there and writing the tail
+    back.
+
+    Arguments:
+    path -- str: Path to the archive
+
+    Returns:
+    tail -- tuple: (offset, the bytes from there to the end, mtime in ns), or
+                   None if there is no archive
+    """
+
+    if os.path.exists(path) is False:
+        return None
+    if IsZip(path):
+        _CheckZip(path)
+        with zipfile.ZipFile(path, "r") as z:
+            offset = z.start_dir
+    else:
+        offset = tarIndex.CurrentHeader(path)["end"]
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+    return offset, data, mtime
+
+
+def Restore(path, tail, *args, **kwargs):
+    """
+    Puts an archive back as it was before an append, from its tail.
+
+    The mtime is put back too, so an index written before the append
+    matches the archive again and is not rebuilt.
+
+    Arguments:
+    path -- str: Path to the archive
+    tail -- tuple: As returned by Tail before the append. None removes the
+                   archive, as it did not exist.
+    """
+
+    tarIndex._cache.pop(path, None)
+    _zipCache.pop(path, None)
+    if tail is None:
+        for name in Files(path):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+        return
+
+    offset, data, mtime = tail
+    with open(path, "r+b") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.utime(path, ns=(mtime, mtime))
+
+
+def Files(path, *args, **kwargs):
+    """Returns the files making up an archive, ie. a tar and its index."""
+
+    if IsZip(path):
+        return [path]
+    return [path, tarIndex.IndexFile(path)]
+
+
+def Rename(source, destination, *args, **kwargs):
+    """
+    Moves an archive into place, along with its index sidecar if it has one.
+
+    Arguments:
+    source      -- str: Path the archive was written at
+    destination -- str: Path to move it to
+    """
+
+    os.replace(source, destination)
+    if IsZip(destination) is False:
+        os.replace(tarIndex.IndexFile(source), tarIndex.IndexFile(destination))
+
+
+def Summary(*args, **kwargs):
+    """Returns a line describing the compression done by this process."""
+
+    if _stats["files"] == 0:
+        return "nothing compressed"
+    megabytes = 1024**2
+    return (
+        f'{_stats["files"]} cfuns compressed from {_stats["bytesIn"] / megabytes:.1f} '
+        f'to {_stats["bytesOut"] / megabytes:.1f} MB '
+        f'({_stats["bytesOut"] / max(_stats["bytesIn"], 1):.1%}), '
+        f'{_stats["bytesIn"] / megabytes / max(_stats["seconds"], 1e-9):.1f} MB/s per core'
+    )
@@ -0,0 +1,165 @@
+"""
+Module for expanding every artifact expected for a configuration.
+
+Used to record cfuns in the ledger as they are made, and to rebuild the
+ledger from disk with
+    python campaign.py reconcile
+
+Main functions:
+  ExpectedArtifacts -- Ledger rows of every eigenmode, propagator and cfun
+                       expected for a configuration, from the manifest
+  RecordCfuns       -- Records the cfuns made by one call to cfungen
+  Reconcile         -- Rebuilds the ledger from disk in parallel
+"""
+
+# standard library modules
+import concurrent.futures  # for reconciling configurations in parallel
+
+# local modules
+from colarunscripts import checkCfuns, dirCache
+from colarunscripts import configIDs as cfg
+from colarunscripts import ledger, manifest
+
+
+def CfunRows(
+    parameters, jobValues, kd, shift, sinkType=None, structure=None, *args, **kwargs
+):
+    """
+    Returns rows for every cfun expected for the current config.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this job
+    kd         -- int: field strength, None for all
+    shift      -- str: Cshift, None for all
+    sinkType   -- str: Only include this sink type (optional)
+    structure  -- list: Only include this structure (optional)
+    """
+
+    source = ledger.SourceLabel(parameters, jobValues["sourceType"])
+    rows = []
+    for key, cfun, *_ in checkCfuns.ExpectedCfuns(parameters, jobValues, kd, shift):
+        keykd, keyShift, keySink, sinkVal, chi, chibar, keyStructure = key
+        if sinkType is not None and keySink != sinkType:
+            continue
+        if structure is not None and keyStructure != "".join(structure):
+            continue
+        rows.append(
+            ledger.Row(
+                "cfun",
+                cfun,
+                jobValues["kappa"],
+                jobValues["cfgID"],
+                keykd,
+                keyShift,
+                source,
+                ledger.SinkLabel(keySink, sinkVal),
+                keyStructure,
+                f"{chi}{chibar}",
+            )
+        )
+    return rows
+
+
+def RecordCfuns(parameters, jobValues, kd, shift, sinkType, structure, *args, **kwargs):
+    """
+    Records the cfuns made by one call to cfungen.
+
+    Only cfuns actually present in the cfun directory are recorded.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this job
+    kd         -- int: field strength
+    shift      -- str: Cshift
+    sinkType   -- str: The sink type just made
+    structure  -- list: The structure just made
+    """
+
+    if ledger.Enabled(parameters) is False:
+        return
+
+    rows = CfunRows(parameters, jobValues, kd, shift, sinkType, structure)
+    made = [row for row in rows if dirCache.IsFile(row[-1])]
+    ledger.Record(parameters, made)
+
+
+def ExpectedArtifacts(parameters, jobValues, *args, **kwargs):
+    """
+    Returns rows for every eigenmode, propagator and cfun of a config.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this job.
+                        kappa and cfgID must be set.
+    """
+
+    configManifest = manifest.Build(
+        parameters, [jobValues["kappa"]], [jobValues["cfgID"]]
+    )
+    return [configManifest.ledgerRow(i) for i in range(len(configManifest))]
+
+
+def ReconcileConfig(parameters, jobValues, *args, **kwargs):
+    """
+    Returns the rows of all artifacts of one config which exist on disk.
+
+    Eigenmodes and propagators are found by listing their directories, cfuns
+    through checkCfuns so that tarred cfuns are found too.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this config
+    """
+
+    rows = ExpectedArtifacts(parameters, jobValues)
+    fileRows = [row for row in rows if row[0] != "cfun"]
+    existing = [row for row in fileRows if dirCache.IsFile(row[-1])]
+
+    expected = checkCfuns.ExpectedCfuns(parameters, jobValues)
+    missing = checkCfuns.MissingCfuns(
+        parameters, jobValues, useLedger=False, expected=expected
+    )
+    missingPaths = {cfun for key, cfun, *_ in expected if key in missing}
+    existing += [
+        row for row in rows if row[0] == "cfun" and row[-1] not in missingPaths
+    ]
+    return existing
+
+
+def Reconcile(parameters, jobs=1, *args, **kwargs):
+    """
+    Rebuilds the ledger from what exists on disk.
+
+    Configurations are checked in parallel, each recorded in a table of its
+    own as it is done (see ledger.StartRebuild). The table then replaces the
+    ledger in a single short transaction, so readers see either the old or
+    the new ledger, and running jobs are only kept waiting for the swap.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobs       -- int: Number of worker processes
+    """
+
+    runValues = parameters["runValues"]
+    configList = []
+    for kappa in runValues["kappaValues"]:
+        start, ncon = cfg.ConfigDetails(kappa, runValues["runPrefix"])
+        for nthConfig in range(1, ncon + 1):
+            cfgID = cfg.ConfigID(nthConfig, runValues["runPrefix"], start)
+            configList.append({**runValues, "kappa": kappa, "cfgID": cfgID})
+
+    ledger.StartRebuild(parameters)
+    numRows = 0
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        results = executor.map(
+            ReconcileConfig, [parameters] * len(configList), configList
+        )
+        for jobValues, rows in zip(configList, results):
+            ledger.RecordRebuild(parameters, rows)
+            numRows += len(rows)
+            print(f'{jobValues["kappa"]} {jobValues["cfgID"]}: {len(rows)} artifacts')
+    ledger.FinishRebuild(parameters)
+
+    print(f"Ledger rebuilt with {numRows} artifacts")
+    return numRows
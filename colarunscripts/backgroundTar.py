@@ -0,0 +1,114 @@
+"""
+Module for tarring correlation functions in the background.
+
+When backgroundTar is True in runValues, the cfuns of each call to cfungen
+are tarred by a worker thread while the next call runs, rather than the GPUs
+sitting idle while they are globbed, written to the tars and deleted, and
+while the job waits on the tar locks. There is a single worker, so tars are
+written one at a time and in the order they were queued, as they would be
+without it. Cfuns are only deleted once in a tar, so a cfun waiting to be
+tarred is still found loose by checkCfuns.
+
+The job waits for the outstanding tars before reporting, and any error
+raised while tarring is raised again there.
+
+The time the worker spent tarring, less the time the job then had to wait
+for it, is time the GPUs would otherwise have sat idle.
+
+Main functions:
+  Enabled -- Whether background tarring is turned on in the parameters
+  Submit  -- Queues a call to the worker, or makes it now if not enabled
+  Drain   -- Waits for every queued call, raising the first error
+  Summary -- Returns the GPU time saved by this process
+"""
+
+# standard library modules
+import concurrent.futures  # for the worker thread
+import time  # for timing the tarring
+import traceback  # for printing errors raised in the worker
+
+# The worker, created when first needed
+_worker = {}
+
+# Calls queued and not yet drained
+_pending = []
+
+# Time spent tarring and waiting for the worker, and GPUs left idle meanwhile
+_stats = {"tars": 0, "seconds": 0.0, "waited": 0.0, "gpus": 0}
+
+
+def Enabled(parameters, *args, **kwargs):
+    """Returns whether background tarring is turned on in the parameters."""
+    return parameters["runValues"].get("backgroundTar", False) is True
+
+
+def _Timed(function, *args, **kwargs):
+    """Calls function, adding the time it takes to the stats."""
+
+    startTime = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _stats["tars"] += 1
+        _stats["seconds"] += time.perf_counter() - startTime
+
+
+def Submit(parameters, numGPUs, function, *args, **kwargs):
+    """
+    Queues a call to the worker, or makes it now if not enabled.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    numGPUs    -- int: GPUs the job would leave idle while tarring
+    function   -- callable: Function to call, ie. makeCfun.TarCfuns. Its
+                            arguments must not be modified by the job while
+                            it is queued.
+    """
+
+    if Enabled(parameters) is False:
+        function(*args, **kwargs)
+        return
+
+    if "thread" not in _worker:
+        _worker["thread"] = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="tar"
+        )
+    _stats["gpus"] = max(_stats["gpus"], numGPUs)
+    _pending.append(_worker["thread"].submit(_Timed, function, *args, **kwargs))
+
+
+def Drain(*args, **kwargs):
+    """
+    Waits for every queued call to finish.
+
+    Every call is waited for, even if an earlier one failed, so that no tar
+    is left half written. The first error raised by a call is then raised.
+    """
+
+    if len(_pending) == 0:
+        return
+
+    print(f"\nWaiting for {len(_pending)} background tars to finish")
+    startTime = time.perf_counter()
+    concurrent.futures.wait(_pending)
+    _stats["waited"] += time.perf_counter() - startTime
+
+    errors = [future.exception() for future in _pending]
+    errors = [error for error in errors if error is not None]
+    _pending.clear()
+    if len(errors) > 0:
+        # Only the first is raised, so the rest are printed here
+        for error in errors[1:]:
+            traceback.print_exception(error)
+        raise errors[0]
+
+
+def Summary(*args, **kwargs):
+    """Returns a line describing the tarring done in the background."""
+
+    overlapped = max(_stats["seconds"] - _stats["waited"], 0)
+    return (
+        f'{_stats["tars"]} sets tarred in {_stats["seconds"]:.1f}s, '
+        f'{_stats["waited"]:.1f}s waited for, '
+        f'{_stats["gpus"] * overlapped / 3600:.2f} idle GPU hours saved'
+    )
@@ -0,0 +1,360 @@
+"""
+Module for the configuration ID and member table sidecars of the cfun tars.
+
+Each tar has two binary sidecars, replacing the text <tar>cfglist and
+<tar>info files:
+  <tar>cfgids  -- The configuration IDs in the tar, each encoded as an
+                  integer. The first IDs, up to the count in the header, are
+                  sorted and unique. IDs appended since follow, unsorted.
+  <tar>members -- The member table, a row of (ID, member name) for each cfun
+                  put in the tar.
+Both are appended to by jobs holding the tar lock, with a single write per
+append. A partial record left by a killed job is ignored, and cut off by the
+next append. Compacting, ie.
+when the shards of a tar are merged, sorts the IDs and drops duplicates from
+both, so a membership test is a binary search of the sorted IDs plus a scan of
+the few appended since.
+
+Tars made before these sidecars existed are converted once with
+    python campaign.py migrate-sidecars
+
+Main functions:
+  Encode  -- Encodes configuration IDs as integers
+  Decode  -- Decodes integers back into configuration IDs
+  Append  -- Records the cfuns of a configuration put in a tar
+  IDs     -- Returns the configuration IDs in a tar
+  Have    -- Tests which of a list of configuration IDs are in a tar
+  Members -- Returns the member table of a tar
+  Pending -- Returns the number of IDs appended since compacting
+  Compact -- Sorts the IDs and drops duplicates
+  Migrate -- Converts the text cfglist and info files of a tar
+"""
+
+# standard library modules
+import os  # for appending
+import re  # for finding IDs in cfun paths
+import struct  # for the record formats
+
+# third party modules
+import numpy as np
+
+# local modules
+from colarunscripts.utilities import AtomicWrite
+
+# Suffixes of the sidecars, as <tar><sidecar>
+IDS = "cfgids"
+MEMBERS = "members"
+SIDECARS = (IDS, MEMBERS)
+
+# Suffixes of the text sidecars they replace
+LEGACY = ("cfglist", "info")
+
+# Header of the ID sidecar, followed by the number of sorted IDs
+MAGIC = b"CFGIDS1\n"
+HEADER = struct.Struct("<8sq")
+
+# Member table rows, followed by the member name
+ROW = struct.Struct("<qH")
+
+# Run prefixes, as in configIDs.ConfigGap, in the order they are encoded
+PREFIXES = ("a", "b", "gM", "hM", "iM", "jM", "kM")
+
+# Integer recorded for cfuns whose ID is not known
+UNKNOWN = -1
+
+
+def Encode(cfgIDs, *args, **kwargs):
+    """
+    Encodes configuration IDs, ie. -a-001030, as integers.
+
+    The prefix, number of digits and number are each kept, so decoding gives
+    back exactly the same ID.
+
+    Arguments:
+    cfgIDs -- list: The configuration IDs
+
+    Returns:
+    codes -- np.ndarray: int64 codes, in the same order
+    """
+
+    codes = np.empty(len(cfgIDs), dtype=np.int64)
+    for i, cfgID in enumerate(cfgIDs):
+        _, prefix, number = cfgID.split("-")
+        codes[i] = (PREFIXES.index(prefix) << 56) | (len(number) << 48) | int(number)
+    return codes
+
+
+def Decode(codes, *args, **kwargs):
+    """Decodes integers from Encode back into configuration IDs."""
+
+    cfgIDs = []
+    for code in codes:
+        code = int(code)
+        if code == UNKNOWN:
+            cfgIDs.append(None)
+            continue
+        width = (code >> 48) & 0xFF
+        number = code & ((1 << 48) - 1)
+        cfgIDs.append(f"-{PREFIXES[code >> 56]}-{number:0{width}d}")
+    return cfgIDs
+
+
+def _ReadIDs(tarPath):
+    """
+    Reads the ID sidecar of a tar.
+
+    Returns:
+    sorted   -- np.ndarray: The sorted, unique IDs
+    appended -- np.ndarray: The IDs appended since, in the order written
+    """
+
+    try:
+        with open(tarPath + IDS, "rb") as f:
+            contents = f.read()
+    except FileNotFoundError:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+
+    if len(contents) < HEADER.size:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    magic, numSorted = HEADER.unpack_from(contents)
+    if magic != MAGIC:
+        raise ValueError(f"{tarPath + IDS} is not an ID sidecar")
+    # Any partial record at the end is still being, or was never, written
+    count = (len(contents) - HEADER.size) // 8
+    codes = np.frombuffer(contents, dtype="<i8", count=count, offset=HEADER.size)
+    return codes[:numSorted], codes[numSorted:]
+
+
+def _ReadMembers(tarPath):
+    """
+    Reads the member table of a tar.
+
+    Returns:
+    rows -- list: (code, name) tuples
+    end  -- int: Offset of the end of the last complete row
+    """
+
+    try:
+        with open(tarPath + MEMBERS, "rb") as f:
+            contents = f.read()
+    except FileNotFoundError:
+        return [], 0
+
+    rows = []
+    offset = 0
+    while offset + ROW.size <= len(contents):
+        code, length = ROW.unpack_from(contents, offset)
+        start = offset + ROW.size
+        if start + length > len(contents):
+            break
+        rows.append((code, contents[start : start + length].decode()))
+        offset = start + length
+    return rows, offset
+
+
+def _Rows(rows):
+    """Returns the bytes of member table rows, given as (code, name) tuples."""
+
+    return b"".join(
+        ROW.pack(code, len(name.encode())) + name.encode() for code, name in rows
+    )
+
+
+def _Write(path, data):
+    """Writes a whole sidecar, moving it into place once complete."""
+
+    with AtomicWrite(path, "wb") as f:
+        f.write(data)
+
+
+def _AppendBytes(path, header, data, end=None):
+    """
+    Appends to a sidecar in a single write, creating it if required.
+
+    Arguments:
+    path   -- str: Path to the sidecar
+    header -- bytes: Written first if the sidecar is new
+    data   -- bytes: The records to append
+    end    -- int: End of the complete records. Anything after it, left by a
+                   killed job, is cut off first.
+    """
+
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+    try:
+        size = os.fstat(fd).st_size
+        if size < len(header) or size == 0:
+            os.ftruncate(fd, 0)
+            data = header + data
+        elif end is not None and end < size:
+            os.ftruncate(fd, end)
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def Append(tarPath, cfgID, members, *args, **kwargs):
+    """
+    Records the cfuns of a configuration put in a tar.
+
+    The tar must be locked, or be a shard no other job writes.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    cfgID   -- str: Configuration ID of the cfuns
+    members -- list: Member names of the cfuns in the tar
+    """
+
+    code = int(Encode([cfgID])[0])
+    sortedIDs, appended = _ReadIDs(tarPath)
+    end = HEADER.size + 8 * (len(sortedIDs) + len(appended))
+    _AppendBytes(tarPath + IDS, HEADER.pack(MAGIC, 0), struct.pack("<q", code), end)
+    _, end = _ReadMembers(tarPath)
+    rows = _Rows((code, name) for name in members)
+    _AppendBytes(tarPath + MEMBERS, b"", rows, end)
+
+
+def IDs(tarPath, *args, **kwargs):
+    """
+    Returns the configuration IDs in a tar.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    cfgIDs -- set: The configuration IDs. Empty if there is no sidecar.
+    """
+
+    sortedIDs, appended = _ReadIDs(tarPath)
+    return set(Decode(np.union1d(sortedIDs, appended)))
+
+
+def Have(tarPath, cfgIDs, *args, **kwargs):
+    """
+    Tests which of a list of configuration IDs are in a tar.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    cfgIDs  -- list: The configuration IDs to look for
+
+    Returns:
+    have -- np.ndarray: bool, whether each ID is in the tar
+    """
+
+    codes = Encode(cfgIDs)
+    sortedIDs, appended = _ReadIDs(tarPath)
+    found = np.isin(codes, appended)
+    if len(sortedIDs) > 0:
+        # Binary search of the sorted IDs
+        positions = np.minimum(np.searchsorted(sortedIDs, codes), len(sortedIDs) - 1)
+        found |= sortedIDs[positions] == codes
+    return found
+
+
+def Members(tarPath, *args, **kwargs):
+    """
+    Returns the member table of a tar.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    rows -- list: (configuration ID, member name) tuples, in the order
+                  written. The ID is None if it was not known.
+    """
+
+    rows, _ = _ReadMembers(tarPath)
+    cfgIDs = Decode([code for code, _ in rows])
+    return [(cfgID, name) for cfgID, (_, name) in zip(cfgIDs, rows)]
+
+
+def Pending(tarPath, *args, **kwargs):
+    """Returns the number of IDs appended to a tar since it was compacted."""
+
+    _, appended = _ReadIDs(tarPath)
+    return len(appended)
+
+
+def Compact(tarPath, *args, **kwargs):
+    """
+    Sorts the IDs of a tar and drops duplicate IDs and member table rows.
+
+    The tar must be locked.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    dropped -- int: Number of duplicates dropped from the two sidecars
+    """
+
+    sortedIDs, appended = _ReadIDs(tarPath)
+    if len(appended) == 0:
+        return 0
+    codes = np.union1d(sortedIDs, appended)
+    dropped = len(sortedIDs) + len(appended) - len(codes)
+    _Write(
+        tarPath + IDS,
+        HEADER.pack(MAGIC, len(codes)) + codes.astype("<i8").tobytes(),
+    )
+
+    # Keeping the first of each row
+    rows, _ = _ReadMembers(tarPath)
+    unique = dict.fromkeys(rows)
+    dropped += len(rows) - len(unique)
+    _Write(tarPath + MEMBERS, _Rows(unique))
+    return dropped
+
+
+def Migrate(tarPath, *args, **kwargs):
+    """
+    Converts the text cfglist and info files of a tar, then removes them.
+
+    IDs and cfuns already in the binary sidecars are kept. Info files list
+    the paths the cfuns were made at, from which the member names and IDs
+    are recovered. The tar must be locked.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    migrated -- tuple: (number of IDs, number of members) read from the text
+                       files, None if the tar has none
+    """
+
+    cfglist, info = (tarPath + suffix for suffix in LEGACY)
+    if not os.path.isfile(cfglist) and not os.path.isfile(info):
+        return None
+
+    cfgIDs = []
+    if os.path.isfile(cfglist):
+        with open(cfglist, "r") as f:
+            cfgIDs = f.read().split()
+
+    members = {}
+    if os.path.isfile(info):
+        with open(info, "r") as f:
+            for cfun in f.read().split():
+                match = re.search(r"icfg(-(?:[ab]|[ghijk]M)-\d+)", cfun)
+                cfgID = match.group(1) if match is not None else None
+                # Member names are stored as shSHIFT/filename
+                shiftDir = os.path.basename(os.path.dirname(os.path.dirname(cfun)))
+                name = f"{shiftDir}/{os.path.basename(cfun)}"
+                members.setdefault(cfgID, []).append(name)
+
+    numMembers = sum(len(names) for names in members.values())
+    for cfgID in cfgIDs:
+        Append(tarPath, cfgID, members.pop(cfgID, []))
+    # Cfuns of configs missing from the cfglist, ie. from an interrupted job
+    for cfgID, names in members.items():
+        code = UNKNOWN if cfgID is None else int(Encode([cfgID])[0])
+        _AppendBytes(tarPath + MEMBERS, b"", _Rows((code, name) for name in names))
+    Compact(tarPath)
+
+    for path in (cfglist, info):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(cfgIDs), numMembers
@@ -8,7 +8,7 @@ parameters which they print to file. MakePartStubsFile is the exception.
 
 from colarunscripts import particles
 from colarunscripts.configIDs import ConfigID
-from colarunscripts.utilities import VariablePrinter, WriteListLengthnList
+from colarunscripts.utilities import AtomicWrite, VariablePrinter, WriteListLengthnList
 
 
 def MakePropPathFiles(filestub, logFile, propDict, structure, *args, **kwargs):
@@ -55,7 +55,7 @@ def MakePropPathFiles(filestub, logFile, propDict, structure, *args, **kwargs):
         ext = extension.replace("QUARK", quarkPosition)
 
         # Writing to the file
-        with open(filestub + ext, "w") as f:
+        with AtomicWrite(filestub + ext) as f:
             f.write(f"{quarkPath}\n")
         # Writing to the log file
         with open(logFile, "a") as f:
@@ -90,10 +90,10 @@ def MakePartStubsFile(filestub, logFile, isospin_sym, particleList, *args, **kwa
 
     # New list contains only interpolating combinations which are non-vanishing
     # at the current field strength. ie removes lambda0sigma0bar
-    updatedList = particles.CheckForVanishingFields(isospin_sym, particleList)
+    updatedList = particles.CheckForVanishingFields(isospin_sym == "t", particleList)
 
     numParticlePairs = len(updatedList)
-    with open(filestub + extension, "w") as f, open(logFile, "a") as l:
+    with AtomicWrite(filestub + extension) as f, open(logFile, "a") as l:
         l.write(f"\n{extension=}\n")
 
         # Writing number of operator pairs
@@ -150,7 +150,7 @@ def MakeInterpFile(
     # Writing the source details to the file
     # WriteListLengthnList writes first the length of the list, then the elements
     # of the list if it is not empty.
-    with open(partstub + extension, "w") as f:
+    with AtomicWrite(partstub + extension) as f:
         f.write(f"{cfunName}\n")
         f.write(f"{cfunPrefix}\n")
         WriteListLengthnList(f, particle_details["lorentz_indices"])
@@ -158,10 +158,9 @@ def MakeInterpFile(
         WriteListLengthnList(f, particle_details["levi_civita_indices"])
         WriteListLengthnList(f, particle_details["interpolator_terms"])
 
-    # Getting the anti-particle details from the particles module
-    particle_details = getattr(particles, chibar)()
-    # Writing the sink details to the file
-    with open(partstub + extension, "a") as f:
+        # Getting the anti-particle details from the particles module
+        particle_details = getattr(particles, chibar)()
+        # Writing the sink details to the file
         WriteListLengthnList(f, particle_details["gell_mann_matrices"])
         WriteListLengthnList(f, particle_details["levi_civita_indices"])
         WriteListLengthnList(f, particle_details["interpolator_terms"])
@@ -225,7 +224,7 @@ def MakeConfigIDsFile(filestub, logFile, cfgID, *args, **kwargs):
     extension = ".cfg_ids"
 
     # Writing the ID to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{cfgID}\n")
 
     # Writing the ID to the log file
@@ -295,7 +294,7 @@ def MakePropCfunInfoFile(
         doSinkSmear = "f"
 
     # Writing to the file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{1}\n")  # Number of configurations we are doing at once
         f.write(f"{propFormat}\n")
         f.write(f"{cfunFormat}\n")
@@ -352,7 +351,7 @@ def MakeLatticeFile(filestub, logFile, extent):
     extension = ".lat"
 
     # Writing to the file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write("\n".join(str(dim) for dim in extent))
         f.write("\n")
 
@@ -383,7 +382,7 @@ def MakeGFSFile(filestub, logFile, configFormat, configFile, shift, *args, **kwa
     extension = ".gfs"
 
     # Writing to the file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"1\n")  # Number of configurations we are doing at once
         f.write(f"{configFormat}\n")
         f.write(f"{shift}\n")
@@ -436,7 +435,7 @@ def MakeLPSinkFile(
     nSnk_lp = len(nModes_lpsnk)
 
     # Writing to the file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{nDim_lpsnk}\n")
         f.write(f"{shift}\n")
         for modeFile in lapModeFiles:
@@ -500,7 +499,7 @@ def MakePropSmearingFile(
     nsnk = len(sweeps_smsnk)
 
     # Writing to the file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{sinkSmearcode}\n")
         f.write(f"{alpha_smsnk}\n")
         f.write(f"{u0_smsnk}\n")
@@ -0,0 +1,114 @@
+"""
+Module for incrementally reading the cfglist sidecars of the cfun tars.
+
+Each <tar>cfglist file only ever has configuration IDs appended to it. The
+state cache records, for every cfglist read, its size, mtime and inode, how
+many bytes have been parsed and the IDs found. Later reads only parse the
+bytes appended since, so polling the progress of a campaign costs a stat per
+cfglist when nothing has changed.
+
+Main functions:
+  LoadState -- Loads the state cache from file
+  SaveState -- Saves the state cache to file, if it changed
+  ReadIDs   -- Returns the set of IDs in a cfglist, updating the state
+"""
+
+# standard library modules
+import json  # state cache format
+import os  # for stat
+
+# local modules
+from colarunscripts.utilities import AtomicWrite
+
+
+def LoadState(stateFile, *args, **kwargs):
+    """
+    Loads the state cache. A missing or unreadable cache is empty.
+
+    Arguments:
+    stateFile -- str: Path to the state cache
+    """
+
+    try:
+        with open(stateFile, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError, UnicodeDecodeError):
+        return {"changed": True, "cfglists": {}}
+
+    # IDs are stored as lists, but used as sets
+    for entry in state.values():
+        entry["ids"] = set(entry["ids"])
+    return {"changed": False, "cfglists": state}
+
+
+def SaveState(stateFile, state, *args, **kwargs):
+    """
+    Saves the state cache if anything was read since it was loaded.
+
+    Written to a temporary file and moved into place, so an interrupted
+    save leaves the previous cache intact.
+
+    Arguments:
+    stateFile -- str: Path to the state cache
+    state     -- dict: The state, as returned by LoadState
+    """
+
+    if state["changed"] is False:
+        return
+
+    cfglists = {
+        path: {**entry, "ids": sorted(entry["ids"])}
+        for path, entry in state["cfglists"].items()
+    }
+    with AtomicWrite(stateFile) as f:
+        json.dump(cfglists, f)
+    state["changed"] = False
+
+
+def ReadIDs(cfglist, state, *args, **kwargs):
+    """
+    Returns the set of configuration IDs in a cfglist.
+
+    Only the bytes appended since the last read are parsed. If the file
+    shrank or was replaced, it is parsed again from the start. A missing
+    cfglist has no IDs.
+
+    Arguments:
+    cfglist -- str: Path to the cfglist
+    state   -- dict: The state, as returned by LoadState. Updated in place.
+    """
+
+    try:
+        stat = os.stat(cfglist)
+    except FileNotFoundError:
+        if state["cfglists"].pop(cfglist, None) is not None:
+            state["changed"] = True
+        return set()
+
+    entry = state["cfglists"].get(cfglist)
+    if entry is not None and (entry["size"], entry["mtime"], entry["inode"]) == (
+        stat.st_size,
+        stat.st_mtime_ns,
+        stat.st_ino,
+    ):
+        return entry["ids"]
+
+    # Starting again if the file is new, was replaced or shrank
+    if entry is None or entry["inode"] != stat.st_ino or entry["offset"] > stat.st_size:
+        entry = {"offset": 0, "ids": set()}
+
+    with open(cfglist, "rb") as f:
+        f.seek(entry["offset"])
+        appended = f.read(stat.st_size - entry["offset"])
+
+    # Leaving a partially written last line for next time
+    complete = appended.rfind(b"\n") + 1
+    entry["ids"].update(appended[:complete].decode().split())
+    entry["offset"] += complete
+    entry["size"] = stat.st_size
+    entry["mtime"] = stat.st_mtime_ns
+    entry["inode"] = stat.st_ino
+
+    state["cfglists"][cfglist] = entry
+    state["changed"] = True
+    return entry["ids"]
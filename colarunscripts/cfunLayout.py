@@ -0,0 +1,137 @@
+"""
+Module for converting the loose correlation functions between layouts.
+
+See directories.py for the layouts of the cfuns/ directories. Checkers only
+look where the layout set in the parameters puts a cfun, so after changing
+cfunLayout every loose cfun of the campaign left in another layout is moved
+to where the current one puts it. Moves are renames within the same cfuns/
+directory, so nothing is copied, and configuration directories emptied by
+the move are removed. Tars are in cfuns/ in every layout, so are untouched.
+
+Cfuns newer than a minimum age are left alone, as a running job may be about
+to tar them from where it made them. The conversion is safe to run again,
+ie. once the jobs still using the old layout have finished.
+
+Main functions:
+  WithLayout -- Returns a copy of the parameters with another layout
+  Moves      -- Finds the loose cfuns not where the current layout puts them
+  Migrate    -- Moves them into place
+"""
+
+# standard library modules
+import os  # for walking the output tree, renaming and file ages
+import time  # for file ages
+
+# local modules
+from colarunscripts import directories as dirs
+from colarunscripts import recover
+
+
+def WithLayout(parameters, layout, *args, **kwargs):
+    """Returns a copy of the parameters with cfunLayout set to layout."""
+    return {
+        **parameters,
+        "runValues": {**parameters["runValues"], "cfunLayout": layout},
+    }
+
+
+def Moves(parameters, minAge, *args, **kwargs):
+    """
+    Finds the loose cfuns of a campaign not where the current layout puts them.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    minAge     -- float: Seconds since a cfun was last modified before it is
+                         moved
+
+    Returns:
+    moves   -- list: (path, destination) of each cfun to move
+    skipped -- int: Number of cfuns too new to be moved
+    """
+
+    directories = parameters["directories"]
+    outputDir = directories["baseOutputDir"] + directories["runIdentifier"]
+    target = dirs.CfunLayout(parameters)
+    # Patterns of the cfuns in each of the other layouts
+    patterns = {
+        layout: recover.Pattern(WithLayout(parameters, layout))
+        for layout in dirs.CFUNLAYOUTS
+        if layout != target
+    }
+    cutoff = time.time() - minAge
+
+    moves = []
+    skipped = 0
+    for root, _, fileNames in os.walk(outputDir):
+        for name in fileNames:
+            if not name.endswith(".u.2cf"):
+                continue
+            cfunPath = os.path.join(root, name)
+            for layout, pattern in patterns.items():
+                match = pattern.match(cfunPath)
+                if match is not None:
+                    break
+            else:
+                continue
+            try:
+                if os.stat(cfunPath).st_mtime > cutoff:
+                    skipped += 1
+                    continue
+            except FileNotFoundError:
+                continue
+
+            # Back up to cfuns/, then down into the current layout
+            cfunDir = root
+            for _ in range(dirs.CFUNLAYOUTS[layout].count("/")):
+                cfunDir = os.path.dirname(cfunDir)
+            subdir = dirs.CFUNLAYOUTS[target].replace("CONFIGID", match["cfgID"])
+            moves.append((cfunPath, os.path.join(cfunDir, subdir + name)))
+    return moves, skipped
+
+
+def Migrate(moves, dryRun=False, *args, **kwargs):
+    """
+    Moves loose cfuns into place, as found by Moves.
+
+    A cfun already at its destination, ie. made again since the layout was
+    changed, is kept. The old copy is deleted if identical, and otherwise
+    left where it is.
+
+    Arguments:
+    moves  -- list: (path, destination) of each cfun to move
+    dryRun -- bool: Only count what would be done
+
+    Returns:
+    counts -- dict: Numbers of cfuns moved, deleted as duplicates and left as
+                    conflicting with the cfun at the destination
+    """
+
+    counts = {"moved": 0, "duplicates": 0, "conflicts": 0}
+    emptied = set()
+    for path, destination in moves:
+        if os.path.exists(destination):
+            with open(path, "rb") as old, open(destination, "rb") as new:
+                identical = old.read() == new.read()
+            if identical is False:
+                counts["conflicts"] += 1
+                continue
+            counts["duplicates"] += 1
+            if dryRun is False:
+                os.remove(path)
+        else:
+            counts["moved"] += 1
+            if dryRun is False:
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.rename(path, destination)
+        emptied.add(os.path.dirname(path))
+
+    if dryRun is False:
+        for directory in emptied:
+            # Only configuration directories are removed, and only if empty
+            if os.path.basename(directory) == "cfuns":
+                continue
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+    return counts
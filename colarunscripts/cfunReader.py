@@ -0,0 +1,231 @@
+"""
+Module for reading correlation functions straight out of their tars.
+
+Rather than extracting a tar to read a handful of cfuns, a Reader memory maps
+the tar (or zip, see archive.py), along with any shards of it, and finds
+members through the archive's index, which is built on first use if it is
+missing. Members are returned as memoryviews of the map, or NumPy arrays
+over it, so nothing is copied and only the pages holding the members read
+are ever touched. Reading one cfun out of a 10 GB tar costs a dictionary
+lookup and a page fault.
+
+Members stored compressed (see cfunCompression) cannot be viewed in place
+and are returned decompressed instead, as a copy.
+
+Member names are sh<shift>/<cfun filename>, so members are selected by
+matching the parts of the name set by particle, structure, shift and cfgID.
+
+Main functions:
+  Reader  -- Memory mapped reader of a tar and its shards
+  Matches -- Whether a member name matches a selection
+  Select  -- Yields the selected members of several tars
+"""
+
+# standard library modules
+import mmap  # for the memory maps
+import os  # for path manipulation
+
+# third party modules
+import numpy as np
+
+# local modules
+from colarunscripts import archive, shards
+
+
+def _AsList(value):
+    """Returns value as a list of alternatives, or None to match anything."""
+
+    if value is None or isinstance(value, list):
+        return value
+    return [value]
+
+
+def Matches(
+    name,
+    chi=None,
+    chibar=None,
+    structure=None,
+    shift=None,
+    cfgID=None,
+    *args,
+    **kwargs,
+):
+    """
+    Returns whether a member name matches a selection.
+
+    Each criterion is a value or a list of alternatives. None matches
+    anything.
+
+    Arguments:
+    name      -- str: The member name, as sh<shift>/<cfun filename>
+    chi       -- str/list: Sink particle, ie. cascade0_1
+    chibar    -- str/list: Source particle, ie. cascade0_1bar
+    structure -- str/list: Structure, ie. uds
+    shift     -- str/list: Shift, as in the parameters
+    cfgID     -- str/list: Configuration ID, ie. -a-001030
+    """
+
+    shiftDir, _, filename = name.partition("/")
+    if shift is not None and shiftDir[2:] not in _AsList(shift):
+        return False
+    if cfgID is not None:
+        if not any(f"icfg{ID}si" in filename for ID in _AsList(cfgID)):
+            return False
+    if structure is not None:
+        # Structures may be given as lists of quarks, as in the parameters
+        if isinstance(structure, list) and not isinstance(structure[0], str):
+            structures = ["".join(value) for value in structure]
+        elif isinstance(structure, list) and len(structure[0]) == 1:
+            structures = ["".join(structure)]
+        else:
+            structures = _AsList(structure)
+        if not any(filename.endswith(f"_{value}.u.2cf") for value in structures):
+            return False
+
+    # The particles are run together in the name, between the sink label and
+    # the structure, as .<chi><chibar>_
+    pair = filename.rsplit("_", 1)[0].rsplit(".", 1)[-1]
+    if chi is not None and not any(pair.startswith(x) for x in _AsList(chi)):
+        return False
+    if chibar is not None and not any(pair.endswith(x) for x in _AsList(chibar)):
+        return False
+    if chi is not None and chibar is not None:
+        pairs = [x + y for x in _AsList(chi) for y in _AsList(chibar)]
+        if pair not in pairs:
+            return False
+
+    return True
+
+
+class Reader:
+    """
+    Memory mapped reader of a tar and its shards.
+
+    Use as a context manager, or call Close once done. Views handed out keep
+    the maps they point into open until they are themselves released.
+
+    Arguments:
+    tarPath -- str: Path to the canonical tar, or zip
+    """
+
+    def __init__(self, tarPath, *args, **kwargs):
+        self.tarPath = tarPath
+        self._maps = {}
+        # Later shards hold the most recent copy of a member
+        self._paths = [tarPath] + shards.Shards(tarPath)
+        self._where = {}
+        for path in self._paths:
+            for name in archive.Members(path):
+                self._where[name] = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+
+    def _Map(self, path):
+        """Returns the memory map of one of the archives, mapping it if new."""
+
+        if path not in self._maps:
+            with open(path, "rb") as f:
+                self._maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[path]
+
+    def Names(self, *args, **kwargs):
+        """Returns the names of every member of the tar and its shards."""
+        return list(self._where)
+
+    def Get(self, member, *args, **kwargs):
+        """
+        Returns the contents of a member.
+
+        Arguments:
+        member -- str: Name of the member
+
+        Returns:
+        data -- memoryview: View of the member in the map, or bytes if it is
+                            stored compressed. None if there is no such member.
+        """
+
+        path = self._where.get(member)
+        if path is None:
+            return None
+        fileMap = self._Map(path)
+        span = archive.Locate(path, member, fileMap)
+        if span is None:
+            return archive.Read(path, member)
+        offset, size, codec = span
+        if codec is not None:
+            return archive.Decompress(fileMap[offset : offset + size], codec)
+        return memoryview(fileMap)[offset : offset + size]
+
+    def Array(self, member, dtype, offset=0, *args, **kwargs):
+        """
+        Returns the contents of a member as a NumPy array, without copying.
+
+        Arguments:
+        member -- str: Name of the member
+        dtype  -- str/np.dtype: Type of the data, ie. ">c16"
+        offset -- int: Bytes to skip at the start of the member, ie. a header
+
+        Returns:
+        array -- np.ndarray: Read only array over the member, or None if
+                             there is no such member
+        """
+
+        data = self.Get(member)
+        if data is None:
+            return None
+        return np.frombuffer(data, dtype=dtype, offset=offset)
+
+    def Select(self, *args, **kwargs):
+        """
+        Returns the members matching a selection. See Matches.
+
+        Returns:
+        selected -- dict: Member name to its contents, as from Get
+        """
+
+        return {
+            name: self.Get(name)
+            for name in self._where
+            if Matches(name, *args, **kwargs)
+        }
+
+    def Close(self, *args, **kwargs):
+        """Closes the maps which are no longer viewed."""
+
+        for path, fileMap in list(self._maps.items()):
+            try:
+                fileMap.close()
+            except BufferError:
+                # Still viewed, so closed once the views are released
+                continue
+            del self._maps[path]
+
+
+def Select(tarPaths, *args, **kwargs):
+    """
+    Yields the selected members of several tars. See Matches for selecting.
+
+    The tars of a selection can be chosen with
+        glob.glob(f"{cfunDir}/*{chi}{chibar}_{structure}.tar")
+    as each tar holds a single particle pair and structure.
+
+    Arguments:
+    tarPaths -- list: Paths to the canonical tars, or zips
+
+    Yields:
+    tarPath -- str: The tar the member belongs to
+    name    -- str: Name of the member
+    data    -- memoryview: Its contents, as from Reader.Get
+    """
+
+    for tarPath in tarPaths:
+        if not os.path.isfile(tarPath) and len(shards.Shards(tarPath)) == 0:
+            continue
+        reader = Reader(tarPath)
+        for name, data in reader.Select(*args, **kwargs).items():
+            yield tarPath, name, data
+        reader.Close()
@@ -0,0 +1,148 @@
+"""
+Module for checking which correlation functions exist for a configuration.
+
+All expected correlation functions are expanded first, from the templates of
+the campaign manifest (see manifest.py), then grouped by the tar they would
+be stored in and the directory they would be left in if untarred. Each tar
+index, along with those of any shards of the tar (see shards.py), is read
+and each directory listed exactly once, no matter how many correlation
+functions are expected.
+
+Main functions:
+  ExpectedCfuns   -- Expands every correlation function expected for a config
+  MissingCfuns    -- Returns the full set of correlation functions which are
+                     neither in a tar nor loose in their directory
+  IncompletePairs -- Groups missing correlation functions into the particle
+                     pairs each (sinkType, structure) still needs
+"""
+
+# standard library modules
+import os  # for path manipulation
+
+# local modules
+from colarunscripts import dirCache
+from colarunscripts import ledger, manifest, shards
+
+
+def ExpectedCfuns(parameters, jobValues, kd=None, shift=None, *args, **kwargs):
+    """
+    Expands every correlation function expected for the current config.
+
+    Paths come from the templates of the campaign manifest, derived once per
+    kappa value (see manifest.CfunTemplates), with the config ID filled in.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this job
+    kd         -- int: field strength to expand (optional)(default: all)
+    shift      -- string: Cshift to expand (optional)(default: all)
+
+    Returns:
+    expected -- list: List of (key, cfun, tar, member) tuples. key is
+                      (kd, shift, sinkType, sinkVal, chi, chibar, structure)
+                      with structure joined into a string, cfun is the path
+                      of the untarred file, tar is the tar it belongs in and
+                      member is its name inside that tar.
+    """
+
+    cfgID = jobValues["cfgID"]
+    return [
+        (
+            key,
+            cfun.replace("CONFIGID", cfgID),
+            tar.replace("CONFIGID", cfgID),
+            member.replace("CONFIGID", cfgID),
+        )
+        for key, cfun, tar, member in manifest.CfunTemplates(parameters, jobValues)
+        if (kd is None or key[0] == kd) and (shift is None or key[1] == shift)
+    ]
+
+
+def MissingCfuns(
+    parameters,
+    jobValues,
+    kd=None,
+    shift=None,
+    useLedger=True,
+    expected=None,
+    *args,
+    **kwargs,
+):
+    """
+    Returns the set of correlation functions missing for the current config.
+
+    Does not stop at the first missing correlation function. If the ledger is
+    enabled it is queried once. Otherwise each tar index is read once and
+    each cfun directory listed once.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this job
+    kd         -- int: field strength to check (optional)(default: all)
+    shift      -- string: Cshift to check (optional)(default: all)
+    useLedger  -- bool: Set False to check the disk even if the ledger is
+                        enabled
+    expected   -- list: Output of ExpectedCfuns for the same arguments, if
+                        already available
+
+    Returns:
+    missing -- set: Keys, as described in ExpectedCfuns, of the missing
+                    correlation functions.
+    """
+
+    if expected is None:
+        expected = ExpectedCfuns(parameters, jobValues, kd, shift)
+
+    if useLedger is True and ledger.Enabled(parameters):
+        recorded = ledger.ExistingPaths(
+            parameters, "cfun", jobValues["kappa"], jobValues["cfgID"]
+        )
+        return {key for key, cfun, *_ in expected if cfun not in recorded}
+
+    # Grouping by tar and by directory
+    byTar = {}
+    byDir = {}
+    for key, cfun, tar, member in expected:
+        byTar.setdefault(tar, []).append((key, member))
+        directory, filename = os.path.split(cfun)
+        byDir.setdefault(directory, []).append((key, filename))
+
+    found = set()
+    for tar, entries in byTar.items():
+        # Shards of the tar count as part of it
+        members = shards.Names(tar)
+        found.update(key for key, member in entries if member in members)
+
+    for directory, entries in byDir.items():
+        # Only list directories that still have something to find
+        if all(key in found for key, _ in entries):
+            continue
+        listing = dirCache.Listing(directory) or {}
+        found.update(key for key, filename in entries if filename in listing)
+
+    return {key for key, *_ in expected if key not in found}
+
+
+def IncompletePairs(missing, kd, shift, *args, **kwargs):
+    """
+    Returns the particle pairs still needed for each sink type and structure.
+
+    cfungen makes every sink value of a particle pair in one call, so a pair
+    is needed if any of its sink values is missing.
+
+    Arguments:
+    missing -- set: Keys of missing correlation functions, from MissingCfuns
+    kd      -- int: field strength
+    shift   -- str: Cshift
+
+    Returns:
+    incomplete -- dict: (sinkType, structure) to set of (chi, chibar). Only
+                        incomplete combinations are included, structure is
+                        joined into a string.
+    """
+
+    incomplete = {}
+    for keykd, keyShift, sinkType, _, chi, chibar, structure in missing:
+        if (keykd, keyShift) == (kd, shift):
+            incomplete.setdefault((sinkType, structure), set()).add((chi, chibar))
+    return incomplete
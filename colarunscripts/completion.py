@@ -0,0 +1,199 @@
+"""
+Module for the completion bitmap of the correlation functions of a campaign.
+
+For each kappa value a boolean array with axes
+    configs x kds x shifts x sinkTypes x structures
+is kept as a .npy file in the ledger directory, alongside a sidecar
+recording the values along each axis. An entry is True once every cfun of
+that combination is known to exist. Combinations which are never made (ie.
+smeared sinks for structures other than [u,d,s]) are always True. An entry
+being False only means the combination is not known to be complete, so
+anything acting on the bitmap should confirm with checkCfuns.
+
+Entries are written with os.pwrite, rather than through a writable memmap,
+so that jobs updating different configurations at once never write back
+each other's pages.
+
+Main functions:
+  Update         -- Records the completion state from a set of missing cfuns
+  NextIncomplete -- Finds the next configuration not known to be complete
+"""
+
+# standard library modules
+import json  # axes sidecar format
+import os  # for pwrite and atomic creation
+
+# third party modules
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# local modules
+from colarunscripts import configIDs as cfg
+from colarunscripts import directories as dirs
+
+
+def BitmapFile(parameters, kappa, *args, **kwargs):
+    """Returns the path to the completion bitmap of a kappa value."""
+    return (
+        dirs.FullDirectories(parameters, directory="ledger")["ledger"]
+        + f"completion_k{kappa}.npy"
+    )
+
+
+def Axes(parameters, kappa, *args, **kwargs):
+    """
+    Returns the values along each axis of the bitmap of a kappa value.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    kappa      -- int: The kappa value
+    """
+
+    runValues = parameters["runValues"]
+    _, ncon = cfg.ConfigDetails(kappa, runValues["runPrefix"])
+    return {
+        "ncon": ncon,
+        "kds": list(runValues["kds"]),
+        "shifts": list(runValues["shifts"]),
+        "sinkTypes": list(runValues["sinkTypes"]),
+        "structures": ["".join(structure) for structure in runValues["structureList"]],
+    }
+
+
+def Open(parameters, kappa, *args, **kwargs):
+    """
+    Opens the bitmap of a kappa value read only, creating it if required.
+
+    The bitmap is recreated if the axes in the parameters no longer match
+    those it was made with.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    kappa      -- int: The kappa value
+
+    Returns:
+    bitmap -- memmap: The bitmap
+    axes   -- dict: Values along each axis, as from Axes
+    """
+
+    bitmapFile = BitmapFile(parameters, kappa)
+    axes = Axes(parameters, kappa)
+
+    try:
+        with open(bitmapFile + "axes", "r") as f:
+            matching = json.load(f) == axes
+    except (FileNotFoundError, json.JSONDecodeError):
+        matching = False
+
+    if matching is False:
+        Create(bitmapFile, axes)
+
+    return open_memmap(bitmapFile, mode="r"), axes
+
+
+def Create(bitmapFile, axes, *args, **kwargs):
+    """
+    Creates an empty bitmap, replacing any existing one.
+
+    Arguments:
+    bitmapFile -- str: Path to the bitmap
+    axes       -- dict: Values along each axis, as from Axes
+    """
+
+    print(f"Creating completion bitmap {bitmapFile}")
+    shape = (
+        axes["ncon"],
+        len(axes["kds"]),
+        len(axes["shifts"]),
+        len(axes["sinkTypes"]),
+        len(axes["structures"]),
+    )
+
+    tempFile = f"{bitmapFile}.{os.getpid()}.tmp"
+    bitmap = open_memmap(tempFile, mode="w+", dtype=np.bool_, shape=shape)
+    # Smeared sinks are only made for [u,d,s], so the rest are always complete
+    for i, sinkType in enumerate(axes["sinkTypes"]):
+        for j, structure in enumerate(axes["structures"]):
+            if sinkType == "smeared" and structure != "uds":
+                bitmap[:, :, :, i, j] = True
+    bitmap.flush()
+    del bitmap
+
+    tempAxes = f"{bitmapFile}axes.{os.getpid()}.tmp"
+    with open(tempAxes, "w") as f:
+        json.dump(axes, f)
+    os.replace(tempFile, bitmapFile)
+    os.replace(tempAxes, bitmapFile + "axes")
+
+
+def Update(parameters, jobValues, missing, kd=None, shift=None, *args, **kwargs):
+    """
+    Records the completion state of a configuration.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of parameters relevant to this job.
+                        kappa and nthConfig must be set.
+    missing    -- set: Keys of missing cfuns, from checkCfuns.MissingCfuns
+    kd         -- int: The field strength missing was checked for
+                       (default: all)
+    shift      -- str: The shift missing was checked for (default: all)
+    """
+
+    bitmap, axes = Open(parameters, jobValues["kappa"])
+    config = jobValues["nthConfig"] - 1
+
+    incomplete = {(key[0], key[1], key[2], key[6]) for key in missing}
+    kdList = axes["kds"] if kd is None else [kd]
+    shiftList = axes["shifts"] if shift is None else [shift]
+
+    with open(bitmap.filename, "r+b") as f:
+        for kd in kdList:
+            for shift in shiftList:
+                i = axes["kds"].index(kd)
+                j = axes["shifts"].index(shift)
+
+                # The sink and structure axes of one (kd, shift) are contiguous
+                block = np.array(bitmap[config, i, j])
+                for k, sinkType in enumerate(axes["sinkTypes"]):
+                    for m, structure in enumerate(axes["structures"]):
+                        if sinkType == "smeared" and structure != "uds":
+                            continue
+                        complete = (kd, shift, sinkType, structure) not in incomplete
+                        block[k, m] = complete
+
+                offset = bitmap.offset + np.ravel_multi_index(
+                    (config, i, j, 0, 0), bitmap.shape
+                )
+                os.pwrite(f.fileno(), block.tobytes(), offset)
+
+
+def NextIncomplete(parameters, kappa, nthConfig, step, ncon, *args, **kwargs):
+    """
+    Finds the next configuration not known to be complete.
+
+    Checks nthConfig + step, nthConfig + 2*step, ... up to ncon in a single
+    scan of the bitmap.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    kappa      -- int: The kappa value
+    nthConfig  -- int: The current configuration
+    step       -- int: The gap between configurations to check
+    ncon       -- int: The last configuration to check
+
+    Returns:
+    nthConfig -- int: The next configuration not known to be complete, or
+                      None if every remaining configuration is complete.
+    """
+
+    bitmap, axes = Open(parameters, kappa)
+    candidates = np.arange(nthConfig + step, min(ncon, axes["ncon"]) + 1, step)
+    if len(candidates) == 0:
+        return None
+
+    complete = bitmap[candidates - 1].reshape(len(candidates), -1).all(axis=1)
+    incomplete = np.flatnonzero(~complete)
+    if len(incomplete) == 0:
+        return None
+    return int(candidates[incomplete[0]])
@@ -1,13 +1,18 @@
 """
 Module for getting configuration IDs and configuration details.
 
-Contains two main functions.
+Contains five main functions.
   ConfigDetails -- Returns the starting configuration number and total
                     number of configurations based on the run prefix and
                     kappa value.
   ConfigIDs     -- Returns the formatted configuration ID, eg -a-1880
                     based on current (nth) configuration, starting config
                     and the run prefix
+  ConfigGap     -- Returns the gap between configuration numbers for the
+                    run prefix
+  FormatRanges  -- Compresses a list of configuration numbers into ranges,
+                    eg 3-7,12,40-55
+  ParseRanges   -- Expands ranges, as from FormatRanges, back into a list
 
 Numeric functions (One,Two,...) are helper functions for ConfigDetails.
 
@@ -136,6 +141,24 @@ def ConfigDetails(kappa, runPrefix, *args, **kwargs):
     return start, ncon
 
 
+def ConfigGap(runPrefix, *args, **kwargs):
+    """
+    Returns the gap between consecutive configuration numbers
+
+    Function arguments:
+    runPrefix -- char: The runPrefix or series name within the
+                       configuration set.
+    """
+    # Different series types (runPrefix) have different gaps between
+    # configuration numbers.
+    if runPrefix in ["a", "b"]:
+        return 10
+    elif runPrefix in ["gM", "hM", "iM", "jM", "kM"]:
+        return 20
+    else:
+        raise ValueError("Invalid run prefix")
+
+
 def ConfigID(nthConfig, runPrefix, start, *args, **kwargs):
     """
     Returns a formatted configuration ID, eg -a-1880
@@ -150,14 +173,49 @@ def ConfigID(nthConfig, runPrefix, start, *args, **kwargs):
     Returns:
     configID -- str: Formatted ID suffix, ie -a-001880.
     """
-    # Different series types (runPrefix) have different gaps between
-    # configuration numbers.
-    if runPrefix in ["a", "b"]:
-        gap = 10
-    elif runPrefix in ["gM", "hM", "iM", "jM", "kM"]:
-        gap = 20
-    else:
-        raise ValueError("Invalid run prefix")
-
-    ID = start + (nthConfig - 1) * gap
+    ID = start + (nthConfig - 1) * ConfigGap(runPrefix)
     return f"-{runPrefix}-00{ID}"
+
+
+def FormatRanges(indices, *args, **kwargs):
+    """
+    Compresses configuration numbers into ranges, eg [3,4,5,12] -> 3-5,12
+
+    The format is that accepted by slurm's --array option.
+
+    Function arguments:
+    indices -- iterable of int: The configuration numbers
+
+    Returns:
+    ranges -- str: Comma separated ranges. Empty if there are no indices.
+    """
+    ranges = []
+    for index in sorted(set(indices)):
+        if len(ranges) > 0 and index == ranges[-1][1] + 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+def ParseRanges(ranges, *args, **kwargs):
+    """
+    Expands ranges, eg 3-5,12 -> [3,4,5,12]
+
+    Function arguments:
+    ranges -- str: Comma separated ranges, as from FormatRanges
+
+    Returns:
+    indices -- int list: The configuration numbers, sorted
+    """
+    indices = set()
+    for part in ranges.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        first, _, last = part.partition("-")
+        indices.update(range(int(first), int(last or first) + 1))
+    return sorted(indices)
@@ -0,0 +1,299 @@
+"""
+Module for reusing correlation functions already made by other campaigns.
+
+When useDedupe is True in runValues, every cfun made is recorded in a
+shared SQLite index (dedupeIndex in the directories section) under the
+provenance hash of the cfungen input files that made it (see provenance.py).
+Those hashes do not depend on the campaign's output directory, so before
+calling cfungen a campaign looks up the hash of its own input files. Any cfun
+another campaign (or this one) already made from identical inputs is hard
+linked into place, or copied if linking is not possible, instead of being
+made again. Cfuns which have since been tarred are copied out of the tar.
+
+Each recorded cfun carries its share of the GPU time of the cfungen call
+that made it, so reusing it is counted as that much GPU time saved.
+
+Main functions:
+  Enabled -- Whether deduplication is turned on in the parameters
+  Reuse   -- Puts previously made cfuns in place, returning those still to make
+  Record  -- Records the cfuns made by a call to cfungen
+  Summary -- Returns the GPU time saved by this process
+  Saved   -- Returns the GPU time saved, per campaign, from the index
+"""
+
+# standard library modules
+import os  # for linking and path manipulation
+import shutil  # for copying when linking is not possible
+import sqlite3  # the index itself
+import time  # for recording when cfuns were reused
+
+# local modules
+from colarunscripts import archive, checkCfuns, dirCache, shards
+
+# Order of the columns in the outputs table and in rows
+COLUMNS = (
+    "hash",
+    "sinkVal",
+    "chi",
+    "chibar",
+    "path",
+    "tar",
+    "member",
+    "gpuSeconds",
+    "campaign",
+)
+
+# Open connections, keyed by index file. One per process.
+_connections = {}
+
+# Cfuns reused and GPU time saved by this process
+_saved = {"cfuns": 0, "gpuSeconds": 0.0}
+
+
+def Enabled(parameters, *args, **kwargs):
+    """Returns whether deduplication is turned on in the parameters."""
+    return parameters["runValues"].get("useDedupe", False) is True
+
+
+def Connect(parameters, *args, **kwargs):
+    """
+    Returns the connection to the shared index, creating it if required.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    indexFile = parameters["directories"]["dedupeIndex"]
+    if indexFile in _connections:
+        return _connections[indexFile]
+
+    # Long timeout as jobs from several campaigns may be writing at once
+    connection = sqlite3.connect(indexFile, timeout=300)
+    with connection:
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS outputs ({', '.join(COLUMNS)}, "
+            "PRIMARY KEY (hash, sinkVal, chi, chibar, path))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS reuses "
+            "(hash, path, source, gpuSeconds, campaign, time)"
+        )
+    _connections[indexFile] = connection
+    return connection
+
+
+def Campaign(parameters, *args, **kwargs):
+    """Returns the label of the campaign, its runIdentifier."""
+    return parameters["directories"]["runIdentifier"].strip("/")
+
+
+def ExpectedSet(parameters, kd, shift, sinkType, structure, jobValues, *args, **kwargs):
+    """
+    Returns the cfuns made by one call to cfungen.
+
+    Returns:
+    expected -- list: (key, cfun, tar, member) tuples, as from
+                      checkCfuns.ExpectedCfuns, for the sink type and structure
+    """
+
+    structureStr = "".join(structure)
+    return [
+        (key, cfun, tar, member)
+        for key, cfun, tar, member in checkCfuns.ExpectedCfuns(
+            parameters, jobValues, kd, shift
+        )
+        if key[2] == sinkType and key[6] == structureStr
+    ]
+
+
+def Place(source, tar, member, target, *args, **kwargs):
+    """
+    Puts a previously made cfun at target.
+
+    Hard links the original file if it still exists, falling back to a copy
+    if it is on another filesystem. Otherwise copies it out of its tar, or a
+    shard of the tar. The cfun is moved into place once complete, replacing
+    any existing file.
+
+    Arguments:
+    source -- str: Path the cfun was made at
+    tar    -- str: Tar the cfun is put in once tarred
+    member -- str: Name of the cfun inside the tar
+    target -- str: Where to put the cfun
+
+    Returns:
+    placed -- bool: Whether the cfun could be found and put in place
+    """
+
+    dirCache.MakeDirs(os.path.dirname(target))
+    tempFile = f"{target}.{os.getpid()}.tmp"
+    if os.path.isfile(source):
+        try:
+            os.link(source, tempFile)
+        except OSError:
+            shutil.copyfile(source, tempFile)
+    else:
+        path = shards.Locate(tar, member)
+        if path is None:
+            return False
+        with open(tempFile, "wb") as f:
+            f.write(archive.Read(path, member))
+
+    os.replace(tempFile, target)
+    return True
+
+
+def Reuse(
+    parameters,
+    kd,
+    shift,
+    sinkType,
+    structure,
+    jobValues,
+    particleList,
+    deckHash,
+    *args,
+    **kwargs,
+):
+    """
+    Puts in place every requested cfun already made from identical inputs.
+
+    Arguments:
+    parameters   -- dict: Dictionary of all parameters from yml
+    sinkType     -- str: The sink type about to be made
+    structure    -- list: The structure about to be made
+    jobValues    -- dict: Dictionary of parameters relevant to this job
+    particleList -- list: The particle pairs about to be made
+    deckHash     -- str: Provenance hash of the cfungen input files
+
+    Returns:
+    remaining -- list: The particle pairs, from particleList, which could not
+                       all be reused and so must still be made.
+    """
+
+    connection = Connect(parameters)
+    rows = connection.execute(
+        "SELECT sinkVal, chi, chibar, path, tar, member, gpuSeconds "
+        "FROM outputs WHERE hash=?",
+        (deckHash,),
+    )
+    available = {}
+    for sinkVal, chi, chibar, *source in rows:
+        available.setdefault((sinkVal, chi, chibar), []).append(source)
+
+    wanted = {tuple(pair) for pair in particleList}
+    remaining = set()
+    reuses = []
+    done = set()
+    for key, cfun, _, _ in ExpectedSet(
+        parameters, kd, shift, sinkType, structure, jobValues
+    ):
+        _, _, _, sinkVal, chi, chibar, _ = key
+        if (chi, chibar) not in wanted or cfun in done:
+            continue
+        done.add(cfun)
+
+        placed = False
+        for path, tar, member, gpuSeconds in available.get((sinkVal, chi, chibar), []):
+            if path != cfun and Place(path, tar, member, cfun):
+                placed = True
+                break
+        if placed is False:
+            remaining.add((chi, chibar))
+            continue
+
+        dirCache.Added(cfun)
+        reuses.append(
+            (deckHash, cfun, path, gpuSeconds, Campaign(parameters), time.time())
+        )
+        _saved["cfuns"] += 1
+        _saved["gpuSeconds"] += gpuSeconds
+
+    if len(reuses) > 0:
+        print(f"Reused {len(reuses)} correlation functions made from identical inputs")
+        with connection:
+            connection.executemany(
+                "INSERT INTO reuses VALUES (?, ?, ?, ?, ?, ?)", reuses
+            )
+
+    return [pair for pair in particleList if tuple(pair) in remaining]
+
+
+def Record(
+    parameters,
+    kd,
+    shift,
+    sinkType,
+    structure,
+    jobValues,
+    particleList,
+    deckHash,
+    gpuSeconds,
+    *args,
+    **kwargs,
+):
+    """
+    Records the cfuns made by a call to cfungen in the shared index.
+
+    Only cfuns actually present in the cfun directory are recorded. The
+    binary's output directory must have been invalidated in dirCache.
+
+    Arguments:
+    parameters   -- dict: Dictionary of all parameters from yml
+    sinkType     -- str: The sink type just made
+    structure    -- list: The structure just made
+    jobValues    -- dict: Dictionary of parameters relevant to this job
+    particleList -- list: The particle pairs just made
+    deckHash     -- str: Provenance hash of the cfungen input files
+    gpuSeconds   -- float: GPU time taken by the call
+    """
+
+    made = {tuple(pair) for pair in particleList}
+    rows = []
+    for key, cfun, tar, member in ExpectedSet(
+        parameters, kd, shift, sinkType, structure, jobValues
+    ):
+        _, _, _, sinkVal, chi, chibar, _ = key
+        if (chi, chibar) in made and dirCache.IsFile(cfun):
+            rows.append([deckHash, sinkVal, chi, chibar, cfun, tar, member])
+
+    if len(rows) == 0:
+        return
+
+    # Sharing the GPU time of the call between the cfuns it made
+    for row in rows:
+        row += [gpuSeconds / len(rows), Campaign(parameters)]
+
+    connection = Connect(parameters)
+    with connection:
+        connection.executemany(
+            f"INSERT OR REPLACE INTO outputs VALUES ({', '.join(len(COLUMNS) * '?')})",
+            rows,
+        )
+
+
+def Summary(*args, **kwargs):
+    """Returns a line describing the reuse done by this process."""
+
+    return (
+        f'{_saved["cfuns"]} correlation functions reused, '
+        f'{_saved["gpuSeconds"] / 3600:.2f} GPU hours saved'
+    )
+
+
+def Saved(parameters, *args, **kwargs):
+    """
+    Returns the reuse recorded in the shared index, by campaign.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+
+    Returns:
+    saved -- list: (campaign, cfuns reused, GPU hours saved) tuples
+    """
+
+    rows = Connect(parameters).execute(
+        "SELECT campaign, COUNT(*), SUM(gpuSeconds) / 3600 FROM reuses "
+        "GROUP BY campaign ORDER BY campaign"
+    )
+    return rows.fetchall()
@@ -0,0 +1,251 @@
+"""
+Module for answering file and directory existence queries from memory.
+
+On parallel filesystems every is_file/is_dir is a metadata RPC. Instead,
+each directory is listed once with os.scandir and the listing kept for the
+rest of the process. Files and directories the scripts create or delete
+themselves are updated in the listings directly. Directories written to by
+the binaries must be invalidated after the binary runs.
+
+Listings go stale if other jobs write to the same directories, so anything
+which needs to see the work of other jobs (ie. submitting the next config)
+should Clear the cache first.
+
+The listings are shared by the threads of a job (see backgroundTar.py), so
+are only touched while holding a lock. Directories are scanned outside it,
+and a scan is only kept if the directory was not changed, invalidated or
+cleared while it was being made.
+
+Main functions:
+  IsFile     -- Whether a file exists
+  IsDir      -- Whether a directory exists
+  Listing    -- The names in a directory, from a single scan
+  MakeDirs   -- Creates a directory and any missing parents
+  Added      -- Records a file created by the scripts
+  Removed    -- Records a file deleted by the scripts
+  Invalidate -- Forgets the listing of a directory
+  Clear      -- Forgets all listings
+  Counts     -- Returns the number of metadata operations done so far
+  Summary    -- Returns the number of metadata operations done and saved
+"""
+
+# standard library modules
+import os  # for scandir and path manipulation
+import pathlib  # for mkdir
+import threading  # for sharing the listings between threads
+
+# Listings already made by this process. Keys are directory paths, values are
+# dicts of name: isDirectory, or None for directories which do not exist.
+_snapshots = {}
+
+# Changes recorded to each directory, and clears, so scans made meanwhile
+# are not kept
+_changes = {}
+_clears = [0]
+
+# Held while touching any of the above
+_lock = threading.RLock()
+
+# Metadata operations done and queries answered from memory by this process
+_counts = {"scans": 0, "mkdirs": 0, "queries": 0}
+
+
+def _Key(path):
+    """Normalises a path for use as a key."""
+    return os.path.normpath(os.path.abspath(path))
+
+
+def _Changed(directory):
+    """Records a change to a directory. The lock must be held."""
+    _changes[directory] = _changes.get(directory, 0) + 1
+
+
+def _Listing(directory, fresh=False):
+    """
+    Returns the listing of a directory as kept, scanning it if required.
+
+    The listing returned may be changed by other threads once the lock is
+    released, so must only be used while holding it.
+    """
+
+    with _lock:
+        if fresh is False and directory in _snapshots:
+            return _snapshots[directory]
+        before = (_changes.get(directory, 0), _clears[0])
+        _counts["scans"] += 1
+
+    try:
+        with os.scandir(directory) as entries:
+            listing = {entry.name: entry.is_dir() for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        listing = None
+
+    with _lock:
+        if (_changes.get(directory, 0), _clears[0]) == before:
+            _snapshots[directory] = listing
+    return listing
+
+
+def Listing(directory, fresh=False, *args, **kwargs):
+    """
+    Returns the listing of a directory, scanning it if not already known.
+
+    Arguments:
+    directory -- str: Path to the directory
+    fresh     -- bool: Whether to scan it again even if known
+
+    Returns:
+    listing -- dict: Name to whether it is a directory, a copy which is not
+                     updated. None if the directory does not exist.
+    """
+
+    with _lock:
+        listing = _Listing(_Key(directory), fresh)
+        return None if listing is None else dict(listing)
+
+
+def IsFile(path, *args, **kwargs):
+    """
+    Returns whether a file (or anything other than a directory) exists.
+
+    Arguments:
+    path -- str: Path to the file
+    """
+
+    directory, name = os.path.split(_Key(path))
+    with _lock:
+        _counts["queries"] += 1
+        listing = _Listing(directory)
+        return listing is not None and listing.get(name) is False
+
+
+def IsDir(path, *args, **kwargs):
+    """
+    Returns whether a directory exists.
+
+    Arguments:
+    path -- str: Path to the directory
+    """
+
+    path = _Key(path)
+    with _lock:
+        _counts["queries"] += 1
+        if path in _snapshots:
+            return _snapshots[path] is not None
+
+        parent, name = os.path.split(path)
+        if name == "":  # the root
+            return True
+        listing = _Listing(parent)
+        return listing is not None and listing.get(name) is True
+
+
+def MakeDirs(path, *args, **kwargs):
+    """
+    Creates a directory and any missing parents, if it does not exist.
+
+    Arguments:
+    path -- str: Path to the directory
+
+    Returns:
+    made -- bool: Whether the directory had to be made
+    """
+
+    if IsDir(path):
+        return False
+
+    pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+
+    # Updating the listings of the new directory and its new parents
+    path = _Key(path)
+    with _lock:
+        _counts["mkdirs"] += 1
+        while True:
+            parent, name = os.path.split(path)
+            if name == "":
+                break
+            _Changed(path)
+            _Changed(parent)
+            if _snapshots.get(path, {}) is None:
+                del _snapshots[path]
+            listing = _snapshots.get(parent)
+            if listing is not None:
+                listing[name] = True
+                break
+            path = parent
+    return True
+
+
+def Added(path, isDirectory=False, *args, **kwargs):
+    """
+    Records a file or directory created by the scripts.
+
+    Arguments:
+    path        -- str: Path to what was created
+    isDirectory -- bool: Whether it is a directory
+    """
+
+    directory, name = os.path.split(_Key(path))
+    with _lock:
+        _Changed(directory)
+        listing = _snapshots.get(directory)
+        if listing is not None:
+            listing[name] = isDirectory
+
+
+def Removed(path, *args, **kwargs):
+    """
+    Records a file or directory deleted by the scripts.
+
+    Arguments:
+    path -- str: Path to what was deleted
+    """
+
+    path = _Key(path)
+    directory, name = os.path.split(path)
+    with _lock:
+        _Changed(directory)
+        _Changed(path)
+        listing = _snapshots.get(directory)
+        if listing is not None:
+            listing.pop(name, None)
+        _snapshots.pop(path, None)
+
+
+def Invalidate(directory, *args, **kwargs):
+    """
+    Forgets the listing of a directory, so it is scanned again when needed.
+
+    Arguments:
+    directory -- str: Path to the directory
+    """
+
+    directory = _Key(directory)
+    with _lock:
+        _Changed(directory)
+        _snapshots.pop(directory, None)
+
+
+def Clear(*args, **kwargs):
+    """Forgets all listings."""
+
+    with _lock:
+        _clears[0] += 1
+        _snapshots.clear()
+        _changes.clear()
+
+
+def Counts(*args, **kwargs):
+    """Returns the numbers of metadata operations done so far, as a dict."""
+
+    with _lock:
+        return dict(_counts)
+
+
+def Summary(*args, **kwargs):
+    """Returns a line describing the metadata operations of this process."""
+
+    return (
+        f'{_counts["scans"]} directories scanned, {_counts["mkdirs"]} made, '
+        f'{_counts["queries"]} existence queries answered from the listings'
+    )
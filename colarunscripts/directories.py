@@ -1,7 +1,18 @@
 """
 Module for constructing the required directory and file paths.
 
+Loose correlation functions are kept in the cfuns/ directory of each
+(kappa, kd, shift), laid out as set by cfunLayout in runValues:
+  flat   -- (default) All in cfuns/ itself
+  config -- In a subdirectory cfuns/cfg<cfgID>/ for each configuration, so no
+            directory holds more than the cfuns of one cfungen call and a
+            config's cfuns are found by listing a directory of its own
+Tars are in cfuns/ whatever the layout. Trees are converted between layouts
+with
+    python campaign.py migrate-layout
+
 Main functions:
+  CfunLayout           -- Returns the layout of the loose cfuns
   GetBaseDirectories   -- Constructs the directory paths without replacement of
                           value placeholders
   FullDirectories      -- Replaces the placeholders and makes the directories
@@ -10,11 +21,11 @@ Main functions:
 """
 
 import os.path  # For getting directories from filepaths
-import pathlib  # For making directories
 import pprint  # For nice printing of dictionaries
 from argparse import Namespace  # For converting dictionaries to namespaces
 
 from colarunscripts import configIDs as cfg
+from colarunscripts import dirCache
 from colarunscripts.particles import QuarkCharge
 from colarunscripts.shifts import FormatShift
 from colarunscripts.utilities import GetEnvironmentVar
@@ -22,6 +33,18 @@ from colarunscripts.utilities import GetEnvironmentVar
 # Just for nice printing of dictionaries. print -> pp
 pp = pprint.PrettyPrinter(indent=4).pprint
 
+# Supported values of cfunLayout, with the subdirectory of cfuns/ they use
+CFUNLAYOUTS = {"flat": "", "config": "cfgCONFIGID/"}
+
+
+def CfunLayout(parameters, *args, **kwargs):
+    """Returns the layout of the loose cfuns set in the parameters."""
+
+    layout = parameters["runValues"].get("cfunLayout", "flat")
+    if layout not in CFUNLAYOUTS:
+        raise ValueError(f"Unknown cfunLayout {layout}")
+    return layout
+
 
 def GetBaseDirectories(parameters, directory=None, *args, **kwargs):
     """
@@ -55,7 +78,9 @@ def GetBaseDirectories(parameters, directory=None, *args, **kwargs):
     reportDir = outputDir + "reports/"
 
     # Appending output file names and saving to directories dictionary
-    directories["cfun"] = outputDir + "cfuns/" + base.cfunFileBase
+    directories["cfun"] = (
+        outputDir + "cfuns/" + CFUNLAYOUTS[CfunLayout(parameters)] + base.cfunFileBase
+    )
     directories["propReport"] = reportDir + base.propFileBase + ".proprep"
     directories["cfunReport"] = (
         reportDir + base.cfunFileBase + "CONFIGIDsiSINK_STRUCTURE.cfunrep"
@@ -78,6 +103,8 @@ def GetBaseDirectories(parameters, directory=None, *args, **kwargs):
     directories["stdout"] = runFileDir + "stdout/" + base.runIdentifier
     # parameter file copies
     directories["parameters"] = runFileDir + "parameters/"
+    # artifact ledger
+    directories["ledger"] = runFileDir + "ledger/" + base.runIdentifier
 
     if tempDir != "NONE/":
         runFileDir = tempDir
@@ -121,6 +148,7 @@ def FullDirectories(
     cfgID="",
     structure=[],
     kH=0,
+    makeDirs=True,
     *args,
     **kwargs,
 ):
@@ -130,6 +158,8 @@ def FullDirectories(
     Key-word arguments:
     directory -- string, string list: Optional argument to specify specific
                                       file paths to make and return
+    makeDirs  -- bool: Whether to create directories that do not exist.
+                       Existence checkers pass False to avoid the stat calls.
     Other key-word arguments: See their default value for their proper type.
                               Are all used for replacement of placeholders
     """
@@ -172,14 +202,17 @@ def FullDirectories(
         replaced = replaced.replace("NY", str(parameters["lattice"]["extent"][1]))
         directories[filetype] = replaced
 
+    if makeDirs is False:
+        return directories
+
     # Create directories that do not exist
     for directory in directories.values():
         # Extracting just the directory path
         path = os.path.dirname(directory)
-        if pathlib.Path(path).is_dir() is False:
+        if dirCache.IsDir(path) is False:
             print(f"Making directory {path}")
             try:
-                pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+                dirCache.MakeDirs(path)
             except PermissionError:
                 print(f"Permission to create {directory} denied")
 
@@ -194,6 +227,7 @@ def LapModeFiles(
     shift="",
     quark=None,
     withExtension=True,
+    makeDirs=True,
     *args,
     **kwargs,
 ):
@@ -203,11 +237,12 @@ def LapModeFiles(
     If quark is not specified, the charge passed is not adjusted for
     flavour. It is assumed that is already done
     Arguments:
-    kappa -- int: Kappa value for the eigenmodes
-    kd    -- int: The field strength
-    cfgID -- str: The configuration identifier
-    quark -- str or list of str: The quark, or list of quarks to
-                  return
+    kappa    -- int: Kappa value for the eigenmodes
+    kd       -- int: The field strength
+    cfgID    -- str: The configuration identifier
+    quark    -- str or list of str: The quark, or list of quarks to
+                     return
+    makeDirs -- bool: Whether to create directories that do not exist
 
     Returns:
     lapModeFiles -- dict: Dictionary of eigenmode file paths.
@@ -267,10 +302,10 @@ def LapModeFiles(
 
         # Making directory if it doesn't exist
         path = os.path.dirname(lapModeFiles[quark])
-        if pathlib.Path(path).is_dir() is False:
+        if makeDirs is True and dirCache.IsDir(path) is False:
             print(f"Making directory {path}")
             try:
-                pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+                dirCache.MakeDirs(path)
             except PermissionError:
                 print(f"Permission to create {path} denied")
 
@@ -280,7 +315,17 @@ def LapModeFiles(
 
 
 def GetCfunFile(
-    parameters, kappa, kd, shift, sourceType, sinkType, sinkVal, cfgID, *args, **kwargs
+    parameters,
+    kappa,
+    kd,
+    shift,
+    sourceType,
+    sinkType,
+    sinkVal,
+    cfgID,
+    makeDirs=True,
+    *args,
+    **kwargs,
 ):
 
     cfunBase = FullDirectories(
@@ -290,6 +335,8 @@ def GetCfunFile(
         kd=kd,
         shift=shift,
         sourceType=sourceType,
+        cfgID=cfgID,
+        makeDirs=makeDirs,
         **parameters["sourcesink"],
     )["cfun"]
 
@@ -0,0 +1,154 @@
+"""
+Module for the write-ahead journal of appends to the correlation function tars.
+
+Putting cfuns in a tar takes several steps: the archive is appended to and
+synced, the cfuns are deleted, then their ID and names are added to the
+sidecars (see cfgSidecar.py). A job killed at walltime part way through
+would leave a tar cut short, or cfuns in the tar which the sidecars do not
+know about and so are made again.
+
+Before the archive is touched a <tar>journal is written, recording the part
+of the archive the append overwrites (see archive.Tail) and the cfuns going
+in. It is marked appended once the archive is synced, and removed once the
+rest is done. The next job to lock the tar replays any journal left behind:
+  append   -- The archive may be partly written, so is put back as it was.
+              The cfuns were not yet deleted, so are tarred again later.
+  appended -- The archive is complete, so the cfuns still there are deleted
+              and the sidecars written.
+Either way the tar is left as a finished append would have left it, without
+reading through it.
+
+Main functions:
+  JournalFile -- Returns the path of the journal of a tar
+  Begin       -- Writes the journal before an append
+  Appended    -- Marks the archive of the append as complete
+  End         -- Removes the journal once the append is done
+  Replay      -- Rolls back or completes an append left by a killed job
+"""
+
+# standard library modules
+import base64  # for keeping the tail in the journal
+import json  # journal format
+import os  # for removing the journal and cfuns
+
+# local modules
+from colarunscripts import archive, cfgSidecar, dirCache
+from colarunscripts.utilities import AtomicWrite
+
+# Suffix of the journal, as <tar><suffix>
+SUFFIX = "journal"
+
+
+def JournalFile(tarPath, *args, **kwargs):
+    """Returns the path of the journal of a tar."""
+    return tarPath + SUFFIX
+
+
+def _Write(tarPath, entry):
+    """Writes the journal, replacing any there already."""
+
+    with AtomicWrite(JournalFile(tarPath)) as f:
+        json.dump(entry, f)
+
+
+def _Read(tarPath):
+    """Reads the journal of a tar. Returns None if there is none."""
+
+    try:
+        with open(JournalFile(tarPath), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def Begin(tarPath, cfunList, cfgID, members, *args, **kwargs):
+    """
+    Writes the journal of a tar before appending to it. The tar must be locked.
+
+    Arguments:
+    tarPath  -- str: Path to the tar
+    cfunList -- list: The cfuns going in, deleted once the append is done
+    cfgID    -- str: Config ID of the cfuns, for the cfgSidecar sidecars. None
+                     if the sidecars are written by the caller.
+    members  -- list: Member names of the cfuns in the tar
+    """
+
+    tail = archive.Tail(tarPath)
+    if tail is not None:
+        offset, data, mtime = tail
+        tail = [offset, base64.b64encode(data).decode(), mtime]
+    _Write(
+        tarPath,
+        {
+            "stage": "append",
+            "tail": tail,
+            "cfuns": cfunList,
+            "cfgID": cfgID,
+            "members": members,
+        },
+    )
+
+
+def Appended(tarPath, *args, **kwargs):
+    """Marks the archive of the append to a tar as complete."""
+
+    entry = _Read(tarPath)
+    entry["stage"] = "appended"
+    # The tail is no longer needed
+    entry["tail"] = None
+    _Write(tarPath, entry)
+
+
+def End(tarPath, *args, **kwargs):
+    """Removes the journal of a tar once the append is done."""
+
+    try:
+        os.remove(JournalFile(tarPath))
+    except FileNotFoundError:
+        pass
+
+
+def Replay(tarPath, *args, **kwargs):
+    """
+    Rolls back or completes an append to a tar left by a killed job.
+
+    The tar must be locked.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    stage -- str: Stage the append was left at, None if there was no journal
+    """
+
+    entry = _Read(tarPath)
+    if entry is None:
+        return None
+
+    if entry["stage"] == "append":
+        print(f"Rolling back interrupted append to {tarPath}")
+        tail = entry["tail"]
+        if tail is not None:
+            offset, data, mtime = tail
+            tail = (offset, base64.b64decode(data), mtime)
+        archive.Restore(tarPath, tail)
+        for path in archive.Files(tarPath):
+            if tail is None:
+                dirCache.Removed(path)
+            else:
+                dirCache.Added(path)
+    else:
+        print(f"Completing interrupted append to {tarPath}")
+        for cfun in entry["cfuns"]:
+            try:
+                os.remove(cfun)
+            except FileNotFoundError:
+                pass
+            dirCache.Removed(cfun)
+        if entry["cfgID"] is not None:
+            cfgSidecar.Append(tarPath, entry["cfgID"], entry["members"])
+            for sidecar in cfgSidecar.SIDECARS:
+                dirCache.Added(tarPath + sidecar)
+
+    End(tarPath)
+    return entry["stage"]
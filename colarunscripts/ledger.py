@@ -0,0 +1,342 @@
+"""
+Module for the SQLite ledger of produced eigenmodes, propagators and cfuns.
+
+When useLedger is True in runValues, the makers record every artifact they
+produce or delete in the ledger, and all skip/exists decisions query it
+rather than probing the filesystem. Artifacts are keyed by their physical
+parameters:
+  kind, kappa, cfgID, kd (effective, ie. charge adjusted), shift, source,
+  sink, structure, particles (chi+chibar)
+along with the path they were written to. Artifacts on temporary job storage
+have a different path in every job, so they are only found by the job that
+made them.
+
+The ledger can be rebuilt from what is on disk with
+    python campaign.py reconcile
+(see artifacts.py). It is rebuilt into a table of its own, which replaces
+the ledger in one short transaction once done, so running jobs are not kept
+waiting while the disk is scanned.
+
+The ledger is one SQLite database in runFiles/ledger/, shared by every job
+through SQLite's own locking, which uses POSIX locks. It must be on a
+filesystem where those work. SQLite's locking is unreliable over NFS and
+Lustre, so runFiles/ on those may corrupt the ledger.
+
+Main functions:
+  ArtifactExists -- Whether an artifact exists, via the ledger if enabled
+  Record         -- Records produced artifacts
+  Remove         -- Removes deleted artifacts
+  StartRebuild   -- Starts rebuilding the ledger into a table of its own
+  RecordRebuild  -- Records artifacts found on disk in the rebuilt ledger
+  FinishRebuild  -- Replaces the ledger with the rebuilt one
+"""
+
+# standard library modules
+import sqlite3  # the ledger itself
+
+# local modules
+from colarunscripts import dirCache
+from colarunscripts import directories as dirs
+
+# Order of the columns in the artifacts table and in rows
+COLUMNS = (
+    "kind",
+    "kappa",
+    "cfgID",
+    "kd",
+    "shift",
+    "source",
+    "sink",
+    "structure",
+    "particles",
+    "path",
+)
+INSERT = f"INSERT OR REPLACE INTO artifacts VALUES ({', '.join(len(COLUMNS) * '?')})"
+
+# Table the ledger is rebuilt into before replacing it
+REBUILD = "rebuild"
+REBUILD_INSERT = INSERT.replace("artifacts", REBUILD, 1)
+
+# Open connections, keyed by ledger file. One per process.
+_connections = {}
+
+
+def Enabled(parameters, *args, **kwargs):
+    """Returns whether the ledger is turned on in the parameters."""
+    return parameters["runValues"].get("useLedger", False) is True
+
+
+def LedgerFile(parameters, *args, **kwargs):
+    """Returns the path to the ledger database, making its directory."""
+    return (
+        dirs.FullDirectories(parameters, directory="ledger")["ledger"]
+        + "artifacts.sqlite"
+    )
+
+
+def Connect(parameters, *args, **kwargs):
+    """
+    Returns the connection to the ledger, creating the ledger if required.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    ledgerFile = LedgerFile(parameters)
+    if ledgerFile in _connections:
+        return _connections[ledgerFile]
+
+    # Long timeout as several jobs may be writing at once
+    connection = sqlite3.connect(ledgerFile, timeout=300)
+    with connection:
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS artifacts ({', '.join(COLUMNS)}, "
+            f"PRIMARY KEY ({', '.join(COLUMNS[:-1])}))"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS artifactsByConfig "
+            "ON artifacts (kappa, cfgID, kind)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS artifactsByPath ON artifacts (path)"
+        )
+    _connections[ledgerFile] = connection
+    return connection
+
+
+def Row(
+    kind,
+    path,
+    kappa,
+    cfgID,
+    kd=0,
+    shift="",
+    source="",
+    sink="",
+    structure="",
+    particles="",
+    *args,
+    **kwargs,
+):
+    """
+    Returns a ledger row with the columns in the right order.
+
+    Arguments:
+    kind      -- str: emode, prop or cfun
+    path      -- str: Where the artifact is (or would be) on disk
+    Remaining arguments are the physical parameters of the artifact. kd
+    should already be adjusted for quark charge.
+    """
+    return (
+        kind,
+        int(kappa),
+        cfgID,
+        int(kd),
+        shift,
+        source,
+        sink,
+        structure,
+        particles,
+        path,
+    )
+
+
+def SourceLabel(parameters, sourceType, *args, **kwargs):
+    """Returns the source label, ie. sm250, as used in filenames."""
+
+    sourcesink = parameters["sourcesink"]
+    if sourceType in ["sm", "lpsm", "lpxyz", "xyz"]:
+        return f'{sourceType}{sourcesink["sweeps_smsrc"]}'
+    elif sourceType == "lp":
+        return f'{sourceType}{sourcesink["nModes_lpsrc"]}'
+    return sourceType
+
+
+def SinkLabel(sinkType, sinkVal, *args, **kwargs):
+    """Returns the sink label, ie. lp96, as used in cfun filenames."""
+
+    if sinkType == "laplacian":
+        return f"lp{sinkVal}"
+    elif sinkType == "smeared":
+        return f"sm{sinkVal}"
+    raise ValueError(f"Unknown sink type {sinkType}")
+
+
+def ArtifactExists(parameters, row, *args, **kwargs):
+    """
+    Returns whether an artifact exists.
+
+    Queries the ledger if it is enabled, otherwise checks the file.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    row        -- tuple: The artifact, as returned by Row
+    """
+
+    if Enabled(parameters) is False:
+        return dirCache.IsFile(row[-1])
+
+    where = " AND ".join(f"{column}=?" for column in COLUMNS)
+    found = (
+        Connect(parameters)
+        .execute(f"SELECT 1 FROM artifacts WHERE {where}", row)
+        .fetchone()
+    )
+    return found is not None
+
+
+def ExistingPaths(parameters, kind, kappa, cfgID, *args, **kwargs):
+    """
+    Returns the set of recorded paths of one kind for a configuration.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    kind       -- str: emode, prop or cfun
+    kappa      -- int: The kappa value
+    cfgID      -- str: The configuration ID
+    """
+
+    rows = Connect(parameters).execute(
+        "SELECT path FROM artifacts WHERE kappa=? AND cfgID=? AND kind=?",
+        (int(kappa), cfgID, kind),
+    )
+    return {path for (path,) in rows}
+
+
+def Record(parameters, rows, *args, **kwargs):
+    """
+    Records produced artifacts. Does nothing if the ledger is disabled.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    rows       -- list: List of rows, as returned by Row
+    """
+
+    if Enabled(parameters) is False:
+        return
+
+    connection = Connect(parameters)
+    with connection:
+        connection.executemany(INSERT, rows)
+
+
+def RecordIfPresent(parameters, rows, *args, **kwargs):
+    """
+    Records those artifacts whose files were actually written.
+
+    Used straight after calling a binary, which may have failed (or been
+    skipped in a dry run). The binary's output directory must have been
+    invalidated in dirCache. Does nothing if the ledger is disabled.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    rows       -- list: List of rows, as returned by Row
+    """
+
+    if Enabled(parameters) is False:
+        return
+
+    Record(parameters, [row for row in rows if dirCache.IsFile(row[-1])])
+
+
+def Remove(parameters, paths, *args, **kwargs):
+    """
+    Removes deleted artifacts. Does nothing if the ledger is disabled.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    paths      -- list: Paths of the deleted artifacts
+    """
+
+    if Enabled(parameters) is False:
+        return
+
+    connection = Connect(parameters)
+    with connection:
+        connection.executemany(
+            "DELETE FROM artifacts WHERE path=?", [(path,) for path in paths]
+        )
+
+
+def _DropRebuild(connection):
+    """Removes the rebuild table and its triggers, ie. left by a killed rebuild."""
+
+    connection.execute(f"DROP TRIGGER IF EXISTS {REBUILD}Insert")
+    connection.execute(f"DROP TRIGGER IF EXISTS {REBUILD}Delete")
+    connection.execute(f"DROP TABLE IF EXISTS {REBUILD}")
+
+
+def StartRebuild(parameters, *args, **kwargs):
+    """
+    Starts rebuilding the ledger into an empty table of its own.
+
+    Artifacts recorded and removed by running jobs meanwhile are copied into
+    it by triggers, so are kept when it replaces the ledger. Only one rebuild
+    may run at a time.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    new = ", ".join(f"NEW.{column}" for column in COLUMNS)
+    connection = Connect(parameters)
+    with connection:
+        _DropRebuild(connection)
+        connection.execute(
+            f"CREATE TABLE {REBUILD} ({', '.join(COLUMNS)}, "
+            f"PRIMARY KEY ({', '.join(COLUMNS[:-1])}))"
+        )
+        connection.execute(
+            f"CREATE TRIGGER {REBUILD}Insert AFTER INSERT ON artifacts "
+            f"BEGIN INSERT OR REPLACE INTO {REBUILD} VALUES ({new}); END"
+        )
+        connection.execute(
+            f"CREATE TRIGGER {REBUILD}Delete AFTER DELETE ON artifacts "
+            f"BEGIN DELETE FROM {REBUILD} WHERE path=OLD.path; END"
+        )
+
+
+def RecordRebuild(parameters, rows, *args, **kwargs):
+    """
+    Records artifacts found on disk in the rebuilt ledger.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    rows       -- list: List of rows, as returned by Row
+    """
+
+    connection = Connect(parameters)
+    with connection:
+        connection.executemany(REBUILD_INSERT, rows)
+
+
+def FinishRebuild(parameters, *args, **kwargs):
+    """
+    Replaces the ledger with the rebuilt one, in a single transaction.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    connection = Connect(parameters)
+    with connection:
+        connection.execute(f"DROP TRIGGER {REBUILD}Insert")
+        connection.execute(f"DROP TRIGGER {REBUILD}Delete")
+        connection.execute("DELETE FROM artifacts")
+        connection.execute(f"INSERT INTO artifacts SELECT * FROM {REBUILD}")
+        connection.execute(f"DROP TABLE {REBUILD}")
+
+
+def Status(parameters, *args, **kwargs):
+    """
+    Returns the number of recorded artifacts by kappa and kind.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    """
+
+    rows = Connect(parameters).execute(
+        "SELECT kappa, kind, COUNT(*), COUNT(DISTINCT cfgID) FROM artifacts "
+        "GROUP BY kappa, kind ORDER BY kappa, kind"
+    )
+    return rows.fetchall()
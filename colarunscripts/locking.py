@@ -0,0 +1,631 @@
+"""
+Module for taking exclusive locks on files shared between jobs.
+
+Locks are POSIX (fcntl) byte range locks on a <file>.lock file, so they are
+released by the operating system if the holder dies. Waiting jobs are served
+in the order they arrived. Each contender takes a ticket from a counter in
+the lock file, and the lock is only taken by the holder of the next ticket
+to be served. Contenders also lock a byte of their own for as long as their
+ticket is wanted, so a ticket whose holder has given up or died is seen to
+be unlocked and skipped straight away.
+
+Some filesystems do not support POSIX locks. There, the lock is instead a
+<file>.lock.link file created atomically with os.link, which also works
+over NFS. Those locks are not fair.
+
+Every lock records its owner: host, PID, job ID, when it was taken and the
+lease it was taken with. A lock whose owner is a process that no longer
+exists on this host is stale and is taken over by the job waiting on it.
+A live owner on this host is never stale, however long it holds the lock, as
+it is not told it has lost it and would keep writing. Owners on other hosts
+cannot be checked, so are stale once their lease has expired. POSIX locks of
+dead processes are already released by the operating system, so for them
+this covers dead nodes the lock server has not noticed. The owner record is
+only written and cleared while the counters are locked, together with taking
+and releasing the lock, and a lock is only taken over if the lock byte is
+still held, so a record left by a holder which died is never mistaken for
+that of the job which took the lock after it. The lock file is replaced,
+and waiters on the old one start again on the new one. Sweep finds
+and clears stale locks, including the .status files used before locking was
+added, across a whole directory tree.
+
+Waiting is bounded by a timeout, after which LockTimeout is raised. Time
+spent waiting is appended to a list, if one is given, so that threads sharing
+a simpleTime.Timer each keep their own and AddWaits adds them to its
+"Lock wait" timer afterwards.
+
+Main functions:
+  Locked   -- Context manager holding the lock on a file
+  Stale    -- Whether the owner of a lock is dead, or its lease expired
+  Sweep    -- Clears the stale locks in a directory tree
+  AddWaits -- Adds time spent waiting to a timer
+  Summary  -- Returns the number of locks taken and the time spent waiting
+"""
+
+# standard library modules
+import contextlib  # for the context manager
+import errno  # for identifying unsupported locking
+import fcntl  # for the locks themselves
+import json  # owner record format
+import os  # for low level file access
+import random  # for spreading out retries
+import struct  # for the ticket counters
+import time  # for sleeping and timing
+
+# local modules
+from colarunscripts.utilities import GetJobID
+
+# Name of the timer lock waits are added to
+TIMER = "Lock wait"
+
+# Default seconds to wait for a lock before giving up
+TIMEOUT = 1800
+
+# Default seconds a lock may be held before other jobs may take it over
+LEASE = 3600
+
+# Layout of the lock file. Two counters, the next ticket to hand out and the
+# next ticket to be served, then the byte which is actually locked, then one
+# byte per ticket. Locks beyond the end of the file are allowed, so the file
+# itself only holds the counters and, while the lock is held, the owner.
+COUNTERS = struct.Struct("<QQ")
+LOCKBYTE = COUNTERS.size
+OWNER = 64
+
+# struct flock, for asking whether the lock byte is held (F_GETLK)
+FLOCK = struct.Struct("hhqqi")
+
+# errnos meaning the filesystem does not do POSIX locks
+UNSUPPORTED = (errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+# Locks taken, contended and time spent waiting by this process
+_stats = {"locks": 0, "contended": 0, "waited": 0.0, "longest": 0.0, "takeovers": 0}
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a lock cannot be taken within the timeout."""
+
+
+def LockFile(filePath, *args, **kwargs):
+    """Returns the path of the lock file of a file."""
+    return filePath + ".lock"
+
+
+def _Sleep(attempt, remaining):
+    """Sleeps for a short, growing, randomised time."""
+    wait = min(0.05 * 2**attempt, 2.0) * random.uniform(0.5, 1.5)
+    time.sleep(max(min(wait, remaining), 0))
+
+
+def _TicketByte(ticket):
+    """Returns the offset of the byte locked by the holder of a ticket."""
+    return LOCKBYTE + 1 + ticket
+
+
+def _ReadCounters(fd):
+    """Returns the next ticket to hand out and the next to serve."""
+    data = os.pread(fd, COUNTERS.size, 0)
+    if len(data) < COUNTERS.size:
+        return 0, 0
+    return COUNTERS.unpack(data)
+
+
+def _TakeTicket(fd):
+    """Takes the next ticket from the counter in the lock file."""
+
+    # The counters are only changed while their bytes are locked
+    fcntl.lockf(fd, fcntl.LOCK_EX, COUNTERS.size, 0)
+    try:
+        ticket, serving = _ReadCounters(fd)
+        os.pwrite(fd, COUNTERS.pack(ticket + 1, serving), 0)
+        # Held until the lock is released, or this process gives up or dies
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, _TicketByte(ticket))
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, COUNTERS.size, 0)
+    return ticket
+
+
+def _Wanted(fd, ticket):
+    """Returns whether the holder of a ticket is still waiting or holding."""
+
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_SH | fcntl.LOCK_NB, 1, _TicketByte(ticket))
+    except (BlockingIOError, PermissionError):
+        return True
+    fcntl.lockf(fd, fcntl.LOCK_UN, 1, _TicketByte(ticket))
+    return False
+
+
+def _Advance(fd, ticket):
+    """Moves the queue on past ticket. The counters must be locked."""
+
+    nextTicket, serving = _ReadCounters(fd)
+    if serving == ticket:
+        os.pwrite(fd, COUNTERS.pack(nextTicket, ticket + 1), 0)
+
+
+def _Serve(fd, ticket):
+    """Moves the queue on past ticket, if it is the one being served."""
+
+    fcntl.lockf(fd, fcntl.LOCK_EX, COUNTERS.size, 0)
+    try:
+        _Advance(fd, ticket)
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, COUNTERS.size, 0)
+
+
+def _Take(fd, lease):
+    """
+    Tries to take the lock byte, recording this process as its owner.
+
+    The counters are locked meanwhile, so the record is never that of a
+    previous holder while the lock byte is held.
+
+    Returns:
+    taken -- bool: Whether the lock was taken
+    """
+
+    fcntl.lockf(fd, fcntl.LOCK_EX, COUNTERS.size, 0)
+    try:
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, LOCKBYTE)
+        except (BlockingIOError, PermissionError):
+            return False
+        _WriteOwner(fd, lease)
+        return True
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, COUNTERS.size, 0)
+
+
+def _Release(fd, ticket):
+    """Clears the owner record, serves the next ticket and releases the lock."""
+
+    fcntl.lockf(fd, fcntl.LOCK_EX, COUNTERS.size, 0)
+    try:
+        _ClearOwner(fd)
+        _Advance(fd, ticket)
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, LOCKBYTE)
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, COUNTERS.size, 0)
+
+
+def _Held(fd):
+    """
+    Returns whether another process holds the lock byte, without taking it.
+
+    Locks of this process are not reported, so a probe never releases the
+    lock held by another thread.
+    """
+
+    query = FLOCK.pack(fcntl.F_WRLCK, os.SEEK_SET, LOCKBYTE, 1, 0)
+    result = FLOCK.unpack(fcntl.fcntl(fd, fcntl.F_GETLK, query))
+    return result[0] != fcntl.F_UNLCK
+
+
+def Owner(lease=LEASE, *args, **kwargs):
+    """Returns the owner record of a lock taken by this process."""
+
+    return {
+        "host": os.uname().nodename,
+        "pid": os.getpid(),
+        "jobID": GetJobID(os.environ),
+        "time": time.time(),
+        "lease": lease,
+    }
+
+
+def _WriteOwner(fd, lease):
+    """Records this process as the holder of the lock in a lock file."""
+
+    record = json.dumps(Owner(lease)).encode()
+    os.pwrite(fd, record, OWNER)
+    os.ftruncate(fd, OWNER + len(record))
+
+
+def _ClearOwner(fd):
+    """Removes the owner record from a lock file, keeping the counters."""
+    os.ftruncate(fd, LOCKBYTE)
+
+
+def _ReadOwner(fd):
+    """Returns the owner record of a lock file, or None if there is none."""
+
+    record = os.pread(fd, 4096, OWNER)
+    try:
+        return json.loads(record)
+    except ValueError:
+        return None
+
+
+def _FileOwner(path, lease=LEASE):
+    """
+    Returns the owner record held in a link lock or legacy status file.
+
+    Files without a record, ie. status files, are owned by nobody known and
+    leased from when they were last modified.
+
+    Returns:
+    owner -- dict: The owner record, or None if the file does not exist
+    """
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        pass
+
+    try:
+        modified = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+    return {"host": None, "pid": None, "jobID": None, "time": modified, "lease": lease}
+
+
+def Stale(owner, *args, **kwargs):
+    """
+    Returns whether the owner of a lock is dead or its lease has expired.
+
+    Whether a process is alive can only be checked on the host it ran on.
+    Owners on this host are stale only if dead, and owners on other hosts,
+    or unknown owners, only once their lease expires.
+
+    Arguments:
+    owner -- dict: The owner record, as from Owner. None is never stale.
+    """
+
+    if owner is None:
+        return False
+
+    if owner["host"] == os.uname().nodename:
+        try:
+            os.kill(owner["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            # Alive, but owned by another user
+            pass
+        # Alive, so still writing whatever its lease says
+        return False
+    return time.time() > owner["time"] + owner["lease"]
+
+
+def Describe(owner, *args, **kwargs):
+    """Returns a short description of the owner of a lock."""
+
+    if owner is None or owner["host"] is None:
+        return "unknown owner"
+    taken = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(owner["time"]))
+    return (
+        f'job {owner["jobID"]} (pid {owner["pid"]} on {owner["host"]}, taken {taken})'
+    )
+
+
+def _Replaced(fd, lockFile):
+    """Returns whether the lock file has been replaced since fd was opened."""
+
+    try:
+        current = os.stat(lockFile)
+    except FileNotFoundError:
+        return True
+    opened = os.fstat(fd)
+    return (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino)
+
+
+def _TakeOver(fd, lockFile, owner):
+    """
+    Replaces a lock file whose holder is stale with an empty one.
+
+    The counters are locked while checking and replacing, so only the first
+    contender to find the holder stale replaces the file. The lock byte must
+    still be held, and by the owner found stale, as the record is only
+    changed while the counters are locked. A record left by a holder which
+    died, with the lock byte free, is left to be replaced by the next holder.
+
+    Returns:
+    takenOver -- bool: Whether this process replaced the file
+    """
+
+    fcntl.lockf(fd, fcntl.LOCK_EX, COUNTERS.size, 0)
+    try:
+        if _Replaced(fd, lockFile) or _ReadOwner(fd) != owner or not _Held(fd):
+            return False
+        tempFile = f"{lockFile}.{os.uname().nodename}.{os.getpid()}.tmp"
+        os.close(os.open(tempFile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o664))
+        os.replace(tempFile, lockFile)
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN, COUNTERS.size, 0)
+
+    _stats["takeovers"] += 1
+    print(f"Took over stale lock {lockFile} from {Describe(owner)}")
+    return True
+
+
+def _BreakLink(path, owner, lease=LEASE):
+    """
+    Removes a link lock or status file whose owner is stale.
+
+    The file is first renamed, which only one contender can do, and put back
+    if it turns out another job took the lock in the meantime.
+
+    Returns:
+    broken -- bool: Whether this process removed the file
+    """
+
+    staleFile = f"{path}.{os.uname().nodename}.{os.getpid()}.stale"
+    try:
+        os.rename(path, staleFile)
+    except FileNotFoundError:
+        return False
+
+    if _FileOwner(staleFile, lease) != owner:
+        try:
+            os.link(staleFile, path)
+        except FileExistsError:
+            print(f"Lock {path} was replaced while checking it was stale")
+        os.remove(staleFile)
+        return False
+
+    os.remove(staleFile)
+    _stats["takeovers"] += 1
+    print(f"Took over stale lock {path} from {Describe(owner)}")
+    return True
+
+
+def _AcquireFcntl(fd, lockFile, deadline, lease, *args, **kwargs):
+    """
+    Takes the lock byte of an open lock file, waiting for earlier tickets.
+
+    Arguments:
+    fd       -- int: The open lock file
+    lockFile -- str: Path to the lock file
+    deadline -- float: time.monotonic() after which LockTimeout is raised
+    lease    -- float: Seconds after which other jobs may take the lock over
+
+    Returns:
+    ticket -- int: The ticket the lock was taken with, or None if the lock
+                   file was replaced and must be opened again
+    """
+
+    ticket = _TakeTicket(fd)
+
+    attempt = 0
+    while True:
+        _, serving = _ReadCounters(fd)
+        if serving < ticket and _Wanted(fd, serving) is False:
+            # An earlier contender gave up or died, so skipping its ticket
+            _Serve(fd, serving)
+            continue
+
+        # Earlier tickets go first
+        if serving >= ticket and _Take(fd, lease):
+            return ticket
+
+        # The record is that of whichever ticket currently holds the lock
+        owner = _ReadOwner(fd)
+        if Stale(owner):
+            _TakeOver(fd, lockFile, owner)
+        if _Replaced(fd, lockFile):
+            return None
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LockTimeout("Could not take lock within the timeout")
+        _Sleep(attempt, remaining)
+        attempt += 1
+
+
+def _AcquireLink(lockFile, deadline, lease, *args, **kwargs):
+    """
+    Takes a lock by atomically linking a unique file to lockFile.link.
+
+    The unique file holds the owner record, so the lock does too.
+
+    Returns:
+    linkFile -- str: The lock, to be removed to release it
+    inode    -- int: Inode of the lock, to check it is still ours on release
+    """
+
+    linkFile = lockFile + ".link"
+    uniqueFile = f"{lockFile}.{os.uname().nodename}.{os.getpid()}"
+    with open(uniqueFile, "w") as f:
+        json.dump(Owner(lease), f)
+
+    attempt = 0
+    try:
+        while True:
+            try:
+                os.link(uniqueFile, linkFile)
+            except FileExistsError:
+                pass
+            except OSError:
+                # Over NFS the link may succeed even if an error is returned
+                pass
+            # Two links to the unique file means this process made the lock
+            unique = os.stat(uniqueFile)
+            if unique.st_nlink == 2:
+                return linkFile, unique.st_ino
+
+            owner = _FileOwner(linkFile)
+            if Stale(owner) and _BreakLink(linkFile, owner):
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LockTimeout("Could not take lock within the timeout")
+            _Sleep(attempt, remaining)
+            attempt += 1
+    finally:
+        os.remove(uniqueFile)
+
+
+@contextlib.contextmanager
+def Locked(filePath, timeout=TIMEOUT, waits=None, lease=LEASE, *args, **kwargs):
+    """
+    Holds an exclusive lock on a file for the duration of a with block.
+
+    Arguments:
+    filePath -- str: The file to lock. The lock itself is <filePath>.lock
+    timeout  -- float: Seconds to wait before raising LockTimeout
+    waits    -- list: List to append the seconds spent waiting to (optional)
+    lease    -- float: Seconds after which other jobs may take the lock over
+    """
+
+    lockFile = LockFile(filePath)
+    startTime = time.perf_counter()
+    deadline = time.monotonic() + timeout
+
+    fd = None
+    linkFile = None
+    try:
+        while True:
+            fd = os.open(lockFile, os.O_RDWR | os.O_CREAT, 0o664)
+            try:
+                ticket = _AcquireFcntl(fd, lockFile, deadline, lease)
+            except OSError as e:
+                if isinstance(e, LockTimeout) or e.errno not in UNSUPPORTED:
+                    raise
+                linkFile, inode = _AcquireLink(lockFile, deadline, lease)
+                break
+            if ticket is not None:
+                break
+            # Taken over from a stale holder, so starting again on the new file
+            os.close(fd)
+            fd = None
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        raise
+    finally:
+        waited = time.perf_counter() - startTime
+        if waits is not None:
+            waits.append(waited)
+
+    _stats["locks"] += 1
+    _stats["waited"] += waited
+    _stats["longest"] = max(_stats["longest"], waited)
+    if waited > 1:
+        _stats["contended"] += 1
+        print(f"Waited {waited:.1f}s for lock on {filePath}")
+
+    try:
+        yield
+    finally:
+        if linkFile is None:
+            if _Replaced(fd, lockFile):
+                print(f"Lock on {filePath} was taken over while held")
+            _Release(fd, ticket)
+        else:
+            try:
+                ours = os.stat(linkFile).st_ino == inode
+            except FileNotFoundError:
+                ours = False
+            if ours is True:
+                os.remove(linkFile)
+            else:
+                print(f"Lock on {filePath} was taken over while held")
+        os.close(fd)
+
+
+def _SweepLockFile(lockFile, dryRun):
+    """
+    Checks the holder of a POSIX lock file, replacing it if stale.
+
+    Returns:
+    state -- str: One of "free", "held", "stale" or "cleared" (free, with the
+                  record of a holder which died left behind)
+    owner -- dict: The owner record of the lock file
+    """
+
+    fd = os.open(lockFile, os.O_RDWR)
+    try:
+        # The record only changes while the counters are locked
+        fcntl.lockf(fd, fcntl.LOCK_EX, COUNTERS.size, 0)
+        try:
+            owner = _ReadOwner(fd)
+            held = _Held(fd)
+            if held is False and owner is not None and dryRun is False:
+                _ClearOwner(fd)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, COUNTERS.size, 0)
+
+        if held is True:
+            if Stale(owner) is False:
+                return "held", owner
+            if dryRun is False:
+                _TakeOver(fd, lockFile, owner)
+            return "stale", owner
+        return ("free" if owner is None else "cleared"), owner
+    finally:
+        os.close(fd)
+
+
+def Sweep(directory, lease=LEASE, dryRun=False, *args, **kwargs):
+    """
+    Clears every stale lock in a directory tree.
+
+    Arguments:
+    directory -- str: The directory to search
+    lease     -- float: Seconds after which locks without an owner record,
+                        ie. legacy .status files, are stale
+    dryRun    -- bool: Whether to only report the stale locks
+
+    Returns:
+    counts -- dict: Number of locks found in each state
+    """
+
+    counts = {"free": 0, "held": 0, "stale": 0, "cleared": 0}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".lock"):
+                try:
+                    state, owner = _SweepLockFile(path, dryRun)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED:
+                        raise
+                    continue
+            elif name.endswith(".lock.link") or name.endswith(".status"):
+                owner = _FileOwner(path, lease)
+                if owner is None:
+                    continue
+                state = "stale" if Stale(owner) else "held"
+                if state == "stale" and dryRun is False:
+                    _BreakLink(path, owner, lease)
+            else:
+                continue
+
+            counts[state] += 1
+            # Locks actually taken over are reported as they are
+            if state == "held" or (state == "stale" and dryRun is True):
+                print(f"{state:>6}: {path}, {Describe(owner)}")
+    return counts
+
+
+def AddWaits(timer, waits, *args, **kwargs):
+    """
+    Adds time spent waiting for locks to the "Lock wait" timer of a Timer.
+
+    Only to be called from the thread the timer belongs to, once the threads
+    which waited have finished.
+
+    Arguments:
+    timer -- Timer: Timer to add to. Its lock wait timer must be initialised.
+    waits -- list: Seconds spent waiting by each Locked, as appended by it
+    """
+
+    timer.timerDict[TIMER]["time"] += sum(waits)
+    timer.timerDict[TIMER]["numCalls"] += len(waits)
+
+
+def Summary(*args, **kwargs):
+    """Returns a line describing the locks taken by this process."""
+
+    return (
+        f'{_stats["locks"]} locks taken, {_stats["contended"]} contended, '
+        f'{_stats["waited"]:.1f}s spent waiting (longest {_stats["longest"]:.1f}s), '
+        f'{_stats["takeovers"]} taken over from stale holders'
+    )
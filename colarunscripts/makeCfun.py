@@ -9,35 +9,55 @@ This script is not intended to  be called fromthe command line
 """
 
 # standard library modules
-import glob  # for globbing created cfuns
+import concurrent.futures  # for writing several tars at once
+import os  # for path manipulation
 import pathlib  # for various path related operations
-import random  # for avoiding race conditions with tars
 import re  # for extracting tar file path
-import tarfile  # for managing the cfun tars
-import time  # for time.sleep
-import traceback  # allows printing of the full traceback
+import time  # for timing cfungen
 from datetime import datetime  # for writing out the time
 
 # local modules
 from colarunscripts import cfgenFiles as files
 from colarunscripts import configIDs as cfg
+from colarunscripts import dedupe, dirCache, locking
 from colarunscripts import directories as dirs
+from colarunscripts import artifacts
 from colarunscripts import particles as part
+from colarunscripts import provenance
+from colarunscripts import archive, backgroundTar, cfgSidecar, journal, shards
 from colarunscripts.makePropagator import CallMPI
 from colarunscripts.particles import QuarkCharge
 from colarunscripts.shifts import FormatShift
 from colarunscripts.utilities import pp
 
+# Seconds waited for tar locks by TarCfuns, which may be in the background
+# tar thread, to be added to the job's timer from the main thread
+_lockWaits = []
 
-def main(parameters, kd, shift, jobValues, timer, *args, **kwargs):
+
+def main(
+    parameters,
+    kd,
+    shift,
+    jobValues,
+    timer,
+    incomplete=None,
+    hashes=None,
+    *args,
+    **kwargs,
+):
     """
     Main function. Begins correlation function production process
 
     Arguments:
-    jobValues -- dict: Dictionary containing the job specific values such as
-                       kd, shift, nthConfig, etc...
-    timer     -- Timer: Timer object to manage timing of correlation function
-                       calculation time.
+    jobValues  -- dict: Dictionary containing the job specific values such as
+                        kd, shift, nthConfig, etc...
+    timer      -- Timer: Timer object to manage timing of correlation function
+                        calculation time.
+    incomplete -- dict: (sinkType, structure) to particle pairs to make, as
+                        from checkCfuns.IncompletePairs. None to make all.
+    hashes     -- dict: Provenance hashes, from manageJob.ExpectedProvenance.
+                        None if provenance is not being tracked.
     """
 
     # compiling the filestub for the input files to feed to cfungen
@@ -49,21 +69,39 @@ def main(parameters, kd, shift, jobValues, timer, *args, **kwargs):
     )
 
     # Calling the function that does all the work
-    MakeCorrelationFunctions(parameters, filestub, kd, shift, jobValues, timer)
+    MakeCorrelationFunctions(
+        parameters, filestub, kd, shift, jobValues, timer, incomplete, hashes
+    )
 
 
 def MakeCorrelationFunctions(
-    parameters, filestub, kd, shift, jobValues, timer, *args, **kwargs
+    parameters,
+    filestub,
+    kd,
+    shift,
+    jobValues,
+    timer,
+    incomplete=None,
+    hashes=None,
+    *args,
+    **kwargs,
 ):
     """
     Makes the input files and then the actual correlation functions.
 
+    Only (sinkType, structure) combinations in incomplete are made, and only
+    for the particle pairs listed for them.
+
     Arguments:
-    filestub  -- str: Base input filestub to pass to cfungenGPU.x
-    jobValues -- dict: Dictionary containing the job specific values such as
+    filestub   -- str: Base input filestub to pass to cfungenGPU.x
+    jobValues  -- dict: Dictionary containing the job specific values such as
                       kd, shift, nthConfig, etc...
-    timer     -- Timer: Timer object to manage timing of correlation function
+    timer      -- Timer: Timer object to manage timing of correlation function
                       calculation time.
+    incomplete -- dict: (sinkType, structure) to set of (chi, chibar) to make,
+                      with structure joined into a string. None to make all.
+    hashes     -- dict: Provenance hashes, from manageJob.ExpectedProvenance.
+                      None if provenance is not being tracked.
 
 
     """
@@ -77,6 +115,10 @@ def MakeCorrelationFunctions(
     for sinkType in jobValues["sinkTypes"]:
         jobValues["sinkType"] = sinkType
 
+        if incomplete is not None and sinkType not in {key[0] for key in incomplete}:
+            print(f"\nAll correlation functions exist for {sinkType=}, skipping")
+            continue
+
         with open(logFile, "a") as f:
             f.write(f"\nSink type: {sinkType}\n")
             f.write("\nInput files not dependent on structure:\n")
@@ -93,6 +135,18 @@ def MakeCorrelationFunctions(
                 print(f"\nskipping combination of {structure=} and {sinkType=}")
                 continue
 
+            # Restricting to the particle pairs which are missing something
+            if incomplete is None:
+                particleList = jobValues["particleList"]
+            else:
+                needed = incomplete.get((sinkType, "".join(structure)), set())
+                particleList = [
+                    pair for pair in jobValues["particleList"] if tuple(pair) in needed
+                ]
+                if len(particleList) == 0:
+                    print(f"\nCorrelation functions for {structure=} exist, skipping")
+                    continue
+
             interpLogFile = jobValues["inputSummary"]["interp"]
             with open(logFile, "a") as f, open(interpLogFile, "a") as g:
 
@@ -107,31 +161,24 @@ def MakeCorrelationFunctions(
                     print(f"{quark}: {propDict[quark]}")
                     f.write(f"{quark}: {propDict[quark]}\n")
 
-            print("Making structure specific files")
-            MakeSpecificFiles(
-                parameters,
-                filestub,
-                logFile,
-                kd,
-                shift,
-                structure,
-                propDict,
-                jobValues,
-            )
-
-            # Preparing final variables for call to cfungen
-            executable = parameters["propcfun"]["cfgenExecutable"]
-
-            scheduler = jobValues["scheduler"].lower()
-            numGPUs = parameters[scheduler + "Params"]["NUMGPUS"]
-            numCPUs = numGPUs
-            if numCPUs < parameters[scheduler + "Params"]["NUMGPUS"]:
-                print(
-                    f"WARNING: {numCPUs=}, {numGPUs=}, BUT cfungen generally requires equal numbers of CPUs and GPUs. This may cause issues."
+            deckHash = None
+            if hashes is not None:
+                deckHash = hashes["cfuns"][(sinkType, "".join(structure))]
+
+            # Reusing cfuns already made from identical input files
+            runList = particleList
+            if deckHash is not None and dedupe.Enabled(parameters):
+                runList = dedupe.Reuse(
+                    parameters,
+                    kd,
+                    shift,
+                    sinkType,
+                    structure,
+                    jobValues,
+                    particleList,
+                    deckHash,
                 )
 
-            timeout = parameters["propcfun"]["timeout"]
-
             reportFile = dirs.FullDirectories(
                 parameters,
                 directory="cfunReport",
@@ -142,28 +189,190 @@ def MakeCorrelationFunctions(
                 **parameters["sourcesink"],
             )["cfunReport"]
 
-            timerLabel = "Correlation functions"
-            CallMPI(
-                executable,
-                reportFile,
-                jobValues["runFunction"],
-                filestub=filestub,
-                numGPUs=numGPUs,
-                numCPUs=numCPUs,
-                timeout=timeout,
-                timerLabel=timerLabel,
-                timer=timer,
-            )
+            if len(runList) > 0:
+                gpuSeconds = CallCfungen(
+                    parameters,
+                    filestub,
+                    logFile,
+                    kd,
+                    shift,
+                    structure,
+                    propDict,
+                    jobValues,
+                    runList,
+                    reportFile,
+                    timer,
+                )
+                if deckHash is not None and dedupe.Enabled(parameters):
+                    dedupe.Record(
+                        parameters,
+                        kd,
+                        shift,
+                        sinkType,
+                        structure,
+                        jobValues,
+                        runList,
+                        deckHash,
+                        gpuSeconds,
+                    )
+            else:
+                print(f"\nAll correlation functions for {structure=} reused")
+
+            artifacts.RecordCfuns(parameters, jobValues, kd, shift, sinkType, structure)
+            if deckHash is not None:
+                # Recorded against the report file, which exists per structure
+                provenance.Write(parameters, reportFile, deckHash)
 
             if jobValues["tarCfuns"] is True:
-                # Tar new correlation functions together
-                TarCfuns(parameters, kd, shift, structure, sinkType, jobValues)
+                # Tar new correlation functions together, in the background
+                # while the next structure is made if backgroundTar is set.
+                # Copies are passed as the job moves on to other values.
+                scheduler = jobValues["scheduler"].lower()
+                backgroundTar.Submit(
+                    parameters,
+                    parameters[scheduler + "Params"]["NUMGPUS"],
+                    TarCfuns,
+                    parameters,
+                    kd,
+                    shift,
+                    list(structure),
+                    sinkType,
+                    dict(jobValues),
+                    list(particleList),
+                    _lockWaits,
+                )
+                if backgroundTar.Enabled(parameters) is False:
+                    AddLockWaits(timer)
 
         # End structure loop
     # End sinktype loop
 
 
-def CompilePropPaths(parameters, kd, shift, jobValues, *args, **kwargs):
+def CallCfungen(
+    parameters,
+    filestub,
+    logFile,
+    kd,
+    shift,
+    structure,
+    propDict,
+    jobValues,
+    particleList,
+    reportFile,
+    timer,
+    *args,
+    **kwargs,
+):
+    """
+    Makes the structure specific input files and calls cfungenGPU.x.
+
+    Arguments:
+    filestub     -- str: Base input filestub to pass to cfungenGPU.x
+    structure    -- str list: Quark structure
+    propDict     -- dict: Dictionary containing prop paths
+    jobValues    -- dict: Dictionary containing job specific values
+    particleList -- list: The particle pairs to make
+    reportFile   -- str: The report file for cfungenGPU.x output
+    timer        -- Timer: Timer object to manage timing of correlation
+                          function calculation time.
+
+    Returns:
+    gpuSeconds -- float: The GPU time taken by cfungenGPU.x
+    """
+
+    print("Making structure specific files")
+    MakeSpecificFiles(
+        parameters,
+        filestub,
+        logFile,
+        kd,
+        shift,
+        structure,
+        propDict,
+        jobValues,
+        particleList,
+    )
+
+    # Preparing final variables for call to cfungen
+    executable = parameters["propcfun"]["cfgenExecutable"]
+
+    scheduler = jobValues["scheduler"].lower()
+    numGPUs = parameters[scheduler + "Params"]["NUMGPUS"]
+    numCPUs = numGPUs
+    if numCPUs < parameters[scheduler + "Params"]["NUMGPUS"]:
+        print(
+            f"WARNING: {numCPUs=}, {numGPUs=}, BUT cfungen generally requires equal numbers of CPUs and GPUs. This may cause issues."
+        )
+
+    timeout = parameters["propcfun"]["timeout"]
+
+    timerLabel = "Correlation functions"
+    startTime = time.perf_counter()
+    CallMPI(
+        executable,
+        reportFile,
+        jobValues["runFunction"],
+        filestub=filestub,
+        numGPUs=numGPUs,
+        numCPUs=numCPUs,
+        timeout=timeout,
+        timerLabel=timerLabel,
+        timer=timer,
+    )
+    gpuSeconds = numGPUs * (time.perf_counter() - startTime)
+
+    # The binary wrote to the cfun directory
+    cfunFile = dirs.GetCfunFile(
+        parameters,
+        jobValues["kappa"],
+        kd,
+        shift,
+        jobValues["sourceType"],
+        jobValues["sinkType"],
+        "",
+        jobValues["cfgID"],
+        makeDirs=False,
+    )
+    dirCache.Invalidate(os.path.dirname(cfunFile))
+    return gpuSeconds
+
+
+def DeckHash(
+    parameters, kd, shift, structure, sinkType, jobValues, upstream=(), *args, **kwargs
+):
+    """
+    Returns the provenance hash of the cfuns of a structure and sink type.
+
+    The input files for every particle pair are written under a scratch
+    filestub, hashed and deleted, so the hash does not depend on which pairs
+    are missing. Nothing is run.
+
+    Arguments:
+    structure  -- str list: Quark structure
+    sinkType   -- str: The sink type
+    jobValues  -- dict: Dictionary containing job specific values
+    upstream   -- iterable: Hashes of the propagators and eigenmodes read
+    """
+
+    # The cfun info file takes the sink type from runValues
+    jobValues["sinkType"] = sinkType
+    jobValues = {
+        **jobValues,
+        "inputSummary": {**jobValues.get("inputSummary", {}), "interp": os.devnull},
+    }
+    propDict = CompilePropPaths(parameters, kd, shift, jobValues, makeDirs=False)
+
+    filestub = provenance.ScratchStub(
+        parameters, "cfunInput", jobValues, sinkType + "".join(structure)
+    )
+    MakeReusableFiles(parameters, filestub, os.devnull, kd, shift, jobValues)
+    MakeSpecificFiles(
+        parameters, filestub, os.devnull, kd, shift, structure, propDict, jobValues
+    )
+    return provenance.DeckHash(parameters, filestub, upstream, cleanUp=True)
+
+
+def CompilePropPaths(parameters, kd, shift, jobValues, makeDirs=True, *args, **kwargs):
     """
     Creates a dictionary of propagator paths for all quarks in the quarkList.
 
@@ -171,6 +380,7 @@ def CompilePropPaths(parameters, kd, shift, jobValues, *args, **kwargs):
     jobValues  -- dict: Dictionary containing job specific values
     parameters -- dict: Dictionary of all of the run parameters.
                         From parameters.yml
+    makeDirs   -- bool: Whether to create the propagator directories
 
     """
 
@@ -195,6 +405,7 @@ def CompilePropPaths(parameters, kd, shift, jobValues, *args, **kwargs):
             directory="prop",
             kd=kd,
             shift=shift,
+            makeDirs=makeDirs,
             **jobValues,
             **parameters["sourcesink"],
         )["prop"]
@@ -261,18 +472,28 @@ def MakeReusableFiles(
 
 
 def MakeSpecificFiles(
-    parameters, filestub, logFile, kd, shift, structure, propDict, jobValues
+    parameters,
+    filestub,
+    logFile,
+    kd,
+    shift,
+    structure,
+    propDict,
+    jobValues,
+    particleList=None,
 ):
     """
     Makes the files which depend on structure and cannot be reused.
 
     Arguments:
-    filestub   -- str: Base filestub to pass to cfungenGPU.x
-    structure  -- str list: Quark structure
-    propDict   -- dict: Dictionary containing prop paths
-    jobValues  -- dict: Dictionary containing job specific values
-    parameters -- dict: Dictionary of all of the run parameters.
-                        From parameters.yml
+    filestub     -- str: Base filestub to pass to cfungenGPU.x
+    structure    -- str list: Quark structure
+    propDict     -- dict: Dictionary containing prop paths
+    jobValues    -- dict: Dictionary containing job specific values
+    parameters   -- dict: Dictionary of all of the run parameters.
+                          From parameters.yml
+    particleList -- list: The particle pairs to make. Default is all pairs in
+                          jobValues.
 
     """
 
@@ -323,13 +544,14 @@ def MakeSpecificFiles(
 
     # Making the particle stubs file - not reusable as isospin changes the
     # available operator combinations
-    particleList = jobValues["particleList"]
+    if particleList is None:
+        particleList = jobValues["particleList"]
     files.MakePartStubsFile(filestub, logFile, isospin_sym, particleList)
 
     # Looping over operator pairs to make interpolator files
     # .interp files are structure dependent as the structure
     # is in the filename of the correlator
-    for chi, chibar in jobValues["particleList"]:
+    for chi, chibar in particleList:
         # compiling the particle stub ie. 5319732_4proton_1proton_1bar
         partstub = filestub + chi + chibar
 
@@ -388,41 +610,162 @@ def TarCfuns(
     structure: list,
     sinkType: str,
     jobValues: dict,
+    particleList: list = None,
+    waits: list = None,
 ) -> None:
     """
     Tars newly created correlation functions together.
 
     Arguments:
-    parameters -- dict:
-    kd         -- int:
-    shift      -- str:
-    structure  -- list:
-    sinkType   -- str:
-    jobValues  -- dict
-
-    Globs to create list of files to tar and determines tarfile name based on
-    what was globbed. Ability to specify what to glob intended for future versions.
+    parameters   -- dict:
+    kd           -- int:
+    shift        -- str:
+    structure    -- list:
+    sinkType     -- str:
+    jobValues    -- dict
+    particleList -- list: Particle pairs just made. Default is all pairs.
+    waits        -- list: List to add the seconds spent waiting for tar locks
+                          to, for the main thread to add to its timer
+
+    The cfun directory is listed once and the new cfuns split between the
+    particle pairs, each of which has a tar of its own. As each tar is locked
+    separately, up to tarJobs tars are then written at once.
     """
+    startTime = time.perf_counter()
+    scans = dirCache.Counts()["scans"]
+
     tarPath, cfunBase = GetTarFile(
         parameters, kd, shift, sinkType, jobValues, structure
     )
 
-    # Looping through particles (We want a different tar for each)
-    for chi, chibar in jobValues["particleList"]:
-        # Finalising filenames
-        tarFile = tarPath.replace("CHICHIBAR", f"{chi}{chibar}")
-        cfunFiles = cfunBase.replace("CHICHIBAR", f"{chi}{chibar}")
-        cfunList = glob.glob(cfunFiles)  # Doing the glob
-
-        # Checking that we actually have cfuns to tar
-        if len(cfunList) == 0:
-            print(
-                f"No cfuns for {chi}{chibar}. If you are not debugging, something has gone wrong"
+    if particleList is None:
+        particleList = jobValues["particleList"]
+
+    cfunLists = PartitionCfuns(cfunBase, particleList)
+
+    codec = archive.Codec(parameters)
+    jobs = archive.CompressionJobs(parameters)
+    timeout = parameters["runValues"].get("lockTimeout", locking.TIMEOUT)
+    lease = parameters["runValues"].get("lockLease", locking.LEASE)
+    tarJobs = parameters["runValues"].get("tarJobs", 4)
+
+    # Each thread keeps its own lock waits, gathered once all are done
+    tarWaits = []
+
+    # Looping through particles (We want a different tar for each). Tar locks
+    # do not exclude threads of the same job, so each tar is only written by
+    # one thread, and pairs listed twice only once.
+    futures = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=tarJobs) as pool:
+        for chi, chibar in cfunLists:
+            # Finalising filenames
+            tarFile = tarPath.replace("CHICHIBAR", f"{chi}{chibar}")
+            cfunList = cfunLists[chi, chibar]
+
+            # Checking that we actually have cfuns to tar
+            if len(cfunList) == 0:
+                print(
+                    f"No cfuns for {chi}{chibar}. If you are not debugging, something has gone wrong"
+                )
+                continue
+
+            # Putting everything into the tar, or a shard of it of our own
+            if shards.Enabled(parameters):
+                futures.append(
+                    pool.submit(
+                        WriteShard,
+                        parameters,
+                        tarFile,
+                        cfunList,
+                        shift,
+                        jobValues,
+                        codec,
+                        jobs,
+                    )
+                )
+                continue
+            tarWaits.append([])
+            futures.append(
+                pool.submit(
+                    CreateTar,
+                    tarFile,
+                    cfunList,
+                    shift,
+                    jobValues,
+                    timeout,
+                    tarWaits[-1],
+                    lease,
+                    codec,
+                    jobs,
+                )
             )
-            continue
 
-        # Putting everything into the tar
-        CreateTar(tarFile, cfunList, shift, jobValues)
+    # Every tar has been attempted, so the first error can be raised
+    try:
+        for future in futures:
+            future.result()
+    finally:
+        if waits is not None:
+            waits.extend(waited for lockWaits in tarWaits for waited in lockWaits)
+
+    print(
+        f"\nTarred {sum(len(cfuns) for cfuns in cfunLists.values())} cfuns of "
+        f"{''.join(structure)} {sinkType} into {len(futures)} tars in "
+        f"{time.perf_counter() - startTime:.1f}s, from "
+        f'{dirCache.Counts()["scans"] - scans} directory listings'
+    )
+
+
+def AddLockWaits(timer, *args, **kwargs):
+    """
+    Adds the time TarCfuns spent waiting for tar locks to the timer.
+
+    Only to be called from the main thread, while no tars are being written
+    in the background (see backgroundTar.Drain).
+
+    Arguments:
+    timer -- Timer: Timer to add to
+    """
+
+    if locking.TIMER not in timer.timerDict:
+        timer.initialiseTimer(locking.TIMER)
+    locking.AddWaits(timer, _lockWaits)
+    _lockWaits.clear()
+
+
+def PartitionCfuns(cfunBase, particleList, *args, **kwargs):
+    """
+    Splits the cfuns in a directory between particle pairs.
+
+    Arguments:
+    cfunBase     -- str: Path to the cfuns, as from GetTarFile, with CHICHIBAR
+                         in place of the particles and globs in place of the
+                         sink values
+    particleList -- list: The particle pairs to find cfuns of
+
+    Returns:
+    cfunLists -- dict: (chi, chibar) to the list of its cfuns
+    """
+
+    directory, pattern = os.path.split(cfunBase)
+    # The particles are matched as a group, as only whole pairs are looked for
+    prefix, suffix = pattern.split("CHICHIBAR")
+    regex = re.compile(
+        "(.*)".join(re.escape(part).replace(r"\*", ".*") for part in [prefix, suffix])
+        + "$"
+    )
+    pairs = {f"{chi}{chibar}": (chi, chibar) for chi, chibar in particleList}
+
+    cfunLists = {tuple(pair): [] for pair in particleList}
+    # One listing, rather than a glob of the directory for each pair. Scanned
+    # afresh, as what goes in the tar must be what is there now, and a copy,
+    # so the other threads may carry on changing the cache
+    listing = dirCache.Listing(directory, fresh=True) or {}
+    for name in sorted(listing):
+        match = regex.match(name)
+        if match is not None and match.group(1) in pairs and not listing[name]:
+            cfunLists[pairs[match.group(1)]].append(os.path.join(directory, name))
+    return cfunLists
 
 
 def GetTarFile(
@@ -433,6 +776,7 @@ def GetTarFile(
     jobValues: dict,
     structure: list = None,
     sinkVal: str = "*",
+    makeDirs: bool = True,
     *args,
     **kwargs,
 ):
@@ -449,6 +793,7 @@ def GetTarFile(
     jobValues  -- dict
     structure  -- list:
     sinkVal    -- str:
+    makeDirs   -- bool: Whether to create the cfun and tar directories
     """
 
     # Getting the general path to the cfuns. We intentionally pass * for sinkVal so
@@ -462,6 +807,7 @@ def GetTarFile(
         sinkType,
         sinkVal,
         jobValues["cfgID"],
+        makeDirs=makeDirs,
     )
 
     if structure is not None:
@@ -470,58 +816,50 @@ def GetTarFile(
     else:
         cfunBase = cfunFiles
 
-    # Removing various parts of the cfun filepath to construct the tar path. Removed
-    # things are combined in the tar. Use regex to remove for generality, probably
-    # not strictly necessary
-    tarPath = re.sub(r"sh(([xyzt]\d+)+|(None))\/", "", cfunBase)  # shift
-    tarPath = re.sub(r"icfg-([ab]|([ghijk]M)){1}-\d+", "", tarPath)  # config id
-    tarPath = tarPath.replace(".u.2cf", "") + ".tar"  # file extension
-    tarPath = tarPath.replace("*", "")  # any globs
+    tarPath = TarOf(cfunBase, archive.Extension(parameters))
     # Ensuring the directory for the tar exists
-    tarDir = pathlib.PurePath(tarPath).parent
-    pathlib.Path(tarDir).mkdir(parents=True, exist_ok=True)
+    if makeDirs is True:
+        dirCache.MakeDirs(os.path.dirname(tarPath))
 
     return tarPath, cfunBase
 
 
-def BreakRaceCondition(filePath: str, maxTries: int = 10, *args, **kwargs) -> str:
+def TarOf(cfunPath, extension, *args, **kwargs):
     """
-    Breaks race condition of file being accessed by different processes.
+    Returns the path of the tar a cfun is put in.
 
     Arguments:
-    filepath -- str: path to file which is being accessed
-    maxTries -- int: number of attempts to access file before giving up.
-
-    Returns:
-    statusFile -- str: The path to the status file made showing the file is open.
-                       Returns failed if it gives up.
-
-    Creates a status file, demonstrating that this process has the file open. If
-    the status file already exists, waits before trying again. Gives up when
-    maxTries is reached.
-
-    STATUS FILE MUST BE DELETED AFTER CLOSING FILE OF INTEREST.
+    cfunPath  -- str: Path to the cfun, or a glob of cfuns with * in place of
+                      the sink value
+    extension -- str: Extension of the archive format, ie. .tar
     """
 
-    # Needs to be a pathlib path for touch
-    statusFile = pathlib.Path(filePath + ".status")
-    counter = 0  # Attempt counter
-    while True:
-        if counter >= maxTries:  #'give up' condition
-            print("maxTries exceeded, skipping file. File open by other process")
-            return "failed"
-        # Try to create the status file
-        try:
-            statusFile.touch(exist_ok=False)  # creating own status file
-            return statusFile
-        except FileExistsError:  # If file exists,
-            time.sleep(5)  # wait 5 seconds before trying again
-            counter += 1
-        print(counter)
+    # Removing various parts of the cfun filepath to construct the tar path. Removed
+    # things are combined in the tar. Use regex to remove for generality, probably
+    # not strictly necessary
+    tarPath = re.sub(
+        r"cfg(-([ab]|([ghijk]M)){1}-\d+|CONFIGID)\/", "", cfunPath
+    )  # config directory
+    tarPath = re.sub(r"sh(([xyzt]\d+)+|(None))\/", "", tarPath)  # shift
+    tarPath = re.sub(r"icfg-([ab]|([ghijk]M)){1}-\d+", "", tarPath)  # config id
+    tarPath = tarPath.replace("icfgCONFIGID", "")  # config id placeholder
+    tarPath = tarPath.replace(".u.2cf", "") + extension
+    tarPath = tarPath.replace("*", "")  # any globs
+    return tarPath
 
 
 def CreateTar(
-    tarPath: str, cfunList: list, shift: str, jobValues: dict, *args, **kwargs
+    tarPath: str,
+    cfunList: list,
+    shift: str,
+    jobValues: dict,
+    timeout: float = locking.TIMEOUT,
+    waits: list = None,
+    lease: float = locking.LEASE,
+    codec: str = "none",
+    jobs: int = 0,
+    *args,
+    **kwargs,
 ) -> None:
     """
     Creates/appends the list of cfuns to the tar.
@@ -531,43 +869,174 @@ def CreateTar(
     cfunList  -- list: List of cfuns to add to the tar
     shift     -- str: Shift of cfuns to append. For naming inside tar
     jobValues -- dict: Dictionary of job Values
+    timeout   -- float: Seconds to wait for other jobs to finish with the tar
+    waits     -- list: List to append the seconds spent waiting for the tar
+                       to, for the caller to add to its timer (optional)
+    lease     -- float: Seconds after which other jobs may take the lock over
+    codec     -- str: Compression of the cfuns in the tar, see archive.CODECS
+    jobs      -- int: Processes to compress with. 0 uses every core.
 
     """
 
-    # Need to break race condition with other jobs if doing different configs in
-    # different jobs, otherwise they may try to access the same tar simultaneously
-    statusFile = BreakRaceCondition(tarPath)
-    if statusFile == "failed":  # If the race condition cannot be broken
-        return
+    try:
+        # Compressing before locking so other jobs are not kept waiting
+        compressed = None
+        if codec != "none":
+            compressed = archive.Compress(cfunList, codec, jobs)
+
+        # Other jobs doing different configs may be appending to the same tar,
+        # so the tar is locked while it is written
+        with locking.Locked(tarPath, timeout, waits, lease):
+            # Anything tarred meanwhile by campaign.py recover is left out
+            kept = [i for i, cfun in enumerate(cfunList) if os.path.isfile(cfun)]
+            if len(kept) < len(cfunList):
+                cfunList = [cfunList[i] for i in kept]
+                if compressed is not None:
+                    compressed = [compressed[i] for i in kept]
+            if len(cfunList) > 0:
+                AppendCfuns(
+                    tarPath, cfunList, shift, jobValues["cfgID"], compressed, codec
+                )
+    except locking.LockTimeout:
+        # The cfuns are left in place, where they are still found by checkCfuns
+        print(f"Could not lock {tarPath} in {timeout}s, leaving cfuns untarred")
+
+
+def AppendCfuns(
+    tarPath, cfunList, shift, cfgID, compressed=None, codec=None, *args, **kwargs
+):
+    """
+    Appends cfuns to a tar, then deletes them. The tar must be locked.
+
+    The append is journaled, so if the job is killed part way through it is
+    rolled back or completed by the next append to the tar (see journal.py).
+
+    Arguments:
+    tarPath    -- str: File path to the tar.
+    cfunList   -- list: List of cfuns to add to the tar
+    shift      -- str: Shift of cfuns to append. For naming inside tar
+    cfgID      -- str: Config ID of the cfuns, for the cfgSidecar sidecars
+    compressed -- list: The cfuns as from archive.Compress, or None
+    codec      -- str: Codec the cfuns were compressed with
+    """
+
+    print(f"\nPutting cfuns into tar file:\n{tarPath}")
+    # Finishing off any append a killed job left, then journaling this one
+    journal.Replay(tarPath)
+    memberNames = MemberNames(cfunList, shift)
+    journal.Begin(tarPath, cfunList, cfgID, memberNames)
+
+    # Appending without reading through the archive, which is synced
+    # and its index updated once closed
+    with archive.Appending(tarPath) as a:
+        AddCfuns(a, cfunList, shift, compressed, codec)
+    for path in archive.Files(tarPath):
+        dirCache.Added(path)
+    journal.Appended(tarPath)
+
+    # Deleting cfuns which are in tar. We wait until tar is finalised so
+    # we don't delete the cfun if it fails
+    for cfun in cfunList:
+        path = pathlib.Path(cfun)
+        path.unlink(missing_ok=True)
+        dirCache.Removed(cfun)
+
+    # Recording the config and the cfuns put in the tar
+    cfgSidecar.Append(tarPath, cfgID, memberNames)
+    for sidecar in cfgSidecar.SIDECARS:
+        dirCache.Added(tarPath + sidecar)
+    journal.End(tarPath)
+
+
+def MemberNames(cfunList, shift, *args, **kwargs):
+    """Returns the names cfuns are stored under in their tar, as shSHIFT/filename."""
+    return [f"sh{shift}/" + pathlib.PurePosixPath(cfun).name for cfun in cfunList]
+
+
+def AddCfuns(writer, cfunList, shift, compressed=None, codec=None, *args, **kwargs):
+    """
+    Adds cfuns to an archive open for appending.
+
+    Arguments:
+    writer     -- object: Writer from archive.Appending
+    cfunList   -- list: List of cfuns to add
+    shift      -- str: Shift of the cfuns. For naming inside the archive
+    compressed -- list: (data, mtime) of each cfun from archive.Compress, or
+                        None to add the files as they are
+    codec      -- str: Codec the cfuns were compressed with
+    """
+
+    for i, (cfun, name) in enumerate(zip(cfunList, MemberNames(cfunList, shift))):
+        arcname = "/" + name
+        if compressed is None:
+            writer.Add(cfun, arcname)
+        else:
+            data, mtime = compressed[i]
+            writer.AddBytes(arcname, data, mtime, codec)
+
+
+def WriteShard(
+    parameters: dict,
+    tarPath: str,
+    cfunList: list,
+    shift: str,
+    jobValues: dict,
+    codec: str = "none",
+    jobs: int = 0,
+    *args,
+    **kwargs,
+) -> None:
+    """
+    Writes the list of cfuns to a new shard of the tar.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    tarPath    -- str: File path to the canonical tar.
+    cfunList   -- list: List of cfuns to put in the shard
+    shift      -- str: Shift of cfuns to write. For naming inside tar
+    jobValues  -- dict: Dictionary of job Values
+    codec      -- str: Compression of the cfuns in the shard
+    jobs       -- int: Processes to compress with. 0 uses every core.
+
+    No other job writes the shard, so nothing is locked. The sidecars are
+    written first and the shard moved into place once complete, so the
+    checkers never see a partial shard. If it is never moved into place the
+    sidecars are removed again.
+    """
 
-    # try is to ensure statusFile is always deleted, even if something goes wrong here
+    shardPath = shards.ShardFile(tarPath, shift, jobValues)
+    dirCache.MakeDirs(os.path.dirname(shardPath))
+    tempFile = f"{shardPath}.{os.getpid()}.tmp"
+    placed = False
     try:
-        print(f"\nPutting cfuns into tar file:\n{tarPath}")
-        # Opening tar in append mode
-        with tarfile.open(name=tarPath, mode="a") as t:
-            # adding all cfuns with name in archive being arcname
-            for cfun in cfunList:
-                # PurePath required to use .name (just how pathlib works). method
-                # extracts just filename.
-                t.add(cfun, arcname=f"/sh{shift}/" + pathlib.PurePosixPath(cfun).name)
-
-        # Deleting cfuns which are in tar. We wait until tar is finalised so we don't
-        # delete the cfun if it fails
+        print(f"\nPutting cfuns into shard:\n{shardPath}")
+        for sidecar in cfgSidecar.SIDECARS:
+            pathlib.Path(shardPath + sidecar).unlink(missing_ok=True)
+        cfgSidecar.Append(shardPath, jobValues["cfgID"], MemberNames(cfunList, shift))
+
+        compressed = None
+        if codec != "none":
+            compressed = archive.Compress(cfunList, codec, jobs)
+        archiveFormat = archive.Format(parameters)
+        with archive.Appending(tempFile, archiveFormat) as a:
+            AddCfuns(a, cfunList, shift, compressed, codec)
+        archive.Rename(tempFile, shardPath)
+        placed = True
+
+        for path in archive.Files(shardPath):
+            dirCache.Added(path)
+        for sidecar in cfgSidecar.SIDECARS:
+            dirCache.Added(shardPath + sidecar)
+
+        # Deleting cfuns only once they are safely in the shard
         for cfun in cfunList:
-            path = pathlib.Path(cfun)
-            path.unlink(missing_ok=True)
-
-        # Writing info files - file containing list of cfgids and list of files
-        with open(tarPath + "cfglist", "a") as f:
-            f.write(jobValues["cfgID"] + "\n")
-        with open(tarPath + "info", "a") as i:
-            i.write("\n".join(cfunList))
-            i.write("\n")
-
-        # Deleting status file
-        statusFile.unlink(missing_ok=True)
+            pathlib.Path(cfun).unlink(missing_ok=True)
+            dirCache.Removed(cfun)
     except:
-        # Deleting status file, then raising exception and exiting
-        statusFile.unlink(missing_ok=True)
-        traceback.print_exc()
-        exit()
+        # The cfuns are kept until the shard is complete
+        for path in archive.Files(tempFile):
+            pathlib.Path(path).unlink(missing_ok=True)
+        if placed is False:
+            for sidecar in cfgSidecar.SIDECARS:
+                pathlib.Path(shardPath + sidecar).unlink(missing_ok=True)
+        raise
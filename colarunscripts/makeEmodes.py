@@ -9,27 +9,20 @@ This script is not intended to be called from the command line.
 """
 
 # standard library modules
-import pathlib  # for checking existence of files
+import os  # for path manipulation
 import subprocess  # for calling lap2dmodes.x
 from datetime import datetime  # for writing out the time
 
+from colarunscripts import dirCache
 from colarunscripts import directories as dirs
-from colarunscripts import shifts
+from colarunscripts import ledger, provenance, shifts
 from colarunscripts.makePropagator import CallMPI
 from colarunscripts.particles import QuarkCharge
 from colarunscripts.propFiles import FieldCode, MakeLatticeFile
 from colarunscripts.utilities import SchedulerParams, VariablePrinter
 
 
-def main(parameters, kd, shift, jobValues, timer):
-
-    inputs = {}
-    inputs["configFile"] = dirs.FullDirectories(
-        parameters, kd=kd, directory="configFile", **jobValues
-    )["configFile"]
-    inputs["configFormat"] = parameters["directories"]["configFormat"]
-    inputs["outputFormat"] = parameters["directories"]["lapModeFormat"]
-    inputs["shift"] = shifts.FormatShift(shift, fullShift="emode")
+def main(parameters, kd, shift, jobValues, timer, hashes=None):
 
     schedulerParams = SchedulerParams(parameters, jobValues["scheduler"])
 
@@ -64,8 +57,24 @@ def main(parameters, kd, shift, jobValues, timer):
             print(5 * "-" + f"Doing {quark} quark" + 5 * "-")
             print(f"Eigenmode to make is: {fullFile}")
 
-            # Checking for eigenmode existence
-            if pathlib.Path(fullFile).is_file():
+            emodeRow = ledger.Row(
+                "emode",
+                fullFile,
+                jobValues["kappa"],
+                jobValues["cfgID"],
+                kd * QuarkCharge(quark),
+                shifts.FormatShift(shift, form="label", fullShift="emode"),
+            )
+
+            # Hash of the input files, if provenance is being tracked
+            deckHash = None if hashes is None else hashes["emodes"][quark]
+
+            # Checking for eigenmode existence, and that it was made from the
+            # same inputs
+            exists = ledger.ArtifactExists(parameters, emodeRow)
+            if exists and (
+                deckHash is None or provenance.Matches(parameters, fullFile, deckHash)
+            ):
                 print("Skipping eigenmode file. File already exists")
                 fullFileList.append(fullFile)
 
@@ -74,6 +83,8 @@ def main(parameters, kd, shift, jobValues, timer):
                         f"\nSkipping {quark=}.\n{fullFile}\n File already exists.\n\n"
                     )
                 continue
+            elif exists:
+                print("Eigenmode input files have changed since it was made, remaking")
 
             # Constructing the input filestub
             filestub = (
@@ -86,16 +97,16 @@ def main(parameters, kd, shift, jobValues, timer):
                 + f".{quark}"
             )
 
-            # Adding required quantities to the inputs dictionary
-            inputs["U1FieldCode"] = FieldCode(
-                kd=kd * QuarkCharge(quark), **parameters["propcfun"], **jobValues
-            )
-            inputs["outputPrefix"] = modeFiles[quark]
-
             # Making the input files
-            MakeLatticeFile(filestub, logFile, **parameters["lattice"])
-            MakeLap2ModesFile(
-                filestub, logFile, **inputs, **parameters["laplacianEigenmodes"]
+            MakeInputFiles(
+                parameters,
+                filestub,
+                logFile,
+                kd,
+                shift,
+                quark,
+                modeFiles[quark],
+                jobValues,
             )
 
             # In parameters file, scheduler params are lowercase, eg. pbsParams
@@ -127,6 +138,11 @@ def main(parameters, kd, shift, jobValues, timer):
                 timerLabel=timerLabel,
                 timer=timer,
             )
+            # The binary wrote to the eigenmode directory
+            dirCache.Invalidate(os.path.dirname(fullFile))
+            ledger.RecordIfPresent(parameters, [emodeRow])
+            if deckHash is not None and dirCache.IsFile(fullFile):
+                provenance.Write(parameters, fullFile, deckHash)
 
             # Compiling the list of files created
             fullFileList.append(fullFile)
@@ -134,6 +150,75 @@ def main(parameters, kd, shift, jobValues, timer):
     return fullFileList
 
 
+def MakeInputFiles(
+    parameters,
+    filestub,
+    logFile,
+    kd,
+    shift,
+    quark,
+    outputPrefix,
+    jobValues,
+    *args,
+    **kwargs,
+):
+    """
+    Makes the input files for lap2dmodes.x.
+
+    Arguments:
+    filestub     -- str: Base filestub to pass to lap2dmodes.x
+    logFile      -- str: The input logFile to also write inputs to
+    kd           -- int: The field strength, not adjusted for quark charge
+    quark        -- str: The quark to make eigenmodes for
+    outputPrefix -- str: The eigenmode file, without extension
+    jobValues    -- dict: Dictionary containing job specific values
+    """
+
+    inputs = {}
+    inputs["configFile"] = dirs.FullDirectories(
+        parameters, kd=kd, directory="configFile", **jobValues
+    )["configFile"]
+    inputs["configFormat"] = parameters["directories"]["configFormat"]
+    inputs["outputFormat"] = parameters["directories"]["lapModeFormat"]
+    inputs["shift"] = shifts.FormatShift(shift, fullShift="emode")
+    inputs["U1FieldCode"] = FieldCode(
+        kd=kd * QuarkCharge(quark), **parameters["propcfun"], **jobValues
+    )
+    inputs["outputPrefix"] = outputPrefix
+
+    MakeLatticeFile(filestub, logFile, **parameters["lattice"])
+    MakeLap2ModesFile(filestub, logFile, **inputs, **parameters["laplacianEigenmodes"])
+
+
+def DeckHash(parameters, kd, shift, quark, jobValues, *args, **kwargs):
+    """
+    Returns the provenance hash of the eigenmodes of a quark.
+
+    The input files are written under a scratch filestub, hashed and
+    deleted. Nothing is run.
+
+    Arguments:
+    kd        -- int: The field strength, not adjusted for quark charge
+    quark     -- str: The quark
+    jobValues -- dict: Dictionary containing job specific values
+    """
+
+    filestub = provenance.ScratchStub(parameters, "lapmodeInput", jobValues, quark)
+    modeFiles = dirs.LapModeFiles(
+        parameters,
+        kd=kd,
+        shift=shift,
+        quark=quark,
+        **jobValues,
+        withExtension=False,
+        makeDirs=False,
+    )
+    MakeInputFiles(
+        parameters, filestub, os.devnull, kd, shift, quark, modeFiles[quark], jobValues
+    )
+    return provenance.DeckHash(parameters, filestub, cleanUp=True)
+
+
 def MakeLap2ModesFile(
     filestub,
     logFile,
@@ -10,20 +10,22 @@ This script is not intended to be called from the command line.
 
 # standard library modules
 import copy  # deep copying of dictionaries
-import pathlib  # for checking existence of files
+import os  # for path manipulation
 import pprint  # nice dictionary printing (for debugging)
 import subprocess  # for calling quarkpropGPU.x
 from datetime import datetime  # for writing out the time
 
 # local modules
+from colarunscripts import dirCache
 from colarunscripts import directories as dirs
+from colarunscripts import ledger, provenance
 from colarunscripts import propFiles as files
 from colarunscripts import shifts
 from colarunscripts.particles import QuarkCharge
 from colarunscripts.utilities import pp
 
 
-def main(parameters, kd, shift, jobValues, timer, *args, **kwargs):
+def main(parameters, kd, shift, jobValues, timer, hashes=None, *args, **kwargs):
     """
     Main function. Begins propagator production process.
 
@@ -35,6 +37,8 @@ def main(parameters, kd, shift, jobValues, timer, *args, **kwargs):
                        kd, shift, SLURM_ARRAY_TASK_ID, etc...
     timer     -- Timer: Timer object to manage timing of correlation function
                        calculation time.
+    hashes    -- dict: Provenance hashes, from manageJob.ExpectedProvenance.
+                       None if provenance is not being tracked.
 
     """
 
@@ -70,15 +74,34 @@ def main(parameters, kd, shift, jobValues, timer, *args, **kwargs):
                 f.write(f"{quark=}:\n")
 
             # Making the propagator
+            deckHash = None if hashes is None else hashes["props"][quark]
             propPath = MakePropagator(
-                parameters, quark, kd, shift, jobValues, filestub, logFile, timer
+                parameters,
+                quark,
+                kd,
+                shift,
+                jobValues,
+                filestub,
+                logFile,
+                timer,
+                deckHash,
             )
             propPaths.append(propPath)
     return propPaths
 
 
 def MakePropagator(
-    parameters, quark, kd, shift, jobValues, filestub, logFile, timer, *args, **kwargs
+    parameters,
+    quark,
+    kd,
+    shift,
+    jobValues,
+    filestub,
+    logFile,
+    timer,
+    deckHash=None,
+    *args,
+    **kwargs,
 ):
     """
     Prepares the input files for making propagators using quarkpropGPU.x.
@@ -91,50 +114,38 @@ def MakePropagator(
                         From parameters.yml
     timer      -- Timer: Timer object to manage timing of correlation function
                         calculation time.
+    deckHash   --  str: Provenance hash of the propagator. None if provenance
+                        is not being tracked.
     """
 
-    # Copying jobValues dictionary. Deepcopy so that we can change items for
-    # this quark only.
-    quarkValues = copy.deepcopy(jobValues)
-
-    # First we check if the quark exists - need property adjustment
-    # for quark flavour to do so
-    kd *= QuarkCharge(quark)
-    if quark in ["s", "nh"]:
-        quarkLabel = "h"
-    else:
-        quarkLabel = "l"
-    quarkValues["strangeKappa"] = parameters["propcfun"]["strangeKappa"]
-
-    # Assembling the quark path
-    quarkPrefix = dirs.FullDirectories(
-        parameters,
-        directory="prop",
-        kd=kd,
-        shift=shift,
-        **quarkValues,
-        **parameters["sourcesink"],
-    )["prop"]
-    quarkValues["quarkPrefix"] = quarkPrefix.replace("QUARK", quarkLabel)
+    quarkValues, quarkLabel, kd, fullQuarkPath, propKappa = QuarkValues(
+        parameters, quark, kd, shift, jobValues
+    )
 
-    fullQuarkPath = (
-        f'{quarkValues["quarkPrefix"]}kKAPPA.{parameters["directories"]["propFormat"]}'
+    propRow = ledger.Row(
+        "prop",
+        fullQuarkPath,
+        propKappa,
+        quarkValues["cfgID"],
+        kd,
+        shift,
+        ledger.SourceLabel(parameters, quarkValues["sourceType"]),
     )
-    # Kappa in filename is flavour dependent, different for directory, but
-    # that should change
-    if quarkLabel == "h":
-        fullQuarkPath = fullQuarkPath.replace("KAPPA", str(quarkValues["strangeKappa"]))
-    else:
-        fullQuarkPath = fullQuarkPath.replace("KAPPA", str(quarkValues["kappa"]))
 
-    # Checking whether the quark already exists
+    # Checking whether the quark already exists, and was made from the same
+    # inputs
     print(f"Quark to make is: \n{fullQuarkPath}")
-    if pathlib.Path(fullQuarkPath).is_file():
+    exists = ledger.ArtifactExists(parameters, propRow)
+    if exists and (
+        deckHash is None or provenance.Matches(parameters, fullQuarkPath, deckHash)
+    ):
         print(f"Skipping {quark} quark. Propagator already exists")
 
         with open(logFile, "a") as f:
             f.write(f"\nSkipping {quark=}.\n{fullQuarkPath} \nFile already exists\n\n")
         return fullQuarkPath
+    elif exists:
+        print(f"Input files for {quark} quark have changed since it was made, remaking")
 
     # Labelling the filestub with the relevant quark
     filestub = dirs.FullDirectories(parameters, directory="propInput")[
@@ -177,9 +188,101 @@ def MakePropagator(
         timerLabel=timerLabel,
         timer=timer,
     )
+    # The binary wrote to the propagator directory
+    dirCache.Invalidate(os.path.dirname(fullQuarkPath))
+    ledger.RecordIfPresent(parameters, [propRow])
+    if deckHash is not None and dirCache.IsFile(fullQuarkPath):
+        provenance.Write(parameters, fullQuarkPath, deckHash)
     return fullQuarkPath
 
 
+def QuarkValues(parameters, quark, kd, shift, jobValues, *args, **kwargs):
+    """
+    Returns the values specific to making the propagator of one quark.
+
+    Arguments
+    quark     --  str: The flavour of quark
+    kd        --  int: The field strength, not adjusted for quark charge
+    jobValues -- dict: Dictionary containing job specific values
+
+    Returns:
+    quarkValues   -- dict: Copy of jobValues with the quark's values added
+    quarkLabel    --  str: l or h, the label of the propagator
+    kd            --  int: The field strength adjusted for quark charge
+    fullQuarkPath --  str: Path of the propagator
+    propKappa     --  int: Kappa value of the propagator
+    """
+
+    # Copying jobValues dictionary. Deepcopy so that we can change items for
+    # this quark only.
+    quarkValues = copy.deepcopy(jobValues)
+
+    # First we check if the quark exists - need property adjustment
+    # for quark flavour to do so
+    kd *= QuarkCharge(quark)
+    if quark in ["s", "nh"]:
+        quarkLabel = "h"
+    else:
+        quarkLabel = "l"
+    quarkValues["strangeKappa"] = parameters["propcfun"]["strangeKappa"]
+
+    # Assembling the quark path
+    quarkPrefix = dirs.FullDirectories(
+        parameters,
+        directory="prop",
+        kd=kd,
+        shift=shift,
+        **quarkValues,
+        **parameters["sourcesink"],
+    )["prop"]
+    quarkValues["quarkPrefix"] = quarkPrefix.replace("QUARK", quarkLabel)
+
+    fullQuarkPath = (
+        f'{quarkValues["quarkPrefix"]}kKAPPA.{parameters["directories"]["propFormat"]}'
+    )
+    # Kappa in filename is flavour dependent, different for directory, but
+    # that should change
+    if quarkLabel == "h":
+        propKappa = quarkValues["strangeKappa"]
+    else:
+        propKappa = quarkValues["kappa"]
+    fullQuarkPath = fullQuarkPath.replace("KAPPA", str(propKappa))
+
+    return quarkValues, quarkLabel, kd, fullQuarkPath, propKappa
+
+
+def DeckHash(parameters, quark, kd, shift, jobValues, emodeHash=None, *args, **kwargs):
+    """
+    Returns the provenance hash of the propagator of a quark.
+
+    The input files are written under a scratch filestub, hashed and
+    deleted. Nothing is run.
+
+    Arguments
+    quark     --  str: The flavour of quark
+    kd        --  int: The field strength, not adjusted for quark charge
+    jobValues -- dict: Dictionary containing job specific values
+    emodeHash --  str: Hash of the eigenmodes the source reads, if any
+    """
+
+    jobValues = {
+        **jobValues,
+        "configFile": dirs.FullDirectories(
+            parameters, directory="configFile", kd=kd, **jobValues
+        )["configFile"],
+    }
+    quarkValues, quarkLabel, kd, _, _ = QuarkValues(
+        parameters, quark, kd, shift, jobValues
+    )
+
+    filestub = provenance.ScratchStub(parameters, "propInput", jobValues, quark)
+    MakePropInputFiles(
+        parameters, filestub, os.devnull, quarkLabel, kd, shift, quarkValues
+    )
+    upstream = [] if emodeHash is None else [emodeHash]
+    return provenance.DeckHash(parameters, filestub, upstream, cleanUp=True)
+
+
 def MakePropInputFiles(
     parameters, filestub, logFile, quarkLabel, kd, shift, quarkValues, *args, **kwargs
 ):
@@ -2,19 +2,20 @@
 import argparse
 import os
 import pathlib
-import re
 import sys
-import tarfile
 from collections import UserDict
 from datetime import datetime
 
+from colarunscripts import archive, backgroundTar, checkCfuns, completion, dedupe
+from colarunscripts import dirCache
 from colarunscripts import configIDs as cfg
 from colarunscripts import directories as dirs
-from colarunscripts import makeCfun, makeEmodes, makePropagator
+from colarunscripts import ledger, locking, makeCfun, makeEmodes, makePropagator
 from colarunscripts import parameters as params
-from colarunscripts import particles, simpleTime, submit
+from colarunscripts import provenance
+from colarunscripts import simpleTime, submit
 from colarunscripts.shifts import CompareShifts
-from colarunscripts.utilities import GetJobID, pp
+from colarunscripts.utilities import GetJobID, IsArrayJob, pp
 
 
 class Paths(UserDict):
@@ -98,6 +99,11 @@ def main(
     PrintJobValues(jobValues)
 
     JobLoops(parameters, jobValues["shifts"], jobValues["kds"], jobValues)
+
+    # Every config of an array job was submitted up front
+    if IsArrayJob(os.environ):
+        print("Part of an array job, not submitting next")
+        return
     SubmitNext(
         parameters,
         jobValues,
@@ -120,6 +126,10 @@ def JobLoops(parameters, shifts, kds, jobValues, *args, **kwargs):
     timer.initialiseTimer("Light Propagators")
     timer.initialiseTimer("Heavy Propagators")
     timer.initialiseTimer("Correlation functions")
+    timer.initialiseTimer(locking.TIMER)
+
+    # Tars may be compressed from other threads, which must not fork
+    archive.StartPool(parameters)
 
     # Do we actually need eigenmodes. Does not override makeEmodes = True
     # in parameters file (In case you want to make and not use eigenmodes
@@ -132,18 +142,51 @@ def JobLoops(parameters, shifts, kds, jobValues, *args, **kwargs):
     inputSummaries = []
     paths = Paths()  # Stores the created files so they can be deleted
 
+    # Checking every cfun for this config in one pass. Only the (kd, shift)
+    # sets which are missing something need to be done.
+    missing = checkCfuns.MissingCfuns(parameters, jobValues)
+
+    # Hashes of the input files of everything to be made. Cfuns made from
+    # input files which have since changed are remade too.
+    hashes = {}
+    if provenance.Enabled(parameters) or dedupe.Enabled(parameters):
+        for shift in shifts:
+            for kd in kds:
+                hashes[kd, shift] = ExpectedProvenance(parameters, kd, shift, jobValues)
+    if provenance.Enabled(parameters):
+        for (kd, shift), setHashes in hashes.items():
+            missing |= StaleCfuns(parameters, kd, shift, jobValues, setHashes["cfuns"])
+
+    incompleteSets = {(key[0], key[1]) for key in missing}
+    completion.Update(parameters, jobValues, missing)
+
     # The funky zip just ensures we have the current and the next shift
     # easily accessible
     for shift, nextShift in zip(shifts, [*shifts[1:], None]):
         for kd in kds:
 
-            if CfunsExist(parameters, jobValues, kd, shift) is True:
+            if (kd, shift) not in incompleteSets:
                 print(
                     f"Correlation functions for {kd=}, {shift=} already exist, skipping."
                 )
                 continue
-            newpaths = doJobSet(parameters, kd, shift, jobValues, timer)
+            # Only the particle pairs missing something are remade
+            incomplete = checkCfuns.IncompletePairs(missing, kd, shift)
+            newpaths = doJobSet(
+                parameters,
+                kd,
+                shift,
+                jobValues,
+                timer,
+                incomplete,
+                hashes.get((kd, shift)),
+            )
             paths = paths + newpaths
+
+            if jobValues["makeCfuns"] is True:
+                # Recording what this set actually managed to make
+                setMissing = checkCfuns.MissingCfuns(parameters, jobValues, kd, shift)
+                completion.Update(parameters, jobValues, setMissing, kd, shift)
             inputSummaries += list(jobValues["inputSummary"].values())
 
         removeProps = (
@@ -159,6 +202,9 @@ def JobLoops(parameters, shifts, kds, jobValues, *args, **kwargs):
                 print(f"Deleting {prop}")
                 path = pathlib.Path(prop)
                 path.unlink(missing_ok=True)
+                dirCache.Removed(prop)
+                provenance.Remove(prop)
+            ledger.Remove(parameters, paths["props"])
             paths.clear(key="props")
             print()
 
@@ -179,6 +225,9 @@ def JobLoops(parameters, shifts, kds, jobValues, *args, **kwargs):
                 print(f"Deleting {eigenMode}")
                 path = pathlib.Path(eigenMode)
                 path.unlink(missing_ok=True)
+                dirCache.Removed(eigenMode)
+                provenance.Remove(eigenMode)
+            ledger.Remove(parameters, paths["eigenmodes"])
             paths.clear(key="eigenmodes")
             print()
 
@@ -192,18 +241,50 @@ def JobLoops(parameters, shifts, kds, jobValues, *args, **kwargs):
         print(50 * "_")
         print()
 
-
-def doJobSet(parameters, kd, shift, jobValues, timer, *args, **kwargs) -> Paths:
+    # Tars still being written in the background must be finished before the
+    # job ends, and any error in them reported
+    try:
+        backgroundTar.Drain()
+    finally:
+        # Lock waits of the background tars, even if one of them failed
+        makeCfun.AddLockWaits(timer)
+        archive.ShutdownPool()
+
+    print(f"Filesystem metadata: {dirCache.Summary()}")
+    print(f"Tar locks: {locking.Summary()}")
+    if backgroundTar.Enabled(parameters):
+        print(f"Background tarring: {backgroundTar.Summary()}")
+    if archive.Codec(parameters) != "none":
+        print(f"Compression: {archive.Summary()}")
+    if dedupe.Enabled(parameters):
+        print(f"Deduplication: {dedupe.Summary()}")
+
+
+def doJobSet(
+    parameters,
+    kd,
+    shift,
+    jobValues,
+    timer,
+    incomplete=None,
+    hashes=None,
+    *args,
+    **kwargs,
+) -> Paths:
     """
     Runs eigenmode, propagator and cfun code for the one configuration.
 
     Loops through field strength and shifts inside through JobLoops function.
 
     Arguments:
-    jobValues -- dict: Dictionary containing the job specific values such as
-                           kd, shift, SLURM_ARRAY_TASK_ID, etc...
-    timer     -- Timer: Timer object to manage timing of correlation function
-                           calculation time.
+    jobValues  -- dict: Dictionary containing the job specific values such as
+                            kd, shift, SLURM_ARRAY_TASK_ID, etc...
+    timer      -- Timer: Timer object to manage timing of correlation function
+                            calculation time.
+    incomplete -- dict: (sinkType, structure) to particle pairs to make, as
+                            from checkCfuns.IncompletePairs. None for all.
+    hashes     -- dict: Provenance hashes, from ExpectedProvenance. None if
+                            provenance is not being tracked.
 
     """
 
@@ -227,7 +308,9 @@ def doJobSet(parameters, kd, shift, jobValues, timer, *args, **kwargs) -> Paths:
         jobValues["inputSummary"]["emode"] = PrepareInputReportFile(
             parameters, "emode", kd, shift, jobValues
         )
-        eigenmodePaths = makeEmodes.main(parameters, kd, shift, jobValues, timer)
+        eigenmodePaths = makeEmodes.main(
+            parameters, kd, shift, jobValues, timer, hashes
+        )
         print("\nEigenmodes done")
         print(f"Time is {datetime.now()}")
         print()
@@ -243,7 +326,7 @@ def doJobSet(parameters, kd, shift, jobValues, timer, *args, **kwargs) -> Paths:
         jobValues["inputSummary"]["prop"] = PrepareInputReportFile(
             parameters, "prop", kd, shift, jobValues
         )
-        propPaths = makePropagator.main(parameters, kd, shift, jobValues, timer)
+        propPaths = makePropagator.main(parameters, kd, shift, jobValues, timer, hashes)
         print("\nPropagators done")
         print(f"Time is {datetime.now()}")
         print(50 * "_")
@@ -261,7 +344,7 @@ def doJobSet(parameters, kd, shift, jobValues, timer, *args, **kwargs) -> Paths:
         jobValues["inputSummary"]["cfun"] = PrepareInputReportFile(
             parameters, "cfun", kd, shift, jobValues
         )
-        makeCfun.main(parameters, kd, shift, jobValues, timer)
+        makeCfun.main(parameters, kd, shift, jobValues, timer, incomplete, hashes)
         print("Correlation functions done")
         print(f"Time is {datetime.now()}")
         print(50 * "_")
@@ -276,6 +359,97 @@ def doJobSet(parameters, kd, shift, jobValues, timer, *args, **kwargs) -> Paths:
     return paths
 
 
+def ExpectedProvenance(parameters, kd, shift, jobValues, *args, **kwargs):
+    """
+    Computes the provenance hash of every artifact of a (kd, shift) set.
+
+    Each hash covers the input files of the artifact and the hashes of the
+    artifacts it reads, so a change propagates to everything downstream.
+
+    Arguments:
+    jobValues -- dict: Dictionary containing the job specific values
+
+    Returns:
+    hashes -- dict: With keys emodes and props (quark to hash) and cfuns
+                    ((sinkType, structure) to hash, structure joined into a
+                    string).
+    """
+
+    quarks = sorted(
+        {quark for structure in jobValues["structureList"] for quark in structure}
+    )
+    lpSource = "lp" in jobValues["sourceType"]
+
+    emodes = {}
+    if lpSource or "laplacian" in jobValues["sinkTypes"]:
+        for quark in quarks:
+            emodes[quark] = makeEmodes.DeckHash(parameters, kd, shift, quark, jobValues)
+
+    props = {}
+    for quark in quarks:
+        emodeHash = emodes[quark] if lpSource else None
+        props[quark] = makePropagator.DeckHash(
+            parameters, quark, kd, shift, jobValues, emodeHash
+        )
+
+    cfuns = {}
+    for sinkType in jobValues["sinkTypes"]:
+        for structure in jobValues["structureList"]:
+            if structure != ["u", "d", "s"] and sinkType == "smeared":
+                continue
+            upstream = [props[quark] for quark in structure]
+            if sinkType == "laplacian":
+                upstream += [emodes[quark] for quark in structure]
+            cfuns[sinkType, "".join(structure)] = makeCfun.DeckHash(
+                parameters, kd, shift, structure, sinkType, jobValues, upstream
+            )
+
+    return {"emodes": emodes, "props": props, "cfuns": cfuns}
+
+
+def StaleCfuns(parameters, kd, shift, jobValues, cfunHashes, *args, **kwargs):
+    """
+    Returns the cfuns of a (kd, shift) set made from different input files.
+
+    Arguments:
+    jobValues  -- dict: Dictionary containing the job specific values
+    cfunHashes -- dict: (sinkType, structure) to hash, from ExpectedProvenance
+
+    Returns:
+    stale -- set: Keys, as from checkCfuns.ExpectedCfuns, of every cfun of
+                  each (sinkType, structure) whose recorded hash differs.
+    """
+
+    staleSets = set()
+    for sinkType in jobValues["sinkTypes"]:
+        for structure in jobValues["structureList"]:
+            structureStr = "".join(structure)
+            if (sinkType, structureStr) not in cfunHashes:
+                continue
+            reportFile = dirs.FullDirectories(
+                parameters,
+                directory="cfunReport",
+                kd=kd,
+                shift=shift,
+                structure=structure,
+                makeDirs=False,
+                **{**jobValues, "sinkType": sinkType},
+                **parameters["sourcesink"],
+            )["cfunReport"]
+            deckHash = cfunHashes[sinkType, structureStr]
+            if provenance.Matches(parameters, reportFile, deckHash) is False:
+                print(f"Input files for {sinkType} {structure} changed, remaking")
+                staleSets.add((sinkType, structureStr))
+
+    if len(staleSets) == 0:
+        return set()
+    return {
+        key
+        for key, _, _, _ in checkCfuns.ExpectedCfuns(parameters, jobValues, kd, shift)
+        if (key[2], key[6]) in staleSets
+    }
+
+
 def PrepareInputReportFile(parameters, report, kd, shift, jobValues):
 
     pathArgs = {"kd": kd, "shift": shift, **jobValues, **parameters["sourcesink"]}
@@ -364,16 +538,28 @@ def SubmitNext(
 
     print(f"Submitting next. {ncon=} {nthConfig=} {numSimultaneousJobs=}")
 
-    while True:
+    # Other jobs have been writing in the meantime
+    dirCache.Clear()
 
-        nthConfig = int(nthConfig) + int(numSimultaneousJobs)
-        jobValues["cfgID"] = cfg.ConfigID(nthConfig, jobValues["runPrefix"], start)
+    while True:
 
-        if nthConfig > ncon:
+        # Skipping straight past configurations known to be complete
+        nthConfig = completion.NextIncomplete(
+            parameters,
+            jobValues["kappa"],
+            int(nthConfig),
+            int(numSimultaneousJobs),
+            ncon,
+        )
+        if nthConfig is None:
             print(f"No new configurations to submit")
             return
+        jobValues["cfgID"] = cfg.ConfigID(nthConfig, jobValues["runPrefix"], start)
 
-        if CfunsExist(parameters, jobValues) is False:
+        # The bitmap may not know about work done elsewhere, so confirming
+        missing = checkCfuns.MissingCfuns(parameters, jobValues)
+        completion.Update(parameters, {**jobValues, "nthConfig": nthConfig}, missing)
+        if len(missing) > 0:
             break
         else:
             print(
@@ -417,78 +603,8 @@ def CfunsExist(parameters, jobValues, kd=None, shift=None, *args, **kwargs):
 
     """
 
-    # Note: As soon as we find something is missing, we can return false as
-    # all cfuns are made in one call. (Structure exempt, on todo list)
-
-    # Recursively calling function for all shifts/kd if not specified
-    if kd is None:
-        for kd in jobValues["kds"]:
-            if CfunsExist(parameters, jobValues, kd, shift) is False:
-                return False
-    if shift is None:
-        for shift in jobValues["shifts"]:
-            if CfunsExist(parameters, jobValues, kd, shift) is False:
-                return False
-
-    for sinkType in jobValues["sinkTypes"]:
-
-        # Grabbing appropriate sink values
-        if "laplacian" == sinkType:
-            sinkVals = parameters["sourcesink"]["nModes_lpsnk"]
-        elif "smeared" == sinkType:
-            sinkVals = parameters["sourcesink"]["sweeps_smsnk"]
-
-        # Looping through everything we need
-        for sinkVal in sinkVals:
-            cfunArgs = {"kd": kd, "shift": shift, "sinkVal": sinkVal, **jobValues}
-            cfunArgs["sinkType"] = sinkType
-            cfunFilename = dirs.GetCfunFile(parameters, **cfunArgs)
-
-            tarArgs = {
-                "kd": kd,
-                "shift": shift,
-                "sinkType": sinkType,
-                "sinkVal": "",
-                "jobValues": jobValues,
-            }
-            tarFilename, _ = makeCfun.GetTarFile(parameters, **tarArgs)
-
-            for chi, chibar in jobValues["particleList"]:
-
-                for structure in jobValues["structureList"]:
-                    # Not a perfect check for isospin, but close enough
-                    if (kd == 0) or (structure[1] == structure[0]):
-                        fields = particles.CheckForVanishingFields(
-                            isospin_sym=True, chi=chi, chibar=chibar
-                        )
-                        if len(fields) == 0:
-                            continue
-
-                    # Structure in jobValues['structureList'] is a list
-                    formattedStructure = "".join(structure)
-                    cfun = cfunFilename.replace(
-                        "CHICHIBAR_STRUCTURE", f"{chi}{chibar}_{formattedStructure}"
-                    )
-                    tar = tarFilename.replace(
-                        "CHICHIBAR_STRUCTURE", f"{chi}{chibar}_{formattedStructure}"
-                    )
-
-                    cfunParts = re.split(r"\/", cfun)
-                    prunedCfun = cfunParts[-3] + "/" + cfunParts[-1]
-                    try:
-                        with tarfile.open(tar, "r") as t:
-                            fileList = t.getnames()
-
-                    except FileNotFoundError:
-                        fileList = []
-
-                    if (
-                        pathlib.Path(cfun).is_file() is False
-                        and prunedCfun not in fileList
-                    ):
-                        return False
-
-        return True
+    missing = checkCfuns.MissingCfuns(parameters, jobValues, kd, shift)
+    return len(missing) == 0
 
 
 if __name__ == "__main__":
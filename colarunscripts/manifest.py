@@ -0,0 +1,508 @@
+"""
+Module for the campaign manifest, a table of every expected output file.
+
+A parameters file is expanded into one row for every eigenmode, propagator and
+correlation function it should produce, for every configuration of every
+kappa value. Paths are only derived once per kappa value, as templates with
+the CONFIGID placeholder left in. Rows for each configuration then only store
+the index of the template and of the configuration ID.
+
+All strings are interned in a single table and the columns are stored in
+arrays of integers, so a campaign of 10^6 rows takes tens of MB. Manifests
+can be saved to and loaded from a binary file with
+    python campaign.py manifest
+
+The cfun templates of each kappa value are kept for the process, so the
+checkers (see checkCfuns.ExpectedCfuns), which are called for every config,
+only fill in the configuration ID rather than deriving the paths again.
+
+Main functions:
+  SinkValues    -- Returns the sink values of a sink type
+  CfunTemplates -- Returns every cfun of a kappa value, with CONFIGID in place
+                   of the configuration ID
+  Build         -- Expands a parameters file into a Manifest
+  Load          -- Loads a Manifest saved with Manifest.save
+"""
+
+# standard library modules
+import array  # for the columns
+import json  # for the header of saved manifests
+
+# local modules
+from colarunscripts import configIDs as cfg
+from colarunscripts import directories as dirs
+from colarunscripts import ledger, makeCfun, particles
+from colarunscripts.particles import QuarkCharge
+from colarunscripts.shifts import FormatShift
+
+# Kinds of artifacts, stored by their index in the kind column
+KINDS = ("emode", "prop", "cfun")
+
+# Columns and their array typecodes. Columns with typecode I (other than
+# kappa) hold indices into the string table. path and member are templates
+# which still contain CONFIGID.
+COLUMNS = {
+    "kind": "B",
+    "kappa": "I",
+    "cfgID": "I",
+    "kd": "i",
+    "shift": "I",
+    "source": "I",
+    "sinkType": "I",
+    "sinkVal": "I",
+    "structure": "I",
+    "chi": "I",
+    "chibar": "I",
+    "path": "I",
+    "tar": "I",
+    "member": "I",
+}
+NUMERIC = ("kind", "kappa", "kd")
+
+# Identifies saved manifest files
+MAGIC = b"COLAMANIFEST1\n"
+
+# Values of jobValues which differ between configurations or change during a
+# job, but which cfun paths do not depend on other than through cfgID
+PERCONFIG = ("cfgID", "nthConfig", "jobID", "configFile", "inputSummary", "sinkType")
+
+# Cfun templates already derived, keyed by _TemplateKey
+_cfunTemplates = {}
+
+
+class Manifest:
+    """
+    A table of expected output files with interned, array-backed columns.
+
+    Attributes:
+    strings -- list: The string table
+    columns -- dict: Column name to array of values
+
+    Methods:
+    intern    -- Returns the index of a string in the string table
+    extend    -- Adds the rows of one configuration from templates
+    value     -- Returns a single value, as a string for string columns
+    path      -- Returns the full path of a row
+    member    -- Returns the name inside the tar of a cfun row
+    row       -- Returns a dictionary of all values of a row
+    indices   -- Returns the indices of rows matching given values
+    ledgerRow -- Returns a row in the form used by the ledger
+    save      -- Saves the manifest to a binary file
+    """
+
+    def __init__(self):
+        self.strings = []
+        self._stringIndex = {}
+        self.columns = {name: array.array(code) for name, code in COLUMNS.items()}
+
+    def __len__(self):
+        return len(self.columns["kind"])
+
+    def intern(self, string):
+        """
+        Returns the index of a string in the string table, adding it if new.
+
+        Arguments:
+        string -- str: The string to intern
+        """
+        string = str(string)
+        try:
+            return self._stringIndex[string]
+        except KeyError:
+            self._stringIndex[string] = len(self.strings)
+            self.strings.append(string)
+            return self._stringIndex[string]
+
+    def extend(self, templates, cfgID):
+        """
+        Adds the rows of one configuration.
+
+        Arguments:
+        templates -- dict: Column name to array of template values, as
+                           returned by TemplateColumns. No cfgID column.
+        cfgID     -- str: The configuration ID of the new rows
+        """
+        numRows = len(templates["kind"])
+        for name, column in templates.items():
+            self.columns[name].extend(column)
+        self.columns["cfgID"].extend(
+            array.array(COLUMNS["cfgID"], [self.intern(cfgID)]) * numRows
+        )
+
+    def value(self, name, i):
+        """
+        Returns a single value, as a string for string columns.
+
+        Arguments:
+        name -- str: The column name
+        i    -- int: The row index
+        """
+        value = self.columns[name][i]
+        if name == "kind":
+            return KINDS[value]
+        elif name in NUMERIC:
+            return value
+        return self.strings[value]
+
+    def path(self, i):
+        """Returns the full path of row i."""
+        return self.value("path", i).replace("CONFIGID", self.value("cfgID", i))
+
+    def member(self, i):
+        """Returns the name inside the tar of row i. Empty if not a cfun."""
+        return self.value("member", i).replace("CONFIGID", self.value("cfgID", i))
+
+    def row(self, i):
+        """Returns a dictionary of all values of row i, paths completed."""
+        values = {name: self.value(name, i) for name in COLUMNS}
+        values["path"] = self.path(i)
+        values["member"] = self.member(i)
+        return values
+
+    def indices(self, **criteria):
+        """
+        Returns the indices of rows matching all the given values.
+
+        Arguments:
+        criteria -- Column name to value, ie. kind="cfun", cfgID="-a-001880"
+        """
+        matching = range(len(self))
+        for name, value in criteria.items():
+            if name == "kind":
+                target = KINDS.index(value)
+            elif name in NUMERIC:
+                target = int(value)
+            elif str(value) in self._stringIndex:
+                target = self._stringIndex[str(value)]
+            else:
+                return []
+            column = self.columns[name]
+            matching = [i for i in matching if column[i] == target]
+        return list(matching)
+
+    def ledgerRow(self, i):
+        """Returns row i in the form used by the ledger (see ledger.Row)."""
+        values = self.row(i)
+        if values["kind"] == "cfun":
+            sink = ledger.SinkLabel(values["sinkType"], values["sinkVal"])
+        else:
+            sink = ""
+        return ledger.Row(
+            values["kind"],
+            values["path"],
+            values["kappa"],
+            values["cfgID"],
+            values["kd"],
+            values["shift"],
+            values["source"],
+            sink,
+            values["structure"],
+            values["chi"] + values["chibar"],
+        )
+
+    def save(self, filename):
+        """
+        Saves the manifest to a binary file.
+
+        The file is a magic line, a JSON header line, the string table as
+        null separated UTF-8, then each column's raw array bytes.
+
+        Arguments:
+        filename -- str: The file to write
+        """
+        stringBytes = "\0".join(self.strings).encode()
+        header = {
+            "numRows": len(self),
+            "numStrings": len(self.strings),
+            "stringBytes": len(stringBytes),
+            "columns": {
+                name: [column.typecode, column.itemsize]
+                for name, column in self.columns.items()
+            },
+        }
+        with open(filename, "wb") as f:
+            f.write(MAGIC)
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(stringBytes)
+            for column in self.columns.values():
+                column.tofile(f)
+
+
+def Load(filename, *args, **kwargs):
+    """
+    Loads a Manifest saved with Manifest.save.
+
+    Arguments:
+    filename -- str: The file to read
+    """
+
+    manifest = Manifest()
+    with open(filename, "rb") as f:
+        if f.readline() != MAGIC:
+            raise ValueError(f"{filename} is not a manifest file")
+        header = json.loads(f.readline())
+        strings = f.read(header["stringBytes"]).decode()
+        manifest.strings = strings.split("\0") if header["numStrings"] else []
+        manifest._stringIndex = {s: i for i, s in enumerate(manifest.strings)}
+        for name, (typecode, itemsize) in header["columns"].items():
+            column = array.array(typecode)
+            if column.itemsize != itemsize:
+                raise ValueError(f"{filename} was saved on an incompatible machine")
+            column.fromfile(f, header["numRows"])
+            manifest.columns[name] = column
+    return manifest
+
+
+def SinkValues(parameters, sinkType, *args, **kwargs):
+    """
+    Returns the list of sink values for a sink type.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    sinkType   -- str: The type of sink, laplacian or smeared
+    """
+
+    if "laplacian" == sinkType:
+        return parameters["sourcesink"]["nModes_lpsnk"]
+    elif "smeared" == sinkType:
+        return parameters["sourcesink"]["sweeps_smsnk"]
+    else:
+        raise ValueError(f"Unknown sink type {sinkType}")
+
+
+def _TemplateKey(parameters, jobValues):
+    """Returns what the cfun templates of a kappa value depend on, as a str."""
+
+    return repr(
+        (
+            {
+                name: values
+                for name, values in parameters.items()
+                if name != "runValues"
+            },
+            {name: value for name, value in jobValues.items() if name not in PERCONFIG},
+        )
+    )
+
+
+def CfunTemplates(parameters, jobValues, *args, **kwargs):
+    """
+    Returns every cfun of a kappa value, with CONFIGID in place of the cfgID.
+
+    Derived once for each kappa value and set of parameters, and kept.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of run values. kappa must be set.
+
+    Returns:
+    templates -- list: (key, cfun, tar, member) tuples, as described in
+                       checkCfuns.ExpectedCfuns, not to be modified
+    """
+
+    templateKey = _TemplateKey(parameters, jobValues)
+    if templateKey in _cfunTemplates:
+        return _cfunTemplates[templateKey]
+
+    jobValues = {**jobValues, "cfgID": "CONFIGID"}
+    expected = []
+    for kd in jobValues["kds"]:
+        for shift in jobValues["shifts"]:
+            for sinkType in jobValues["sinkTypes"]:
+
+                # Tar path depends only on the structure and particles,
+                # which are replaced below
+                tarArgs = {
+                    "kd": kd,
+                    "shift": shift,
+                    "sinkType": sinkType,
+                    "sinkVal": "",
+                    "jobValues": jobValues,
+                    "makeDirs": False,
+                }
+                tarFilename, _ = makeCfun.GetTarFile(parameters, **tarArgs)
+
+                for sinkVal in SinkValues(parameters, sinkType):
+                    cfunArgs = {"kd": kd, "shift": shift, **jobValues}
+                    cfunArgs["sinkType"] = sinkType
+                    cfunArgs["sinkVal"] = sinkVal
+                    cfunArgs["makeDirs"] = False
+                    cfunFilename = dirs.GetCfunFile(parameters, **cfunArgs)
+
+                    for structure in jobValues["structureList"]:
+                        # These combinations are never made by makeCfun
+                        if structure != ["u", "d", "s"] and sinkType == "smeared":
+                            continue
+
+                        for chi, chibar in jobValues["particleList"]:
+                            # Not a perfect check for isospin, but close enough
+                            if (kd == 0) or (structure[1] == structure[0]):
+                                fields = particles.CheckForVanishingFields(
+                                    isospin_sym=True, chi=chi, chibar=chibar
+                                )
+                                if len(fields) == 0:
+                                    continue
+
+                            formattedStructure = "".join(structure)
+                            label = f"{chi}{chibar}_{formattedStructure}"
+                            cfun = cfunFilename.replace("CHICHIBAR_STRUCTURE", label)
+                            tar = tarFilename.replace("CHICHIBAR_STRUCTURE", label)
+                            member = makeCfun.MemberNames([cfun], shift)[0]
+
+                            key = (
+                                kd,
+                                shift,
+                                sinkType,
+                                sinkVal,
+                                chi,
+                                chibar,
+                                formattedStructure,
+                            )
+                            expected.append((key, cfun, tar, member))
+
+    # Only a few sets of parameters are used by a process
+    if len(_cfunTemplates) >= 16:
+        _cfunTemplates.clear()
+    _cfunTemplates[templateKey] = expected
+    return expected
+
+
+def TemplateColumns(manifest, parameters, jobValues, *args, **kwargs):
+    """
+    Returns the template rows of one kappa value as columns.
+
+    Paths are derived once, with the configuration ID left as the CONFIGID
+    placeholder.
+
+    Arguments:
+    manifest   -- Manifest: The manifest to intern strings in
+    parameters -- dict: Dictionary of all parameters from yml
+    jobValues  -- dict: Dictionary of run values. kappa must be set.
+    """
+
+    # Values are filled with the placeholder, real values go in per config
+    jobValues = {**jobValues, "cfgID": "CONFIGID"}
+    kappa = jobValues["kappa"]
+    source = ledger.SourceLabel(parameters, jobValues["sourceType"])
+    quarks = {quark for structure in jobValues["structureList"] for quark in structure}
+    templates = {
+        name: array.array(code) for name, code in COLUMNS.items() if name != "cfgID"
+    }
+    s = manifest.intern
+
+    def Add(
+        kind,
+        kappa,
+        kd,
+        shift,
+        path,
+        source="",
+        sinkType="",
+        sinkVal="",
+        structure="",
+        chi="",
+        chibar="",
+        tar="",
+        member="",
+    ):
+        for name, value in (
+            ("kind", KINDS.index(kind)),
+            ("kappa", int(kappa)),
+            ("kd", int(kd)),
+            ("shift", s(shift)),
+            ("source", s(source)),
+            ("sinkType", s(sinkType)),
+            ("sinkVal", s(sinkVal)),
+            ("structure", s(structure)),
+            ("chi", s(chi)),
+            ("chibar", s(chibar)),
+            ("path", s(path)),
+            ("tar", s(tar)),
+            ("member", s(member)),
+        ):
+            templates[name].append(value)
+
+    for kd in jobValues["kds"]:
+        for shift in jobValues["shifts"]:
+            # Eigenmodes
+            emodeShift = FormatShift(shift, form="label", fullShift="emode")
+            modeFiles = dirs.LapModeFiles(
+                parameters,
+                kd=kd,
+                shift=shift,
+                quark=sorted(quarks),
+                makeDirs=False,
+                **jobValues,
+            )
+            # Eigenmodes are shared between quarks of the same charge
+            for modeFile, quark in {
+                modeFile: quark for quark, modeFile in modeFiles.items()
+            }.items():
+                Add("emode", kappa, kd * QuarkCharge(quark), emodeShift, modeFile)
+
+            # Propagators
+            propDict = makeCfun.CompilePropPaths(
+                parameters, kd, shift, jobValues, makeDirs=False
+            )
+            for quark, propFile in propDict.items():
+                if quark in ["s", "nh"]:
+                    propKappa = parameters["propcfun"]["strangeKappa"]
+                else:
+                    propKappa = kappa
+                Add("prop", propKappa, kd * QuarkCharge(quark), shift, propFile, source)
+
+    # Correlation functions
+    for key, cfun, tar, member in CfunTemplates(parameters, jobValues):
+        kd, shift, sinkType, sinkVal, chi, chibar, structure = key
+        Add(
+            "cfun",
+            kappa,
+            kd,
+            shift,
+            cfun,
+            source,
+            sinkType,
+            sinkVal,
+            structure,
+            chi,
+            chibar,
+            tar,
+            member,
+        )
+
+    return templates
+
+
+def Build(parameters, kappaValues=None, cfgIDs=None, *args, **kwargs):
+    """
+    Expands a parameters file into a Manifest of every expected output file.
+
+    Arguments:
+    parameters  -- dict: Dictionary of all parameters from yml
+    kappaValues -- list: Kappa values to include. Default is all in runValues.
+    cfgIDs      -- list: Configuration IDs to include. Default is all
+                         configurations of each kappa.
+    """
+
+    runValues = parameters["runValues"]
+    if kappaValues is None:
+        kappaValues = runValues["kappaValues"]
+
+    manifest = Manifest()
+    for kappa in kappaValues:
+        jobValues = {**runValues, "kappa": kappa}
+        templates = TemplateColumns(manifest, parameters, jobValues)
+
+        if cfgIDs is None:
+            start, ncon = cfg.ConfigDetails(kappa, runValues["runPrefix"])
+            kappaIDs = [
+                cfg.ConfigID(n, runValues["runPrefix"], start)
+                for n in range(1, ncon + 1)
+            ]
+        else:
+            kappaIDs = cfgIDs
+
+        for cfgID in kappaIDs:
+            manifest.extend(templates, cfgID)
+
+    return manifest
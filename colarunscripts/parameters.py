@@ -17,7 +17,7 @@ import yaml  # yaml importing
 
 # local modules
 from colarunscripts import directories as dirs
-from colarunscripts.utilities import pp
+from colarunscripts.utilities import AtomicWrite, pp
 
 
 def Load(parametersFile="", writeOut=False, *args, **kwargs):
@@ -63,7 +63,8 @@ def CopyParamsFile(oldFile, jobID, testing=None, *args, **kwargs):
 
     print(f"Making copy of parameters file at: {copyFile}")
     print()
-    yaml.dump(parameters, open(copyFile, "w"))
+    with AtomicWrite(copyFile) as f:
+        yaml.dump(parameters, f)
 
 
 def ModifyExecutables(parameters, *args, **kwargs):
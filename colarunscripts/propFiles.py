@@ -9,7 +9,7 @@ from colarunscripts import directories as dirs
 from colarunscripts import parameters as params
 from colarunscripts import shifts
 from colarunscripts import sources as src
-from colarunscripts.utilities import VariablePrinter
+from colarunscripts.utilities import AtomicWrite, VariablePrinter
 
 
 def MakeLatticeFile(filestub, logFile, extent):
@@ -25,7 +25,7 @@ def MakeLatticeFile(filestub, logFile, extent):
     extension = ".lat"
 
     # Writing to the file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write("\n".join(str(dim) for dim in extent))
         f.write("\n")
 
@@ -50,7 +50,7 @@ def MakeCloverFile(filestub, logFile, bcx, bcy, bcz, bct, u0, C_SW, *args, **kwa
     extension = ".fm_clover"
 
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{bcx}\n")
         f.write(f"{bcy}\n")
         f.write(f"{bcz}\n")
@@ -120,7 +120,7 @@ def MakePropFile(
     U1FieldCode = FieldCode(U1FieldType, U1FieldQuanta, kd)
 
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{configFile}\n")
         f.write(f"{configFormat}\n")
         f.write(f"{quarkPrefix}\n")
@@ -0,0 +1,159 @@
+"""
+Module for recording which input decks produced each artifact.
+
+When useProvenance is True in runValues, every eigenmode, propagator and
+set of correlation functions carries a hash of exactly the input deck files
+that produced it, combined with the hashes of the artifacts it was made
+from. The hash is kept in a <artifact>.provenance sidecar (for correlation
+functions, next to the cfun report file of the cfungen call). An artifact is
+only reused if its recorded hash matches the hash of the decks the current
+parameters produce, so changing ie. the tolerance remakes the propagators
+and everything downstream of them, while changing a key no deck depends on
+reuses everything.
+
+Deck contents are normalised before hashing, so the job specific filestub,
+temporary storage directory and campaign output directory do not change the
+hash. Equal hashes in different campaigns therefore mean identical inputs,
+which dedupe.py relies on. Artifacts made before provenance was turned on
+have no sidecar and are trusted.
+
+Main functions:
+  Enabled  -- Whether provenance is turned on in the parameters
+  DeckHash -- Hashes the deck files written under a filestub
+  Matches  -- Whether an artifact's recorded hash matches
+  Write    -- Records the hash of an artifact
+  Remove   -- Removes the record of a deleted artifact
+"""
+
+# standard library modules
+import glob  # for finding the deck files
+import hashlib  # for the hashes themselves
+import os  # for removing files
+
+# local modules
+from colarunscripts import directories as dirs
+from colarunscripts.utilities import AtomicWrite, GetEnvironmentVar
+
+
+def Enabled(parameters, *args, **kwargs):
+    """Returns whether provenance is turned on in the parameters."""
+    return parameters["runValues"].get("useProvenance", False) is True
+
+
+def ScratchStub(parameters, directory, jobValues, label, *args, **kwargs):
+    """
+    Returns a filestub to write decks under purely for hashing.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    directory  -- str: Input directory key, ie. propInput
+    jobValues  -- dict: Dictionary of parameters relevant to this job
+    label      -- str: Distinguishes the decks of one artifact from another
+    """
+
+    inputDir = dirs.FullDirectories(parameters, directory=directory)[directory]
+    return f'{inputDir}{jobValues["jobID"]}_{jobValues["nthConfig"]}_provenance{label}'
+
+
+def DeckHash(parameters, filestub, upstream=(), cleanUp=False, *args, **kwargs):
+    """
+    Hashes every deck file written under a filestub.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    filestub   -- str: The filestub the decks were written under. Every file
+                       starting with it is included.
+    upstream   -- iterable: Hashes of the artifacts these decks read
+    cleanUp    -- bool: Whether to delete the decks after hashing
+
+    Returns:
+    hash -- str: Hex digest
+    """
+
+    # Output trees are replaced before the storage they sit in
+    directories = parameters["directories"]
+    replacements = [
+        (filestub, "FILESTUB"),
+        (directories["baseOutputDir"] + directories["runIdentifier"], "OUTPUTDIR/"),
+    ]
+    tempDir = GetEnvironmentVar(parameters["tempStorage"]["tempFS"])
+    if tempDir not in [None, "", "NONE"]:
+        replacements.append((f'{tempDir}/{directories["runIdentifier"]}', "OUTPUTDIR/"))
+        replacements.append((tempDir, "TEMPFS"))
+
+    digest = hashlib.sha256()
+    for deck in sorted(glob.glob(glob.escape(filestub) + "*")):
+        with open(deck, "r") as f:
+            contents = f.read()
+        for old, new in replacements:
+            contents = contents.replace(old, new)
+        # Name relative to the filestub so the stub itself does not matter
+        digest.update(deck[len(filestub) :].encode() + b"\0")
+        digest.update(contents.encode() + b"\0")
+        if cleanUp is True:
+            os.remove(deck)
+
+    for upstreamHash in upstream:
+        digest.update(upstreamHash.encode() + b"\0")
+    return digest.hexdigest()
+
+
+def SidecarFile(path, *args, **kwargs):
+    """Returns the path of the provenance sidecar of an artifact."""
+    return path + ".provenance"
+
+
+def Read(path, *args, **kwargs):
+    """Returns the recorded hash of an artifact, or None if there is none."""
+
+    try:
+        with open(SidecarFile(path), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def Matches(parameters, path, deckHash, *args, **kwargs):
+    """
+    Returns whether an artifact may be reused given the hash of its decks.
+
+    Always True if provenance is disabled or nothing was recorded.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    path       -- str: Path to the artifact
+    deckHash   -- str: The hash of the decks the artifact would be made from
+    """
+
+    if Enabled(parameters) is False:
+        return True
+    recorded = Read(path)
+    return recorded is None or recorded == deckHash
+
+
+def Write(parameters, path, deckHash, *args, **kwargs):
+    """
+    Records the hash of the decks an artifact was made from.
+
+    Does nothing if provenance is disabled.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    path       -- str: Path to the artifact
+    deckHash   -- str: The hash of the decks it was made from
+    """
+
+    if Enabled(parameters) is False:
+        return
+
+    with AtomicWrite(SidecarFile(path)) as f:
+        f.write(deckHash + "\n")
+
+
+def Remove(path, *args, **kwargs):
+    """Removes the sidecar of a deleted artifact, if there is one."""
+
+    try:
+        os.remove(SidecarFile(path))
+    except FileNotFoundError:
+        pass
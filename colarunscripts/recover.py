@@ -0,0 +1,244 @@
+"""
+Module for putting orphaned correlation functions into their tars.
+
+Cfuns are left loose in the cfuns/ directories when CreateTar gives up
+waiting for a tar lock, or the job making them dies before tarring. They are
+still found by the checkers, but each costs a stat. Here every loose cfun
+of the campaign is found, its filename parsed back into the values it was
+made with, and it is put into the tar it would have gone into, along with
+its entries in the tar's ID and member sidecars.
+
+Filenames are parsed with a pattern built from the cfun path in the
+parameters, so the same parameters must be used as made the cfuns.
+
+Recovery is safe to run while jobs are running, and to run again:
+  - only cfuns older than a minimum age are touched, so cfuns being written
+    or about to be tarred by a running job are left alone
+  - each tar is locked while it is written, as it is by the jobs
+  - a cfun already in its tar, or a shard of it, with the same contents is
+    deleted rather than added again
+Appends to tars left journaled by killed jobs (see journal.py) are rolled
+back or completed first, so the cfuns of appends rolled back are recovered
+along with the rest.
+
+Main functions:
+  Pattern -- Returns the pattern matching the cfuns of a campaign
+  Parse   -- Parses a cfun path back into the values it was made with
+  Orphans -- Finds the loose cfuns of a campaign, grouped by tar
+  Ingest  -- Puts the loose cfuns of a tar into it
+"""
+
+# standard library modules
+import os  # for walking the output tree and file ages
+import re  # for parsing cfun paths
+import time  # for file ages
+
+# local modules
+from colarunscripts import archive, journal, locking, makeCfun, shards
+from colarunscripts import directories as dirs
+
+# Placeholders put in the cfun path, and the pattern replacing each
+FIELDS = {
+    "KAPPA": ("kappa", r"[^/]+?"),
+    "KD": ("kd", r"-?\d+"),
+    "SHIFT": ("shift", r"[^/]+?"),
+    "SOURCE": ("source", r"[^/]+?"),
+    "CONFIGID": ("cfgID", r"-(?:[ab]|[ghijk]M)-\d+"),
+    "SINKTYPE": ("sinkType", r"lp|sm"),
+    "SINKVAL": ("sinkVal", r"\d+"),
+    "CHICHIBAR": ("pair", r"[^/]+"),
+    "STRUCTURE": ("structure", r"[a-z]+"),
+}
+
+# Sink labels in filenames, as set in directories.GetCfunFile
+SINKTYPES = {"lp": "laplacian", "sm": "smeared"}
+
+
+def Pattern(parameters, *args, **kwargs):
+    """
+    Returns the pattern matching the paths of the cfuns of a campaign.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+
+    Returns:
+    pattern -- re.Pattern: With a named group for each value in FIELDS
+    """
+
+    # Unknowns are replaced by tokens which survive FullDirectories
+    token = {key: f"@{key}@" for key in FIELDS}
+    cfunBase = dirs.FullDirectories(
+        parameters,
+        directory="cfun",
+        kappa=token["KAPPA"],
+        kd=token["KD"],
+        shift=token["SHIFT"],
+        sourceType=token["SOURCE"],
+        cfgID=token["CONFIGID"],
+        makeDirs=False,
+    )["cfun"]
+    path = (
+        f'{cfunBase}{token["CONFIGID"]}si{token["SINKTYPE"]}{token["SINKVAL"]}'
+        f'.{token["CHICHIBAR"]}_{token["STRUCTURE"]}.u.2cf'
+    )
+
+    regex = re.escape(path)
+    for key, (name, group) in FIELDS.items():
+        escaped = re.escape(token[key])
+        # Values appearing more than once in the path must agree
+        regex = regex.replace(escaped, f"(?P<{name}>{group})", 1)
+        regex = regex.replace(escaped, f"(?P={name})")
+    return re.compile(regex + "$")
+
+
+def Parse(parameters, cfunPath, pattern=None, *args, **kwargs):
+    """
+    Parses a cfun path back into the values it was made with.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    cfunPath   -- str: Path to the cfun
+    pattern    -- re.Pattern: From Pattern, to save building it again
+
+    Returns:
+    fields -- dict: With kappa, kd, shift, source, cfgID, sinkType, sinkVal,
+                    chi, chibar and structure, as in the parameters, and tar
+                    and member, where the cfun is put. None if the path is
+                    not that of a cfun of the campaign. chi and chibar are
+                    None if the particles are not in the particleList.
+    """
+
+    if pattern is None:
+        pattern = Pattern(parameters)
+    match = pattern.match(cfunPath)
+    if match is None:
+        return None
+
+    fields = match.groupdict()
+    fields["kd"] = int(fields["kd"])
+    sinkLabel = fields["sinkType"]
+    fields["sinkType"] = SINKTYPES[sinkLabel]
+
+    # The particles are run together, so are split by the known pairs
+    fields["chi"], fields["chibar"] = None, None
+    for chi, chibar in parameters["runValues"]["particleList"]:
+        if f"{chi}{chibar}" == fields["pair"]:
+            fields["chi"], fields["chibar"] = chi, chibar
+            break
+
+    # The tar is named as if globbing over the sink values, see GetTarFile
+    directory, filename = os.path.split(cfunPath)
+    filename = filename.replace(
+        f'si{sinkLabel}{fields["sinkVal"]}.', f"si{sinkLabel}*.", 1
+    )
+    fields["tar"] = makeCfun.TarOf(
+        os.path.join(directory, filename), archive.Extension(parameters)
+    )
+    fields["member"] = f'sh{fields["shift"]}/{os.path.basename(cfunPath)}'
+    return fields
+
+
+def Orphans(parameters, minAge, *args, **kwargs):
+    """
+    Finds the loose cfuns of a campaign.
+
+    Arguments:
+    parameters -- dict: Dictionary of all parameters from yml
+    minAge     -- float: Seconds since a cfun was last modified before it is
+                         considered orphaned
+
+    Returns:
+    orphans -- dict: Tar path to a list of (cfun path, shift, cfgID, member).
+                     Tars with a journal are included, even with no cfuns.
+    skipped -- int: Number of cfuns too new to be orphaned
+    """
+
+    directories = parameters["directories"]
+    outputDir = directories["baseOutputDir"] + directories["runIdentifier"]
+    pattern = Pattern(parameters)
+    cutoff = time.time() - minAge
+
+    orphans = {}
+    skipped = 0
+    for root, _, fileNames in os.walk(outputDir):
+        for name in fileNames:
+            if name.endswith(journal.SUFFIX):
+                orphans.setdefault(os.path.join(root, name[: -len(journal.SUFFIX)]), [])
+                continue
+            if not name.endswith(".u.2cf"):
+                continue
+            cfunPath = os.path.join(root, name)
+            fields = Parse(parameters, cfunPath, pattern)
+            if fields is None:
+                continue
+            try:
+                if os.stat(cfunPath).st_mtime > cutoff:
+                    skipped += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            orphans.setdefault(fields["tar"], []).append(
+                (cfunPath, fields["shift"], fields["cfgID"], fields["member"])
+            )
+    return orphans, skipped
+
+
+def Ingest(
+    tarPath,
+    cfuns,
+    timeout=locking.TIMEOUT,
+    lease=locking.LEASE,
+    codec="none",
+    dryRun=False,
+    *args,
+    **kwargs,
+):
+    """
+    Puts the loose cfuns of a tar into it, then deletes them.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    cfuns   -- list: (cfun path, shift, cfgID, member) tuples, from Orphans
+    timeout -- float: Seconds to wait for the lock on the tar
+    lease   -- float: Seconds after which other jobs may take the lock over
+    codec   -- str: Compression of the cfuns in the tar, see archive.CODECS
+    dryRun  -- bool: Only count what would be done
+
+    Returns:
+    counts -- dict: Numbers of cfuns added, deleted as already in the tar,
+                    and gone, ie. tarred by a job meanwhile
+    """
+
+    counts = {"added": 0, "duplicates": 0, "gone": 0}
+    try:
+        with locking.Locked(tarPath, timeout, lease=lease):
+            if dryRun is False:
+                journal.Replay(tarPath)
+            groups = {}
+            for cfunPath, shift, cfgID, member in cfuns:
+                if not os.path.isfile(cfunPath):
+                    counts["gone"] += 1
+                    continue
+                path = shards.Locate(tarPath, member)
+                if path is not None:
+                    with open(cfunPath, "rb") as f:
+                        if f.read() == archive.Read(path, member):
+                            counts["duplicates"] += 1
+                            if dryRun is False:
+                                os.remove(cfunPath)
+                            continue
+                groups.setdefault((shift, cfgID), []).append(cfunPath)
+                counts["added"] += 1
+
+            if dryRun is True:
+                return counts
+            # One append, and sidecar entry, per config and shift, as by jobs
+            for (shift, cfgID), cfunList in groups.items():
+                compressed = None
+                if codec != "none":
+                    compressed = archive.Compress(cfunList, codec, 1)
+                makeCfun.AppendCfuns(tarPath, cfunList, shift, cfgID, compressed, codec)
+    except locking.LockTimeout:
+        print(f"Could not lock {tarPath} in {timeout}s, leaving its cfuns loose")
+        counts["added"] = 0
+    return counts
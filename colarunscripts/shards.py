@@ -0,0 +1,213 @@
+"""
+Module for the per-job shard tars of the correlation functions.
+
+When shardTars is True in runValues, jobs do not append to the shared
+per-particle tars. Each call to CreateTar instead writes a new shard
+    <tar>.shards/<cfgID>_<jobID>_sh<shift>.tar
+(or .zip, see archive.py) with its own ID and member sidecars (see
+cfgSidecar.py), so jobs never wait on each other and no locks are taken. A
+shard's sidecars are written first and the shard itself is moved into place
+once complete, so any shard which exists is whole and is never written to
+again.
+
+Checkers treat a tar and its shards as one archive. The shards are merged
+into the canonical tars, and their sidecars into those of the tars, which
+are then compacted, with
+    python campaign.py compact
+
+Main functions:
+  Enabled   -- Whether shard tars are turned on in the parameters
+  ShardFile -- Returns the path of the shard written for a tar
+  Shards    -- Returns the shards of a tar
+  Names     -- Returns the member names of a tar and its shards
+  Locate    -- Returns which of a tar and its shards holds a member
+  Compact   -- Merges the shards of a tar into the tar
+"""
+
+# standard library modules
+import os  # for path manipulation and removing merged shards
+
+# local modules
+from colarunscripts import archive, cfgSidecar, dirCache, journal, locking
+
+# Suffix of the directory holding the shards of a tar
+SUFFIX = ".shards"
+
+# Sidecars of a tar, as <tar><sidecar>, merged or removed along with it.
+# Shards written before cfgSidecar existed have the text ones.
+SIDECARS = cfgSidecar.SIDECARS + cfgSidecar.LEGACY
+
+
+def Enabled(parameters, *args, **kwargs):
+    """Returns whether shard tars are turned on in the parameters."""
+    return parameters["runValues"].get("shardTars", False) is True
+
+
+def ShardDir(tarPath, *args, **kwargs):
+    """Returns the directory holding the shards of a tar."""
+    return tarPath + SUFFIX + "/"
+
+
+def ShardFile(tarPath, shift, jobValues, *args, **kwargs):
+    """
+    Returns the path of the shard written for a tar by one call to CreateTar.
+
+    Arguments:
+    tarPath   -- str: Path to the canonical tar
+    shift     -- str: Shift of the cfuns going in the shard
+    jobValues -- dict: Dictionary of parameters relevant to this job
+    """
+
+    # Shards are in the same format as the tar
+    extension = os.path.splitext(tarPath)[1]
+    return (
+        ShardDir(tarPath)
+        + f'{jobValues["cfgID"]}_{jobValues["jobID"]}_sh{shift}{extension}'
+    )
+
+
+def Shards(tarPath, *args, **kwargs):
+    """
+    Returns the complete shards of a tar, in name order.
+
+    Uses the listings of dirCache, so most tars, which have no shard
+    directory, cost nothing beyond the listing of their own directory.
+
+    Arguments:
+    tarPath -- str: Path to the canonical tar
+    """
+
+    shardDir = ShardDir(tarPath)
+    if dirCache.IsDir(shardDir) is False:
+        return []
+    listing = dirCache.Listing(shardDir) or {}
+    extension = os.path.splitext(tarPath)[1]
+    return [shardDir + name for name in sorted(listing) if name.endswith(extension)]
+
+
+def Names(tarPath, *args, **kwargs):
+    """
+    Returns the names of the members of a tar and all its shards.
+
+    Arguments:
+    tarPath -- str: Path to the canonical tar
+
+    Returns:
+    names -- dict or set: Supports membership tests. The member index of the
+                          tar itself if it has no shards.
+    """
+
+    members = archive.Members(tarPath)
+    shardList = Shards(tarPath)
+    if len(shardList) == 0:
+        return members
+
+    names = set(members)
+    for shard in shardList:
+        names.update(archive.Members(shard))
+    return names
+
+
+def Locate(tarPath, member, *args, **kwargs):
+    """
+    Returns which of a tar and its shards holds a member.
+
+    Arguments:
+    tarPath -- str: Path to the canonical tar
+    member  -- str: Name of the member
+
+    Returns:
+    path -- str: The tar or shard to read the member from with archive.Read,
+                 or None if neither the tar nor its shards hold it
+    """
+
+    for path in [tarPath] + Shards(tarPath):
+        if member in archive.Members(path):
+            return path
+    return None
+
+
+def _RemoveShard(shard):
+    """Removes a merged shard along with its sidecars."""
+
+    for path in archive.Files(shard) + [shard + sidecar for sidecar in SIDECARS]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        dirCache.Removed(path)
+
+
+def Compact(tarPath, timeout=locking.TIMEOUT, lease=locking.LEASE, *args, **kwargs):
+    """
+    Merges the shards of a tar into the tar, along with their sidecars.
+
+    The sidecars of the tar are then compacted, which is also done for tars
+    without shards which have had IDs appended since they were last compacted.
+
+    The tar is locked while it is appended to, as other jobs may be appending
+    to it directly. Shards are only removed once the merged tar is verified
+    to hold the number of members expected and every member of the shards.
+    Merging again after an interruption duplicates members, which is
+    harmless as the last copy of a member is the one read.
+
+    Arguments:
+    tarPath -- str: Path to the canonical tar
+    timeout -- float: Seconds to wait for the lock on the tar
+    lease   -- float: Seconds after which other jobs may take the lock over
+
+    Returns:
+    merged -- tuple: (number of shards merged, number of members merged)
+    """
+
+    shardList = Shards(tarPath)
+    if len(shardList) == 0:
+        if cfgSidecar.Pending(tarPath) > 0:
+            with locking.Locked(tarPath, timeout, lease=lease):
+                cfgSidecar.Compact(tarPath)
+        return 0, 0
+
+    with locking.Locked(tarPath, timeout, lease=lease):
+        journal.Replay(tarPath)
+        # Shards are kept until the end, so only the tar is journaled
+        journal.Begin(tarPath, [], None, [])
+        before = archive.Count(tarPath)
+
+        shardNames = set()
+        added = 0
+        with archive.Appending(tarPath) as a:
+            for shard in shardList:
+                # Compressed members are copied as they are
+                for name, data, mtime, codec in archive.Iterate(shard):
+                    a.AddBytes(name, data, mtime, codec)
+                    shardNames.add(name)
+                    added += 1
+
+        # Checking against the tar itself, not just what was written
+        count, names = archive.Scan(tarPath)
+        if count != before + added or not shardNames <= names:
+            print(
+                f"{tarPath} has {count} members after merging, expected "
+                f"{before + added}. Keeping its shards"
+            )
+            return 0, 0
+        for path in archive.Files(tarPath):
+            dirCache.Added(path)
+        journal.Appended(tarPath)
+
+        for shard in shardList:
+            cfgSidecar.Migrate(shard)
+            members = {}
+            for cfgID, name in cfgSidecar.Members(shard):
+                members.setdefault(cfgID, []).append(name)
+            for cfgID in cfgSidecar.IDs(shard):
+                cfgSidecar.Append(tarPath, cfgID, members.get(cfgID, []))
+        cfgSidecar.Compact(tarPath)
+        for sidecar in cfgSidecar.SIDECARS:
+            dirCache.Added(tarPath + sidecar)
+
+        for shard in shardList:
+            _RemoveShard(shard)
+        journal.End(tarPath)
+
+    return len(shardList), added
@@ -29,7 +29,7 @@ swpsFat_lnk      -- int: Number of link smearing sweeps
 
 """
 
-from colarunscripts.utilities import VariablePrinter
+from colarunscripts.utilities import AtomicWrite, VariablePrinter
 
 
 def pt(filestub, logFile, sourceLocation, *args, **kwargs):
@@ -38,7 +38,7 @@ def pt(filestub, logFile, sourceLocation, *args, **kwargs):
     extension = ".qpsrc_pt"
 
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         for dim in sourceLocation:
             f.write(f"{dim}\n")
 
@@ -70,7 +70,7 @@ def sm(
     extension = ".qpsrc_sm"
 
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         for dim in sourceLocation:
             f.write(f"{dim}\n")
         f.write(f"{sweeps_smsrc}\n")
@@ -112,7 +112,7 @@ def lp(
     extension = ".qpsrc_lp"
 
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{lapmodefile}\n")
         f.write(f"{nDim_lpsrc}\n")
         f.write(f"{nModes_lpsrc}")
@@ -151,7 +151,7 @@ def xyz(
 
     smearcode = "xy"
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{smearcode}\n")
         for dim in sourceLocation:
             f.write(f"{dim}\n")
@@ -203,7 +203,7 @@ def lpsm(
     extension = ".qpsrc_lpsm"
 
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{lapmodefile}\n")
         f.write(f"{nDim_lpsrc}\n")
         f.write(f"{nModes_lpsrc}")
@@ -262,7 +262,7 @@ def lpxyz(
 
     smearcode = "z"
     # Writing to file
-    with open(filestub + extension, "w") as f:
+    with AtomicWrite(filestub + extension) as f:
         f.write(f"{smearcode}\n")
         f.write(f"{lapmodefile}\n")
         f.write(f"{nDim_lpsrc}\n")
@@ -25,6 +25,27 @@ import colarunscripts.parameters as params
 from colarunscripts.utilities import GetJobID, pp
 
 
+def ConfirmEmodeDeletion(parameters, inputArgs, values, *args, **kwargs):
+    """
+    Confirms the user wishes to delete permanently stored eigenmodes.
+
+    Only asks if tempStorage for eigenmodes and keepEmodes are both False,
+    and the check has not already been done or skipped.
+    """
+
+    if inputArgs["skipDeleteCheck"] is False:
+        # If tempstorage for eigenmodes is False and keepEmodes is False
+        # confirm the user wishes to delete permanently stored emodes
+        if values["keepEmodes"] is parameters["tempStorage"]["lapmodes"] is False:
+            print(
+                "WARNING: proceeding will result in the deletion of locally stored eigenmodes."
+            )
+            if input("Enter y to proceed: ") != "y":
+                print("exiting")
+                exit()
+            inputArgs["skipDeleteCheck"] = True
+
+
 def SubmitJobs(parameters, nthConfig, inputArgs, values, *args, **kwargs):
     """
     Submits jobs to the queue.
@@ -40,25 +61,16 @@ def SubmitJobs(parameters, nthConfig, inputArgs, values, *args, **kwargs):
     scheduler     -- str: The scheduler of the system (eg. slurm,pbs,etc.)
     doArrayJobs   -- bool: Whether to do jobs in arrays or not
     keepEmodes    -- bool: Whether to delete eigenmodes each run
-    submitmissing -- bool: Whether we are submitting only the subset of
-                           missing correlation functions
     testing       -- str: what type of testing submission to do
+
+    To submit only the configurations missing correlation functions, see
+    SubmitMissing.
     """
 
     # Getting the directory for the runscripts
     directory = dirs.FullDirectories(parameters, directory="script")["script"]
 
-    if inputArgs["skipDeleteCheck"] is False:
-        # If tempstorage for eigenmodes is False and keepEmodes is False
-        # confirm the user wishes to delete permanently stored emodes
-        if values["keepEmodes"] is parameters["tempStorage"]["lapmodes"] is False:
-            print(
-                "WARNING: proceeding will result in the deletion of locally stored eigenmodes."
-            )
-            if input("Enter y to proceed: ") != "y":
-                print("exiting")
-                exit()
-            inputArgs["skipDeleteCheck"] = True
+    ConfirmEmodeDeletion(parameters, inputArgs, values)
 
     # Looping over parameters to submit as separate jobs
     for kappa in values["kappaValues"]:
@@ -104,7 +116,111 @@ def SubmitJobs(parameters, nthConfig, inputArgs, values, *args, **kwargs):
         )
 
 
-def ScheduleJobs(filename, scheduler, doArrayJobs, ncon, inputArgs):
+def SubmitMissing(parameters, inputArgs, values, *args, **kwargs):
+    """
+    Submits the configurations listed by findMissing.py.
+
+    Each kappa value is submitted as a single array job covering exactly
+    the missing configurations. The jobs do not submit further jobs.
+
+    slurm takes the list of configurations directly. PBS arrays must be a
+    single range, so the runscript instead looks its configuration up in
+    an index file, one configuration per line.
+
+    Arguments:
+    inputArgs -- dict: Command line input. from_missing is the output file
+                       of findMissing.py.
+    values    -- dict: The runValues from parameters.yml
+    """
+
+    # Getting the directory for the runscripts
+    directory = dirs.FullDirectories(parameters, directory="script")["script"]
+
+    ConfirmEmodeDeletion(parameters, inputArgs, values)
+
+    missing = ReadMissing(inputArgs["from_missing"])
+    for kappa, indices in missing.items():
+
+        print()
+        print("kappa: ", kappa)
+        if kappa not in values["kappaValues"]:
+            print(f"{kappa=} is not in kappaValues in the parameters file, skipping")
+            continue
+        if len(indices) == 0:
+            print("No missing configurations")
+            continue
+        arrayRange = cfg.FormatRanges(indices)
+        print("configurations: ", arrayRange)
+
+        # Compiling the runscript filename
+        filename = f'{directory}{values["runPrefix"]}{kappa}missing'
+
+        # Making the runscript
+        scriptArgs = {**inputArgs, "simjobs": 1, "nconfigurations": 0}
+        if values["scheduler"] == "slurm":
+            MakeSlurmRunscript(parameters, filename, kappa, True, **scriptArgs)
+        elif values["scheduler"] == "PBS":
+            if len(indices) == 1:
+                # Not an array, stopping it from submitting the next config
+                # by making this config the last
+                arrayRange = None
+                scriptArgs["nconfigurations"] = indices[0]
+                MakePBSRunscript(
+                    parameters,
+                    filename,
+                    kappa,
+                    False,
+                    nthConfig=indices[0],
+                    **scriptArgs,
+                )
+            else:
+                indexFile = filename + ".indices"
+                with open(indexFile, "w") as f:
+                    f.write("\n".join(str(index) for index in indices) + "\n")
+                arrayRange = f"1-{len(indices)}"
+                MakePBSRunscript(
+                    parameters, filename, kappa, True, indexFile=indexFile, **scriptArgs
+                )
+        else:
+            raise ValueError("Unknown scheduler specified")
+        subprocess.run(["chmod", "+x", filename])  # executable permission
+
+        # Scheduling the jobs
+        ScheduleJobs(
+            filename,
+            values["scheduler"],
+            arrayRange is not None,
+            len(indices),
+            inputArgs,
+            arrayRange,
+        )
+
+
+def ReadMissing(filename, *args, **kwargs):
+    """
+    Reads the output file of findMissing.py.
+
+    Each line is a kappa value and the ranges of missing configurations,
+    ie. 13770: 3-7,12,40-55
+
+    Arguments:
+    filename -- str: The file to read
+
+    Returns:
+    missing -- dict: kappa to list of missing configuration numbers
+    """
+
+    missing = {}
+    with open(filename, "r") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            kappa, _, ranges = line.partition(":")
+            missing[int(kappa)] = cfg.ParseRanges(ranges)
+    return missing
+
+
+def ScheduleJobs(filename, scheduler, doArrayJobs, ncon, inputArgs, arrayRange=None):
 
     command = []
     capture_output = True
@@ -127,9 +243,10 @@ def ScheduleJobs(filename, scheduler, doArrayJobs, ncon, inputArgs):
         command.append("-I")
         capture_output = False
     elif doArrayJobs is True:
-        formattedList = f"1-{ncon}"  # Job ids for array jobs
+        # Job ids for array jobs
+        formattedList = f"1-{ncon}" if arrayRange is None else arrayRange
         if scheduler == "PBS":
-            command.append("-J ")
+            command.append("-J")
             command.append(f"{formattedList}")
         elif scheduler == "slurm":
             command.append(f"--array={formattedList}")
@@ -242,6 +359,7 @@ def MakePBSRunscript(
     simjobs=1,
     nconfigurations=0,
     testing=None,
+    indexFile=None,
     *args,
     **kwargs,
 ):
@@ -252,11 +370,14 @@ def MakePBSRunscript(
     which manages the rest of the job.
 
     Arguments:
-    filename -- str: the name of the file to make
-    kappa    -- int: kappa value of the particular job
-    kd       -- int: field strength of the particular job
-    shift    -- str: lattice shift of the particular job
-    testing  -- str: type of test submission
+    filename  -- str: the name of the file to make
+    kappa     -- int: kappa value of the particular job
+    kd        -- int: field strength of the particular job
+    shift     -- str: lattice shift of the particular job
+    testing   -- str: type of test submission
+    indexFile -- str: For array jobs, file holding the configuration of each
+                      array index, one per line. Default is the array index
+                      itself.
 
     """
 
@@ -294,7 +415,12 @@ def MakePBSRunscript(
     if doArrayJobs is False:
         text = text.replace("NTHCONFIG", str(nthConfig))
     else:
-        text = text.replace("NTHCONFIG", "$PBS_ARRAY_INDEX")
+        if indexFile is None:
+            text = text.replace("NTHCONFIG", "$PBS_ARRAY_INDEX")
+        else:
+            text = text.replace(
+                "NTHCONFIG", f'$(sed -n "${{PBS_ARRAY_INDEX}}p" {indexFile})'
+            )
     text = text.replace("NUMJOBS", str(simjobs))
     text = text.replace("NCON", str(nconfigurations))
     text = text.replace("TESTING", str(testing))
@@ -309,4 +435,7 @@ def main(nthConfig, inputArgs):
 
     parametersFile = inputArgs["parametersfile"]
     parameters = params.Load(parametersFile=parametersFile)
-    SubmitJobs(parameters, nthConfig, inputArgs, parameters["runValues"])
+    if inputArgs.get("from_missing") is not None:
+        SubmitMissing(parameters, inputArgs, parameters["runValues"])
+    else:
+        SubmitJobs(parameters, nthConfig, inputArgs, parameters["runValues"])
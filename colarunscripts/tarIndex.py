@@ -0,0 +1,474 @@
+"""
+Module for managing the member index sidecars of the correlation function tars.
+
+Each tar has a <tar>index file next to it (alongside the <tar>cfgids and
+<tar>members files) which records the size and modification time of the tar when
+it was indexed, along with the name, data offset and size of every member.
+Members stored compressed (see archive.py) also have their codec recorded,
+which is kept in the member's PAX header so the index can be rebuilt.
+Membership tests can then be answered without reading through the tar itself.
+
+The index also records where the member data ends, which is where the end of
+archive blocks start, and the number of members. Appending seeks straight
+there rather than reading every header in the tar as tarfile's append mode
+does, so appends take the same time however large the tar has grown.
+
+The sidecar is a fixed size JSON header, padded with spaces to HEADER bytes,
+followed by one JSON record [name, offset_data, size(, codec)] per line. The
+header holds the size, mtime, end and count above and the length of the
+sidecar up to the last record. Appends write their records from there and
+then the header in place, so they neither read nor rewrite the records of
+earlier members. Anything past the recorded length, ie. from an append cut
+short, is ignored and overwritten by the next append.
+
+Main functions:
+  Members    -- Returns the dictionary of members of a tar. Uses the sidecar,
+                rebuilding it if it no longer matches the tar
+  Appending  -- Context manager appending to a tar from its recorded end
+  AddMember  -- Adds a file to an open tar, keeping track of its data offset
+  CopyMember -- Copies a member of another tar into an open tar, likewise
+  WriteIndex -- Writes the sidecar from a list of TarInfo objects
+"""
+
+# standard library modules
+import contextlib  # for the appending context manager
+import copy  # for copying members between tars
+import json  # sidecar format
+import os  # for stat and atomic replacement
+import tarfile  # for rebuilding the index from the tar
+
+# local modules
+from colarunscripts.utilities import AtomicWrite
+
+# PAX header recording the codec of a compressed member
+CODEC = "COLA.codec"
+
+# Size in bytes of the sidecar header and the fields it holds
+HEADER = 256
+HEADERKEYS = ("size", "mtime", "end", "count", "length")
+
+# Indices already read by this process. Keyed by tar path, values are
+# (size, mtime, members) so repeat lookups do not even re-read the sidecar.
+_cache = {}
+
+
+def IndexFile(tarPath, *args, **kwargs):
+    """
+    Returns the path of the index sidecar for a tar.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    """
+    return tarPath + "index"
+
+
+def Members(tarPath, *args, **kwargs):
+    """
+    Returns the members of a tar as a dictionary.
+
+    Keys are the member names, values are [offset_data, size] of the member,
+    followed by its codec if it is compressed.
+    Missing tars have no members. If the sidecar is missing or its recorded
+    size or mtime do not match the tar, the index is rebuilt from the tar.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    """
+
+    try:
+        stat = os.stat(tarPath)
+    except FileNotFoundError:
+        _cache.pop(tarPath, None)
+        return {}
+
+    # Already read this index and the tar has not changed since
+    cached = _cache.get(tarPath)
+    if cached is not None and cached[0:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    index = ReadIndex(tarPath)
+    if index is None or (index["size"], index["mtime"]) != (
+        stat.st_size,
+        stat.st_mtime_ns,
+    ):
+        print(f"Rebuilding member index for {tarPath}")
+        index = RebuildIndex(tarPath)
+
+    _cache[tarPath] = (index["size"], index["mtime"], index["members"])
+    return index["members"]
+
+
+def ReadIndex(tarPath, *args, **kwargs):
+    """
+    Reads the index sidecar of a tar. Returns None if it cannot be read.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    """
+
+    try:
+        with open(IndexFile(tarPath), "rb") as f:
+            index = _ReadHeader(f)
+            if index is None:
+                return None
+            data = f.read(index["length"] - HEADER)
+        records = json.loads(b"[" + b",".join(data.splitlines()) + b"]")
+        index["members"] = {record[0]: record[1:] for record in records}
+    except (FileNotFoundError, ValueError, IndexError, TypeError):
+        return None
+    return index
+
+
+def ReadHeader(tarPath, *args, **kwargs):
+    """
+    Reads the header of the index sidecar of a tar, ie. the index without
+    its members. Returns None if it cannot be read.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    """
+
+    try:
+        with open(IndexFile(tarPath), "rb") as f:
+            return _ReadHeader(f)
+    except FileNotFoundError:
+        return None
+
+
+def _ReadHeader(f):
+    """
+    Reads the header of an open index sidecar, leaving f at the first record.
+
+    Returns None if the header cannot be read or the sidecar is shorter than
+    the length it records.
+    """
+
+    try:
+        header = json.loads(f.read(HEADER))
+        if (
+            isinstance(header, dict) is False
+            or set(header) != set(HEADERKEYS)
+            or header["length"] < HEADER
+            or os.fstat(f.fileno()).st_size < header["length"]
+        ):
+            return None
+    except (ValueError, TypeError):
+        return None
+    return header
+
+
+def RebuildIndex(tarPath, *args, **kwargs):
+    """
+    Rebuilds the index sidecar of a tar by reading through the full tar.
+
+    A last member cut short, ie. by a job killed while appending, is left
+    out so that the next append overwrites it. The sidecar is only written if
+    the tar did not change while it was read, ie. by an unlocked reader
+    racing an append. Otherwise the index read is returned without saving it.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    index -- dict: The index, as written by WriteIndex
+    """
+
+    stat = os.stat(tarPath)
+    memberList = []
+    with tarfile.open(tarPath, "r") as t:
+        try:
+            for member in t:
+                memberList.append(member)
+        except tarfile.ReadError:
+            # Cut short in the middle of the data of the last member
+            pass
+    after = os.stat(tarPath)
+    while len(memberList) > 0 and _DataEnd(memberList[-1]) > after.st_size:
+        memberList.pop()
+
+    if (after.st_size, after.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        members, end = _Members(memberList)
+        return _Index(stat, members, end, len(memberList))
+    return WriteIndex(tarPath, memberList, stat)
+
+
+def _DataEnd(member):
+    """Returns the offset just past the padded data of a member."""
+
+    # Data is padded out to a whole number of blocks after the header(s)
+    blocks, remainder = divmod(member.size, tarfile.BLOCKSIZE)
+    return member.offset_data + (blocks + (remainder > 0)) * tarfile.BLOCKSIZE
+
+
+def _EndValid(tarPath, index, size):
+    """
+    Returns whether the end of data recorded in an index is believable.
+
+    The end of archive blocks must be there, ie. at least two zero blocks.
+    """
+
+    end = index.get("end")
+    if end is None or end + 2 * tarfile.BLOCKSIZE > size:
+        return False
+    with open(tarPath, "rb") as f:
+        f.seek(end)
+        return f.read(2 * tarfile.BLOCKSIZE).count(0) == 2 * tarfile.BLOCKSIZE
+
+
+def CurrentHeader(tarPath, *args, **kwargs):
+    """
+    Returns the index header of a tar, checked against the tar to append to it.
+
+    The sidecar is only trusted if the tar's size and mtime match it and the
+    end of archive blocks are where it says. Otherwise the index is rebuilt
+    by reading through the full tar. The members are not read.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Returns:
+    header -- dict: The header of the index, with the fields in HEADERKEYS.
+                    None if there is no tar.
+    """
+
+    try:
+        stat = os.stat(tarPath)
+    except FileNotFoundError:
+        return None
+
+    header = ReadHeader(tarPath)
+    if (
+        header is None
+        or (header["size"], header["mtime"]) != (stat.st_size, stat.st_mtime_ns)
+        or _EndValid(tarPath, header, stat.st_size) is False
+    ):
+        print(f"Rebuilding member index for {tarPath}")
+        header = RebuildIndex(tarPath)
+    return {key: header.get(key) for key in HEADERKEYS}
+
+
+@contextlib.contextmanager
+def Appending(tarPath, *args, **kwargs):
+    """
+    Opens a tar to append members to, from the end recorded in its index.
+
+    Members must be added with AddMember or CopyMember. On leaving the with
+    block the end of archive blocks are written, the tar is synced to disk
+    and the records of the new members appended to its index. The tar is
+    created if it does not exist.
+    Appending is not safe against other processes, so the tar must be
+    locked (see locking.py) if others may write to it.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+
+    Yields:
+    t -- TarFile: The tar, open for writing from the end of its data
+    """
+
+    header = CurrentHeader(tarPath)
+    if header is None:
+        header = {key: 0 for key in HEADERKEYS}
+
+    with open(tarPath, "r+b" if os.path.exists(tarPath) else "wb") as f:
+        f.seek(header["end"])
+        with tarfile.open(fileobj=f, mode="w") as t:
+            yield t
+            end = t.offset
+            memberList = t.members
+        # End of archive blocks are written on closing, then the tar cut there
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+    _AppendIndex(tarPath, header, memberList, end)
+
+
+def _AppendIndex(tarPath, header, memberList, end):
+    """
+    Appends the records of members just added to a tar to its index.
+
+    The records are written from the length in the header and the header
+    then rewritten in place. If the sidecar no longer has the header the
+    append started from, ie. an unlocked reader rebuilt it meanwhile, or the
+    tar is new, the whole sidecar is written instead.
+
+    Arguments:
+    tarPath    -- str: Path to the tar
+    header     -- dict: Header of the index the append started from
+    memberList -- list: List of TarInfo objects of the members added
+    end        -- int: Offset of the end of archive blocks after the append
+    """
+
+    stat = os.stat(tarPath)
+    added = {member.name: _Entry(member) for member in memberList}
+    count = header["count"] + len(memberList)
+
+    # Keep the members read by this process if they were of the tar appended to
+    cached = _cache.pop(tarPath, None)
+    if cached is not None and cached[0:2] == (header["size"], header["mtime"]):
+        _cache[tarPath] = (stat.st_size, stat.st_mtime_ns, {**cached[2], **added})
+
+    if header["count"] == 0:
+        _WriteIndex(tarPath, added, end, count, stat)
+        return
+
+    try:
+        f = open(IndexFile(tarPath), "r+b")
+    except FileNotFoundError:
+        f = None
+    if f is None or _ReadHeader(f) != header:
+        if f is not None:
+            f.close()
+        _cache.pop(tarPath, None)
+        RebuildIndex(tarPath)
+        return
+
+    with f:
+        f.seek(header["length"])
+        for member in memberList:
+            f.write(_Record(member.name, _Entry(member)))
+        f.truncate()
+        length = f.tell()
+        f.seek(0)
+        f.write(_HeaderBytes(_Index(stat, None, end, count, length)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def AddMember(t, name, arcname, *args, **kwargs):
+    """
+    Adds a file to an open tar, recording where its data is stored.
+
+    tarfile only sets the offsets of members it reads, not members it adds,
+    so they are filled in here for the index.
+
+    Arguments:
+    t       -- TarFile: The open tar, in write or append mode
+    name    -- str: Path of the file to add
+    arcname -- str: Name of the file inside the tar
+    """
+
+    start = t.offset
+    t.add(name, arcname=arcname)
+    _SetOffsets(t, start)
+
+
+def CopyMember(t, member, fileObject, *args, **kwargs):
+    """
+    Copies a member of another tar into an open tar, as AddMember.
+
+    Arguments:
+    t          -- TarFile: The open tar, in write or append mode
+    member     -- TarInfo: The member, from the tar it is copied from
+    fileObject -- file: The member's data, ie. from extractfile
+    """
+
+    start = t.offset
+    t.addfile(copy.copy(member), fileObject)
+    _SetOffsets(t, start)
+
+
+def _SetOffsets(t, start):
+    """Records the offsets of the member just added at start."""
+
+    member = t.members[-1]
+    # Data is padded out to a whole number of blocks after the header(s)
+    blocks, remainder = divmod(member.size, tarfile.BLOCKSIZE)
+    paddedSize = (blocks + (remainder > 0)) * tarfile.BLOCKSIZE
+    member.offset = start
+    member.offset_data = t.offset - paddedSize
+
+
+def _Entry(member):
+    """Returns the index entry of a member."""
+
+    codec = member.pax_headers.get(CODEC)
+    if codec is None:
+        return [member.offset_data, member.size]
+    return [member.offset_data, member.size, codec]
+
+
+def WriteIndex(tarPath, memberList, stat=None, *args, **kwargs):
+    """
+    Writes the index sidecar for a tar and returns the index written.
+
+    The tar must be closed before calling so that the recorded size and mtime
+    are final.
+
+    Arguments:
+    tarPath    -- str: Path to the tar
+    memberList -- list: List of TarInfo objects of all members of the tar
+    stat       -- os.stat_result: Stat of the tar the members were read from.
+                                  Stat now if None.
+    """
+
+    members, end = _Members(memberList)
+    return _WriteIndex(tarPath, members, end, len(memberList), stat)
+
+
+def _Members(memberList):
+    """Returns the members entry and end of data for a list of TarInfo."""
+
+    members = {member.name: _Entry(member) for member in memberList}
+    end = max((_DataEnd(member) for member in memberList), default=0)
+    return members, end
+
+
+def _Index(stat, members, end, count, length=None):
+    """Returns the index of a tar with the given stat, without members if None."""
+
+    index = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "end": end,
+        "count": count,
+        "length": length,
+    }
+    if members is not None:
+        index["members"] = members
+    return index
+
+
+def _Record(name, entry):
+    """Returns the sidecar line recording a member."""
+
+    return json.dumps([name, *entry]).encode() + b"\n"
+
+
+def _HeaderBytes(index):
+    """Returns the sidecar header of an index, padded out to HEADER bytes."""
+
+    header = json.dumps({key: index[key] for key in HEADERKEYS}).encode()
+    if len(header) >= HEADER:
+        raise ValueError(f"Index header longer than {HEADER} bytes: {header}")
+    return header.ljust(HEADER - 1) + b"\n"
+
+
+def _WriteIndex(tarPath, members, end, count, stat=None):
+    """
+    Writes the index sidecar for a tar and returns the index written.
+
+    The sidecar is written to a temporary file and moved into place so
+    readers never see a partial index.
+
+    Arguments:
+    tarPath -- str: Path to the tar
+    members -- dict: Member name to [offset_data, size(, codec)]
+    end     -- int: Offset of the end of archive blocks
+    count   -- int: Number of members, including any with repeated names
+    stat    -- os.stat_result: Stat of the tar the index is of. Stat now if
+                               None.
+    """
+
+    if stat is None:
+        stat = os.stat(tarPath)
+    records = b"".join(_Record(name, entry) for name, entry in members.items())
+    index = _Index(stat, members, end, count, HEADER + len(records))
+
+    with AtomicWrite(IndexFile(tarPath), "wb") as f:
+        f.write(_HeaderBytes(index))
+        f.write(records)
+
+    _cache[tarPath] = (index["size"], index["mtime"], index["members"])
+    return index
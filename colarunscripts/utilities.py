@@ -1,4 +1,5 @@
 # Standard library modules
+import contextlib
 import os
 import pprint
 import re
@@ -31,6 +32,37 @@ def WriteListLengthnList(fileObject, listToWrite, label=None):
         fileObject.write(f"{element}\n")
 
 
+@contextlib.contextmanager
+def AtomicWrite(filename, mode="w", *args, **kwargs):
+    """
+    Opens a file to write in full, moving it into place once complete.
+
+    The contents are written to a temporary file next to filename, synced to
+    disk and renamed over filename on leaving the with block, so a job
+    killed while writing leaves either the old file or the new one, never a
+    partial file. The temporary file is removed if the block raises.
+
+    Arguments:
+    filename -- str: The file to write
+    mode     -- str: w for text or wb for bytes
+
+    Yields:
+    f -- fileObject: The temporary file, open for writing
+    """
+
+    tempFile = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tempFile, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempFile, filename)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tempFile)
+        raise
+
+
 def PrintDictToFile(filename, dictionary, order=None):
     """
     Prints the values of dictionary to a file, 1 value per line
@@ -50,7 +82,7 @@ def PrintDictToFile(filename, dictionary, order=None):
     if order is None:
         order = dictionary.keys()
 
-    with open(filename, "w") as f:
+    with AtomicWrite(filename) as f:
         for key in order:
             f.write(str(dictionary[key]) + "\n")
 
@@ -115,6 +147,18 @@ def GetJobID(environmentVariables):
         return "1"
 
 
+def IsArrayJob(environmentVariables):
+    """
+    Returns whether the job is one element of a scheduler array job.
+
+    Arguments:
+    environmentVariables -- dict: The environment, ie. os.environ
+    """
+
+    arrayLabels = ["SLURM_ARRAY_TASK_ID", "PBS_ARRAY_INDEX"]
+    return any(label in environmentVariables for label in arrayLabels)
+
+
 def pp(toPrint, indent=4, stream=None):
     """
     Pretty printer, great for dictionaries.
@@ -1,105 +1,159 @@
 import argparse
-import re
+import collections
+import concurrent.futures
+import time
 
-from colarunscripts import configIDs, particles
-from colarunscripts.makeCfun import GetTarFile
-from colarunscripts.manageJob import CfunsExist
+import numpy as np
+
+from colarunscripts import cfgSidecar, cfglistState, checkCfuns, configIDs, shards
 from colarunscripts.parameters import Load
 
 
+def CheckConfig(parameters: dict, jobValues: dict, *args, **kwargs):
+    """
+    Returns the number of missing correlation functions for one config.
+
+    Module level so that it can be run in worker processes.
+    """
+    return len(checkCfuns.MissingCfuns(parameters, jobValues))
+
+
+def CheckConfigs(parameters: dict, jobValueList: list, jobs: int = 1, *args, **kwargs):
+    """
+    Checks a list of configs, yielding the number missing for each in order.
+
+    With more than one job, configs are spread across a process pool. Only a
+    small window of configs is in flight at once, so memory use does not
+    grow with the size of the ensemble.
+
+    Arguments:
+    parameters   -- dict: Dictionary of all parameters from yml
+    jobValueList -- iterable: jobValues for each config to check
+    jobs         -- int: Number of processes to use
+    """
+
+    if jobs <= 1:
+        for jobValues in jobValueList:
+            yield CheckConfig(parameters, jobValues)
+        return
+
+    window = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        for jobValues in jobValueList:
+            window.append(executor.submit(CheckConfig, parameters, jobValues))
+            # Results are handed back in order, waiting on the oldest first
+            if len(window) >= 2 * jobs:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def WriteMissing(fileObject, kappa: int, missingIndices: list, *args, **kwargs):
+    """
+    Writes the missing configs of a kappa value as ranges, eg 12400: 3-7,12
+
+    The ranges can be submitted as a single array job with
+    submit.py --from-missing.
+
+    Arguments:
+    fileObject     -- fileObject: The output file
+    kappa          -- int: The kappa value
+    missingIndices -- int list: The (1-based) numbers of the missing configs
+    """
+    fileObject.write(f"{kappa}: {configIDs.FormatRanges(missingIndices)}\n")
+    fileObject.flush()
+
+
 def FullCheck(inputArgs: dict, *args, **kwargs):
 
     parameters = Load(inputArgs["parametersfile"])
     jobValues = parameters["runValues"]
-    for kappa in jobValues["kappaValues"]:
-        jobValues["kappa"] = kappa
-
-        start, ncon = configIDs.ConfigDetails(kappa, jobValues["runPrefix"])
-        print(start, ncon)
-        cfgIDs = [
-            configIDs.ConfigID(i, jobValues["runPrefix"], start)
-            for i in range(1, ncon + 1)
-        ]
-        print("Checking IDs")
-        missingList = []
-        for ID in cfgIDs:
-            jobValues["cfgID"] = ID
-            if CfunsExist(parameters, jobValues) is True:
-                print(f"Correlation functions exist for {ID}")
-            else:
-                print(f"Correlations functions missing for {ID}")
-                missingList.append(ID)
-
-        with open(inputArgs["outputfile"], "w") as f:
-            for i, ID in enumerate(cfgIDs):
-                if ID in missingList:
-                    f.write(f"{ID} {i+1}\n")
-
-        print('output file is {inputArgs["outputfile"]}')
+    jobs = inputArgs["jobs"]
+
+    with open(inputArgs["outputfile"], "w") as f:
+        for kappa in jobValues["kappaValues"]:
+            jobValues["kappa"] = kappa
+
+            start, ncon = configIDs.ConfigDetails(kappa, jobValues["runPrefix"])
+            print(start, ncon)
+            cfgIDs = [
+                configIDs.ConfigID(i, jobValues["runPrefix"], start)
+                for i in range(1, ncon + 1)
+            ]
+            print(f"Checking IDs using {jobs} processes")
+            jobValueList = ({**jobValues, "cfgID": ID} for ID in cfgIDs)
+
+            startTime = time.perf_counter()
+            missingIndices = []
+            results = CheckConfigs(parameters, jobValueList, jobs)
+            for i, (ID, numMissing) in enumerate(zip(cfgIDs, results)):
+                if numMissing == 0:
+                    print(f"Correlation functions exist for {ID}")
+                else:
+                    print(f"{numMissing} correlations functions missing for {ID}")
+                    missingIndices.append(i + 1)
+
+                elapsed = time.perf_counter() - startTime
+                print(
+                    f"Progress: {i+1}/{ncon} configs checked, "
+                    f"{len(missingIndices)} incomplete, "
+                    f"{(i+1)/elapsed:.2f} configs/s"
+                )
+
+            # Written per kappa so earlier kappas survive interruption
+            WriteMissing(f, kappa, missingIndices)
+
+    print(f'output file is {inputArgs["outputfile"]}')
 
 
 def QuickCheck(inputArgs: dict, *args, **kwargs):
 
     parameters = Load(inputArgs["parametersfile"])
     jobValues = parameters["runValues"]
-    for kappa in jobValues["kappaValues"]:
-        jobValues["kappa"] = kappa
-
-        start, ncon = configIDs.ConfigDetails(kappa, jobValues["runPrefix"])
-        jobValues["cfgID"] = configIDs.ConfigID(1, jobValues["runPrefix"], start)
-
-        haveIDs = set(f'-{jobValues["runPrefix"]}-00{start+10*i}' for i in range(ncon))
-        print("Checking IDs")
-        for kd in jobValues["kds"]:
-            for structure in jobValues["structureList"]:
-                for sinkType in jobValues["sinkTypes"]:
-                    tarPath, _ = GetTarFile(
-                        parameters,
-                        kd,
-                        jobValues["shifts"][0],
-                        sinkType,
-                        jobValues,
-                        structure,
-                    )
-                    for chi, chibar in jobValues["particleList"]:
-                        if kd == 0:
-                            fields = particles.CheckForVanishingFields(
-                                kd, chi=chi, chibar=chibar
-                            )
-                            if len(fields) == 0:
-                                continue
-
-                        cfgFileList = (
-                            tarPath.replace("CHICHIBAR", f"{chi}{chibar}") + "cfglist"
-                        )
-                        with open(cfgFileList, "r") as f:
-                            cfgList = f.read().splitlines()
-                        haveIDs = haveIDs.intersection(cfgList)
-                        if len(set(cfgList)) < 200:
-                            print(cfgFileList)
-
-    fullList = [f'-{jobValues["runPrefix"]}-00{start+10*i}' for i in range(ncon)]
-    allIDs = set(fullList)
-    missingIDs = allIDs - haveIDs
-
-    sortedIDs = sorted_nicely(list(missingIDs))
-    with open(inputArgs["outputfile"], "w") as f:
-        for i, ID in enumerate(fullList):
-            if ID in sortedIDs:
-                f.write(f"{ID} {i+1}\n")
+    state = cfglistState.LoadState(inputArgs["statefile"])
 
-    print(f"Number of missing configs is {len(missingIDs)}")
+    numMissingConfigs = 0
+    with open(inputArgs["outputfile"], "w") as f:
+        for kappa in jobValues["kappaValues"]:
+            jobValues["kappa"] = kappa
+
+            start, ncon = configIDs.ConfigDetails(kappa, jobValues["runPrefix"])
+            fullList = [
+                configIDs.ConfigID(i, jobValues["runPrefix"], start)
+                for i in range(1, ncon + 1)
+            ]
+            jobValues["cfgID"] = fullList[0]
+
+            # Tar paths do not depend on the config, so any config will do
+            tarList = {
+                tar for _, _, tar, _ in checkCfuns.ExpectedCfuns(parameters, jobValues)
+            }
+
+            print("Checking IDs")
+            haveAll = np.ones(ncon, dtype=bool)
+            for tar in sorted(tarList):
+                # Shards of the tar count as part of it
+                have = np.zeros(ncon, dtype=bool)
+                for path in [tar] + shards.Shards(tar):
+                    have |= cfgSidecar.Have(path, fullList)
+                    # Text cfglists of tars not yet migrated
+                    cfgList = cfglistState.ReadIDs(path + "cfglist", state)
+                    if len(cfgList) > 0:
+                        have |= np.isin(fullList, list(cfgList))
+                haveAll &= have
+                if have.sum() < ncon:
+                    print(f"{tar} has {have.sum()}/{ncon} configs")
+
+            missingIndices = [int(i) + 1 for i in np.flatnonzero(~haveAll)]
+            WriteMissing(f, kappa, missingIndices)
+            numMissingConfigs += len(missingIndices)
+
+    cfglistState.SaveState(inputArgs["statefile"], state)
+
+    print(f"Number of missing configs is {numMissingConfigs}")
     print(f'output file is {inputArgs["outputfile"]}')
 
 
-# From https://stackoverflow.com/questions/2669059/how-to-sort-alpha-numeric-set-in-python
-def sorted_nicely(l):
-    """Sort the given iterable in the way that humans expect."""
-    convert = lambda text: int(text) if text.isdigit() else text
-    alphanum_key = lambda key: [convert(c) for c in re.split("([0-9]+)", key)]
-    return sorted(l, key=alphanum_key)
-
-
 def Input():
 
     # Setting up the parser
@@ -112,6 +166,13 @@ def Input():
         help="Whether to fully check for file existence or to just check id list",
         action="store_true",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of processes to use for the full check. Default is 1.",
+        default=1,
+        type=int,
+    )
     parser.add_argument(
         "-p",
         "--parametersfile",
@@ -124,6 +185,13 @@ def Input():
         help="The output file to write to. Default is ./missingCfuns.txt.",
         default="./missingCfuns.txt",
     )
+    parser.add_argument(
+        "-s",
+        "--statefile",
+        help="The cache of text cfglist contents used by the quick check. "
+        + "Default is ./quickCheckState.json.",
+        default="./quickCheckState.json",
+    )
 
     # Parsing the arguments from the command line
     args = parser.parse_args()
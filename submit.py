@@ -52,6 +52,11 @@ def Input():
         default=0,
         type=int,
     )
+    parser.add_argument(
+        "-m",
+        "--from-missing",
+        help="Submit exactly the configurations listed in this output file of findMissing.py, as one array job per kappa value.",
+    )
     parser.add_argument(
         "-t",
         "--testing",
@@ -84,6 +89,11 @@ if __name__ == "__main__":
     if inputArgs["nconfigurations"] != 0:
         inputArgs["nconfigurations"] = inputArgs["nconfigurations"] + (firstConfig - 1)
 
+    # The missing configurations are all submitted at once
+    if inputArgs["from_missing"] is not None:
+        main(firstConfig, inputArgs)
+        exit()
+
     # Looping through jobs to run simultaneously
     for ithJob in range(simJobs):
         nthConfig = ithJob + firstConfig